@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Times writing a large output with --template-newline and --output-newline.
+
+Compares the bulk translation that _WriteToFile() and _WriteToBuffer() do with
+the original line by line StringIO copies, for each combination of newlines.
+
+Usage: python -m scripts.benchmarks.newlines
+"""
+
+import io
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional, TextIO
+
+from snipinator.cli import _WriteToBuffer, _WriteToFile
+
+_SIZE_MB = 16
+_LINE = 'A line of the rendered output, with `code` and some more words.\n'
+_NEWLINES = {'lf': '\n', 'crlf': '\r\n', 'cr': '\r'}
+
+
+def _Time(fn: Callable[[], None]) -> float:
+  times = []
+  for _ in range(3):
+    start = time.perf_counter()
+    fn()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+
+def _ReferenceWriteToBuffer(rendered: str, template_newline: Optional[str],
+                            output_newline: Optional[str], buffer_io: BinaryIO):
+  """The original, line by line, _WriteToBuffer()."""
+  with io.StringIO(rendered, newline=template_newline) as rendered_io:
+    with io.StringIO(newline=output_newline) as output_io:
+      for line in rendered_io:
+        output_io.write(line)
+      buffer_io.write(output_io.getvalue().encode())
+
+
+def _ReferenceWriteToFile(rendered: str, template_newline: Optional[str],
+                          output_io: TextIO):
+  """The original, line by line, _WriteToFile()."""
+  with io.StringIO(rendered, newline=template_newline) as rendered_io:
+    for line in rendered_io:
+      output_io.write(line)
+
+
+def _ReferenceFile(path: Path, rendered: str, template_newline: Optional[str],
+                   output_newline: Optional[str]) -> None:
+  with path.open('w', encoding=None, newline=output_newline) as f:
+    _ReferenceWriteToFile(rendered, template_newline, f)
+
+
+def _BulkFile(path: Path, rendered: str, template_newline: Optional[str],
+              output_newline: Optional[str]) -> None:
+  # Same as _CreateOutputFile().
+  with path.open('w', encoding=None, newline=output_newline) as f:
+    _WriteToFile(rendered, template_newline, f)
+
+
+def main() -> None:
+  rendered = _LINE * int(_SIZE_MB * 1024 * 1024 / len(_LINE))
+  print(f'{_SIZE_MB}MB output')
+  print(f'{"template":>8} {"output":>6} {"dest":>6} {"reference":>10}'
+        f' {"bulk":>10} {"speedup":>8}')
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    path = Path(tmp_dir) / 'output'
+    for template_name, template_newline in _NEWLINES.items():
+      for output_name, output_newline in _NEWLINES.items():
+        reference = _Time(lambda: _ReferenceFile(
+            path, rendered, template_newline, output_newline))
+        expected = path.read_bytes()
+        bulk = _Time(
+            lambda: _BulkFile(path, rendered, template_newline, output_newline))
+        assert path.read_bytes() == expected
+        print(f'{template_name:>8} {output_name:>6} {"file":>6}'
+              f' {reference * 1000:>8.0f}ms {bulk * 1000:>8.0f}ms'
+              f' {reference / bulk:>7.1f}x')
+
+        reference = _Time(lambda: _ReferenceWriteToBuffer(
+            rendered, template_newline, output_newline, io.BytesIO()))
+        bulk = _Time(lambda: _WriteToBuffer(rendered, template_newline,
+                                            output_newline, io.BytesIO()))
+        print(f'{template_name:>8} {output_name:>6} {"stdout":>6}'
+              f' {reference * 1000:>8.0f}ms {bulk * 1000:>8.0f}ms'
+              f' {reference / bulk:>7.1f}x')
+
+
+if __name__ == '__main__':
+  main()
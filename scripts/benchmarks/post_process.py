@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Times the helper post-processing (backtickify/indent/indented) of snippets.
+
+Compares the fused _PostProcess with the original step by step pipeline, on
+snippets of increasing size, to show that the fused version scales linearly.
+
+Usage: python -m scripts.benchmarks.post_process
+"""
+
+import textwrap
+import time
+from types import SimpleNamespace
+from typing import cast
+
+from snipinator.snipinate import BlockCommentStyle, _Context, _PostProcess
+
+_SIZES_MB = [0.1, 1, 4, 16]
+_LINE = 'def f(x):  # `x` is ``quoted`` and ```fenced```\n'
+
+
+def _ReferencePostProcess(text, *, backtickify, indent, indented, decomentify,
+                          _ctx):
+  """The original, step by step, post-processing, that _PostProcess fuses."""
+  if backtickify is not False:
+    count = 0
+    for backticks in range(1, len(text)):
+      if '`' * backticks not in text:
+        count = backticks - 1
+        break
+    bt_str = '`' * max(3, count + 1)
+    text = f'{bt_str}{"" if backtickify is True else backtickify}\n{text}\n{bt_str}'
+  if indent is not None:
+    text = textwrap.indent(text,
+                           ' ' * indent if isinstance(indent, int) else indent)
+  if indented is not None:
+    indent_str = ' ' * indented if isinstance(indented, int) else indented
+    lines = text.splitlines()
+    text = '\n'.join([lines[0]] + [indent_str + line for line in lines[1:]])
+  if decomentify is not False:
+    if decomentify == 'nl':
+      text = f'\n{text}\n'
+    text = _ctx.block_comment.close + text + _ctx.block_comment.open
+  return text
+
+
+def _Time(fn, text: str, ctx) -> float:
+  start = time.perf_counter()
+  fn(text,
+     backtickify='py',
+     indent=2,
+     indented='> ',
+     decomentify=False,
+     _ctx=ctx)
+  return time.perf_counter() - start
+
+
+def main() -> None:
+  # The post-processing only needs the block comment style of the context.
+  ctx = cast(
+      _Context,
+      SimpleNamespace(
+          block_comment=BlockCommentStyle(open='<!--', close='-->')))
+  print(f'{"size":>8} {"reference":>12} {"fused":>12} {"fused MB/s":>12}')
+  for size_mb in _SIZES_MB:
+    text = _LINE * int(size_mb * 1024 * 1024 / len(_LINE))
+    reference = min(_Time(_ReferencePostProcess, text, ctx) for _ in range(3))
+    fused = min(_Time(_PostProcess, text, ctx) for _ in range(3))
+    print(f'{size_mb:>6}MB {reference * 1000:>10.1f}ms {fused * 1000:>10.1f}ms'
+          f' {size_mb / fused:>12.0f}')
+
+
+if __name__ == '__main__':
+  main()
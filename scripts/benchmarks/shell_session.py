@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Times a template of many small shell() commands, with --shell-session.
+
+Usage: python -m scripts.benchmarks.shell_session
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+from snipinator.snipinate import BlockCommentStyle, Snipinate
+
+_COMMAND_COUNTS = [10, 100, 500]
+
+
+def _Render(template_string: str, cwd: Path, shell_session: bool) -> str:
+  return Snipinate(template_file_name='-',
+                   template_string=template_string,
+                   cwd=cwd,
+                   template_args={},
+                   templates_searchpath=None,
+                   block_comment=BlockCommentStyle(open='<!--', close='-->'),
+                   warning_header='',
+                   artifact_path=cwd,
+                   output_base_path=cwd,
+                   shell_session=shell_session)
+
+
+def main() -> None:
+  print(f'{"commands":>8} {"per call":>10} {"session":>10} {"speedup":>8}')
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    cwd = Path(tmp_dir)
+    (cwd / 'file.txt').write_text('contents\n')
+    for command_count in _COMMAND_COUNTS:
+      template_string = ''.join(
+          f"{{{{ shell('{command}', backtickify='bash') }}}}\n"
+          for command in ['cat file.txt', 'ls', 'echo $HOME', 'true'] *
+          (command_count // 4))
+      start = time.perf_counter()
+      expected = _Render(template_string, cwd, shell_session=False)
+      per_call = time.perf_counter() - start
+      start = time.perf_counter()
+      rendered = _Render(template_string, cwd, shell_session=True)
+      session = time.perf_counter() - start
+      assert rendered == expected
+      print(f'{command_count:>8} {per_call * 1000:>8.0f}ms'
+            f' {session * 1000:>8.0f}ms {per_call / session:>7.1f}x')
+
+
+if __name__ == '__main__':
+  main()
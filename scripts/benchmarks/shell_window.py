@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Times shell(start=..., end=...) on a long log, with and without stop_at_end.
+
+Usage: python -m scripts.benchmarks.shell_window
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+from snipinator.snipinate import BlockCommentStyle, Snipinate
+
+_LOG_LINES = [10000, 100000, 1000000]
+
+
+def _Render(template_string: str, cwd: Path) -> str:
+  return Snipinate(template_file_name='-',
+                   template_string=template_string,
+                   cwd=cwd,
+                   template_args={},
+                   templates_searchpath=None,
+                   block_comment=BlockCommentStyle(open='<!--', close='-->'),
+                   warning_header='',
+                   artifact_path=cwd,
+                   output_base_path=cwd)
+
+
+def main() -> None:
+  print(f'{"log lines":>9} {"full":>10} {"stop_at_end":>12} {"speedup":>8}')
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    cwd = Path(tmp_dir)
+    for log_lines in _LOG_LINES:
+      # The section that is needed, then a long log.
+      args = ("echo '== Usage =='; echo 'usage: tool [options]'; echo '=='; "
+              f'seq 1 {log_lines}')
+      template = ('{{ shell("%s", start="== Usage ==\\n", end="==",'
+                  ' include_args=False, stop_at_end=%s) }}')
+      start = time.perf_counter()
+      expected = _Render(template % (args, 'False'), cwd)
+      full = time.perf_counter() - start
+      start = time.perf_counter()
+      rendered = _Render(template % (args, 'True'), cwd)
+      stopped = time.perf_counter() - start
+      assert rendered == expected, (rendered, expected)
+      print(f'{log_lines:>9} {full * 1000:>8.0f}ms {stopped * 1000:>10.0f}ms'
+            f' {full / stopped:>7.1f}x')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Times pretty printing the terminal SVGs of shell(rich=...) captures.
+
+Compares PrettyXML with the minidom round trip it replaces, on colored captures
+of increasing length, and shows rich's own export_svg() time for scale.
+
+Usage: python -m scripts.benchmarks.terminal_svg
+"""
+
+import time
+from io import StringIO
+from typing import Callable
+
+from rich.console import Console
+from rich.terminal_theme import MONOKAI
+from rich.text import Text
+
+from snipinator.private.pretty_xml import MinidomPrettyXML, PrettyXML
+
+_LINE_COUNTS = [100, 1000, 10000]
+
+
+def _Capture(line_count: int) -> str:
+  return ''.join(f'\x1b[32mPASSED\x1b[0m tests/test_{i}.py::test[<&>]'
+                 f' \x1b[1;31m{i * 100 // line_count}%\x1b[0m\n'
+                 for i in range(line_count))
+
+
+def _Time(fn: Callable[[], str]) -> float:
+  times = []
+  for _ in range(3):
+    start = time.perf_counter()
+    fn()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+
+def main() -> None:
+  print(f'{"lines":>6} {"export_svg":>11} {"minidom":>10} {"PrettyXML":>10}'
+        f' {"speedup":>8}')
+  for line_count in _LINE_COUNTS:
+    console = Console(record=True,
+                      force_terminal=True,
+                      width=80,
+                      file=StringIO())
+    text = Text.from_ansi(_Capture(line_count))
+    console.print(text)
+    console.height = len(text.wrap(console, width=80))
+    start = time.perf_counter()
+    svg = console.export_svg(theme=MONOKAI)
+    export = time.perf_counter() - start
+    assert PrettyXML(svg) == MinidomPrettyXML(svg)
+    # PrettyXML first, so that it is not slowed down by collecting the DOMs.
+    pretty = _Time(lambda: PrettyXML(svg))
+    minidom = _Time(lambda: MinidomPrettyXML(svg))
+    print(f'{line_count:>6} {export * 1000:>9.0f}ms {minidom * 1000:>8.0f}ms'
+          f' {pretty * 1000:>8.0f}ms {minidom / pretty:>7.1f}x')
+
+
+if __name__ == '__main__':
+  main()
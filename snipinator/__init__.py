@@ -1,18 +1,34 @@
 # Notes
 #
 # * https://versioningit.readthedocs.io/en/stable/runtime-version.html#getting-package-version-at-runtime
+# * The version is looked up lazily (PEP 562), because the lookup is slow, and
+#   e.g `snipinator.client` should start quickly.
 #
 #
 import sys
+from typing import Any
 
-if sys.version_info >= (3, 8):
-  from importlib.metadata import PackageNotFoundError
-  from importlib.metadata import version as importlib_version
-else:
-  from importlib_metadata import PackageNotFoundError
-  from importlib_metadata import version as importlib_version
+# Set by __getattr__() on first use.
+_build_version: str
 
-try:
-  _build_version = importlib_version('snipinator')
-except PackageNotFoundError:
-  _build_version = '0.0.0'
+
+def _GetBuildVersion() -> str:
+  if sys.version_info >= (3, 8):
+    from importlib.metadata import PackageNotFoundError
+    from importlib.metadata import version as importlib_version
+  else:
+    from importlib_metadata import PackageNotFoundError
+    from importlib_metadata import version as importlib_version
+
+  try:
+    return importlib_version('snipinator')
+  except PackageNotFoundError:
+    return '0.0.0'
+
+
+def __getattr__(name: str) -> Any:
+  if name == '_build_version':
+    global _build_version
+    _build_version = _GetBuildVersion()
+    return _build_version
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -8,27 +8,34 @@
 
 import argparse
 import html
+import importlib
 import io
 import json
 import shlex
 import shutil
 import subprocess
 import sys
+import tempfile
 import time
 import warnings
 from functools import partial
 from pathlib import Path
 from shutil import get_terminal_size
-from typing import Any, BinaryIO, Callable, Dict, List, Optional, TextIO, Union
+from typing import (TYPE_CHECKING, Any, BinaryIO, Callable, Dict, Generator,
+                    Iterable, Iterator, List, MutableMapping, MutableSet,
+                    Optional, Set, TextIO, Tuple, Union, cast)
 
-import colorama
-from rich.console import Console
-from rich_argparse import RichHelpFormatter  # type: ignore[import]
 from typing_extensions import Literal
 
-from . import _build_version
+from .private.deps import (CheckDeps, GetDepsPath, ReadDeps, WriteDepfile,
+                           WriteDeps)
+from .private.disk_cache import DiskCache
 from .private.utilities import GetIOPath, GetPath
-from .snipinate import BlockCommentStyle, Snipinate
+from .snipinate import (BlockCommentStyle, RenderDependencies, Snipinate,
+                        SnipinateCache, SnipinateGenerate)
+
+if TYPE_CHECKING:
+  from rich.console import Console
 
 _NEWLINE_HELP = (' See '
                  '<https://docs.python.org/3/library/functions.html#open>'
@@ -48,6 +55,23 @@ _ARGPARSE_BOOL_CHOICES = ['true', 'false', 'True', 'False', '1', '0']
 _ARGPARSE_BOOL_TRUE = ['true', 'True', '1']
 _ARGPARSE_BOOL_FALSE = ['false', 'False', '0']
 
+# What happened to a rendered template.
+_RenderStatus = Literal['written', 'unchanged', 'stdout', 'check-passed',
+                        'check-failed', 'error']
+_FAILED_STATUSES = ['check-failed', 'error']
+# Options that apply to the whole batch, and so cannot be set per template in
+# a --manifest.
+_BATCH_GLOBAL_OPTIONS = [
+    'manifest', 'cache_dir', 'cache_max_mb', 'processes', 'watch', 'verbose'
+]
+# Options that do not affect the rendered output; all others are part of the
+# options key of --incremental.
+_NON_RENDER_OPTIONS = _BATCH_GLOBAL_OPTIONS + [
+    'jobs', 'svg_processes', 'shell_session', 'shell_timeout', 'render_budget',
+    'check', 'skip_unchanged', 'incremental', 'depfile', 'make_backup',
+    'make_tmp_backup', 'rm', 'move', 'force', 'create', 'stream'
+]
+
 
 def _GetProgramName() -> str:
   if __package__:
@@ -101,21 +125,22 @@ def _GetPermissionOctant8(*, path: Path) -> str:
   return oct(path.stat().st_mode)[-3:]
 
 
-def _ChmodPathlib(path: Path, mode10: int, console: Console):
+def _ChmodPathlib(path: Path, mode10: int, console: 'Console'):
   path.chmod(mode10)
 
 
-def _ChmodSubprocess(path: Path, mode10: int, console: Console, verbose: bool):
+def _ChmodSubprocess(path: Path, mode10: int, console: 'Console',
+                     verbose: bool):
   cmd = ['chmod', str(mode10), str(path)]
   if verbose:
     console.print(f'Running: {shlex.join(cmd)}', style='bold blue')
   subprocess.run(cmd, check=True)
 
 
-def _ChmodTryAll(*, path: Path, mode10: int, console: Console,
+def _ChmodTryAll(*, path: Path, mode10: int, console: 'Console',
                  verbose: bool) -> None:
 
-  chmods: List[Callable[[Path, int, Console], None]]
+  chmods: List[Callable[[Path, int, 'Console'], None]]
   chmods = [_ChmodPathlib, partial(_ChmodSubprocess, verbose=verbose)]
 
   for chmod in chmods:
@@ -169,7 +194,7 @@ def _ChmodTryAll(*, path: Path, mode10: int, console: Console,
   raise ValueError(f'Failed to change mode of {path}')
 
 
-def _MakeWritable(path: Path, console: Console, verbose: bool) -> None:
+def _MakeWritable(path: Path, console: 'Console', verbose: bool) -> None:
 
   # Get the current permissions
   original_mode8: str = _GetPermissionOctant8(path=path)
@@ -192,7 +217,7 @@ def _MakeWritable(path: Path, console: Console, verbose: bool) -> None:
           style='bold green')
 
 
-def _MakeReadonly(path: Path, console: Console, verbose: bool) -> None:
+def _MakeReadonly(path: Path, console: 'Console', verbose: bool) -> None:
 
   # Get the current permissions
   original_mode8: str = _GetPermissionOctant8(path=path)
@@ -215,42 +240,200 @@ def _MakeReadonly(path: Path, console: Console, verbose: bool) -> None:
           style='bold green')
 
 
+def _ParseNewline(values: str) -> Optional[str]:
+  if values == 'auto':
+    return None
+  elif values == 'lf':
+    return '\n'
+  elif values == 'crlf':
+    return '\r\n'
+  elif values == 'cr':
+    return '\r'
+  else:
+    raise argparse.ArgumentTypeError(
+        f'Invalid newline value: {json.dumps(values)}.'
+        ' Must be one of {auto, lf, crlf, cr}')
+
+
 class _NewlineAction(argparse.Action):
 
   def __call__(self, parser, namespace, values, option_string=None):
-    if values == 'auto':
-      newline = None
-    elif values == 'lf':
-      newline = '\n'
-    elif values == 'crlf':
-      newline = '\r\n'
-    elif values == 'cr':
-      newline = '\r'
-    else:
-      raise argparse.ArgumentTypeError(
-          f'Invalid newline value: {json.dumps(values)}.'
-          ' Must be one of {auto, lf, crlf, cr}')
-    setattr(namespace, self.dest, newline)
+    setattr(namespace, self.dest, _ParseNewline(values))
+
+
+def _TranslateNewlines(text: str, template_newline: Optional[str],
+                       output_newline: Optional[str]) -> str:
+  """Translates the newlines of the rendered text, in bulk.
+
+  The same as reading `text` back from io.StringIO(text, newline=
+  template_newline), and writing that to a text file opened with newline=
+  output_newline, but without the per-line copies. Except that an
+  `output_newline` of None leaves '\n' as is, for a text file to translate.
+  """
+  if template_newline is None:
+    # Universal newlines.
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+  elif template_newline not in ('', '\n'):
+    text = text.replace('\n', template_newline)
+  if output_newline not in (None, '', '\n'):
+    text = text.replace('\n', cast(str, output_newline))
+  return text
 
 
 def _WriteToBuffer(rendered: str, template_newline: Optional[str],
                    output_newline: Optional[str], buffer_io: BinaryIO):
-  with io.StringIO(rendered, newline=template_newline) as rendered_io:
-    with io.StringIO(newline=output_newline) as output_io:
-      for line in rendered_io:
-        output_io.write(line)
-      rendered_bytes = output_io.getvalue().encode()
-      buffer_io.write(rendered_bytes)
+  buffer_io.write(
+      _TranslateNewlines(rendered,
+                         template_newline=template_newline,
+                         output_newline=output_newline).encode())
 
 
 def _WriteToFile(rendered: str, template_newline: Optional[str],
                  output_io: TextIO):
-  with io.StringIO(rendered, newline=template_newline) as rendered_io:
-    for line in rendered_io:
-      output_io.write(line)
-
+  # The file translates the output newlines itself.
+  output_io.write(
+      _TranslateNewlines(rendered,
+                         template_newline=template_newline,
+                         output_newline=None))
+
+
+# The rendered text, or (with --stream) the file it was written to, see
+# _StreamToScratchFile().
+_Rendered = Union[str, BinaryIO]
+# The size (in characters) of the chunks that --stream writes.
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _Rechunk(chunks: Iterable[str], size: int) -> Generator[str, None, None]:
+  """Joins consecutive chunks into chunks of at least `size` characters.
+
+  Except for the last one.
+  """
+  buffered: List[str] = []
+  buffered_size = 0
+  for chunk in chunks:
+    buffered.append(chunk)
+    buffered_size += len(chunk)
+    if buffered_size >= size:
+      yield ''.join(buffered)
+      buffered = []
+      buffered_size = 0
+  if buffered:
+    yield ''.join(buffered)
+
+
+def _TranslateTemplateNewlines(
+    chunks: Iterable[str],
+    template_newline: Optional[str]) -> Generator[str, None, None]:
+  """Translates newlines like io.StringIO(text, newline=template_newline).
+
+  That is, like _WriteToFile(), but chunk by chunk.
+  """
+  if template_newline is None:
+    # Universal newlines; a '\r\n' might be split between two chunks.
+    decoder = io.IncrementalNewlineDecoder(None, translate=True)
+    for chunk in chunks:
+      yield decoder.decode(chunk)
+    yield decoder.decode('', final=True)
+  else:
+    for chunk in chunks:
+      yield _TranslateNewlines(chunk,
+                               template_newline=template_newline,
+                               output_newline=None)
+
+
+def _StreamToStdout(chunks: Iterable[str], template_newline: Optional[str],
+                    output_newline: Optional[str]) -> None:
+  """Same as the stdout case of _Render(), but chunk by chunk."""
+  if output_newline is not None and template_newline is None:
+    for chunk in chunks:
+      sys.stdout.write(chunk)
+  elif output_newline is None:
+    # Like _WriteToFile().
+    for chunk in _TranslateTemplateNewlines(chunks, template_newline):
+      sys.stdout.write(chunk)
+  else:
+    # Like _WriteToBuffer().
+    for chunk in _TranslateTemplateNewlines(chunks, template_newline):
+      sys.stdout.buffer.write(
+          _TranslateNewlines(chunk,
+                             template_newline='',
+                             output_newline=output_newline).encode())
+
+
+class _StreamComparator:
+  """Compares the rendered text, chunk by chunk, with an existing output file.
+
+  Same as reading the whole file like _Render() does, and comparing it with the
+  whole rendered text, but without either being in memory.
+  """
+
+  def __init__(self, output_path: Path, output_newline: Optional[str]):
+    self._file: Optional[TextIO] = None
+    if output_path.exists():
+      self._file = output_path.open('r', encoding=None, newline=output_newline)
+    self._same = self._file is not None
+
+  def Compared(self, chunks: Iterable[str]) -> Generator[str, None, None]:
+    """Compares the chunks, as they pass through."""
+    for chunk in chunks:
+      if self._same and self._file is not None:
+        self._same = self._file.read(len(chunk)) == chunk
+      yield chunk
+
+  def Finish(self) -> bool:
+    """Returns True if the chunks were the same as the whole file."""
+    if self._file is None:
+      return False
+    with self._file:
+      return self._same and self._file.read(1) == ''
+
+
+def _StreamToScratchFile(chunks: Iterable[str], template_newline: Optional[str],
+                         output_newline: Optional[str],
+                         comparator: Optional[_StreamComparator],
+                         write: bool) -> Optional[BinaryIO]:
+  """Writes the chunks to an anonymous temporary file, exactly as
+  _CreateOutputFile() would write the whole rendered text to the output file.
+
+  The output file is only written once the render succeeds, from the temporary
+  file, see _CreateOutputFile().
+
+  Args:
+      comparator (Optional[_StreamComparator]): If specified, also compares the
+        chunks with the existing output file.
+      write (bool): If False, the chunks are only compared.
+
+  Returns:
+      Optional[BinaryIO]: The temporary file, or None if `write` is False.
+  """
+  if comparator is not None:
+    chunks = comparator.Compared(chunks)
+  if not write:
+    for _ in chunks:
+      pass
+    return None
 
-def _RemoveOutputPath(output_path: Path, force: bool, console: Console,
+  scratch_file = cast(BinaryIO, tempfile.TemporaryFile())
+  try:
+    scratch_text = io.TextIOWrapper(scratch_file,
+                                    encoding=None,
+                                    newline=output_newline)
+    if template_newline is not None or output_newline is not None:
+      # Otherwise _CreateOutputFile() uses Path.write_text(), which does not
+      # translate the template newlines.
+      chunks = _TranslateTemplateNewlines(chunks, template_newline)
+    for chunk in chunks:
+      scratch_text.write(chunk)
+    scratch_text.flush()
+    scratch_text.detach()
+  except BaseException:
+    scratch_file.close()
+    raise
+  return scratch_file
+
+
+def _RemoveOutputPath(output_path: Path, force: bool, console: 'Console',
                       verbose: bool) -> None:
   try:
     output_path.unlink()
@@ -261,7 +444,7 @@ def _RemoveOutputPath(output_path: Path, force: bool, console: Console,
     output_path.unlink()
 
 
-def _Move(src: Path, dst: Path, force: bool, console: Console,
+def _Move(src: Path, dst: Path, force: bool, console: 'Console',
           verbose: bool) -> None:
   try:
     shutil.move(str(src), str(dst))
@@ -274,21 +457,27 @@ def _Move(src: Path, dst: Path, force: bool, console: Console,
 
 def _CreateOutputFile(template_newline: Optional[str],
                       output_newline: Optional[str], output_path: Path,
-                      rendered: str, console: Console) -> None:
-
-  if template_newline is None and output_newline is None:
+                      rendered: _Rendered, console: 'Console') -> None:
+
+  if not isinstance(rendered, str):
+    # Already written out by _StreamToScratchFile().
+    rendered.seek(0)
+    with output_path.open('wb') as output_file:
+      shutil.copyfileobj(rendered, output_file)
+  elif template_newline is None and output_newline is None:
     # Simple case, nothing was specified for newlines, use python defaults.
     output_path.write_text(rendered, encoding=None)
   else:
+    # The file translates the output newlines (e.g None is os.linesep).
     with output_path.open('w', encoding=None,
                           newline=output_newline) as output_file:
-      _WriteToFile(rendered=rendered,
+      _WriteToFile(rendered,
                    template_newline=template_newline,
                    output_io=output_file)
 
 
 def _SealOutputFile(output_path: Path, chmod: Optional[str], chmod_ro: bool,
-                    console: Console, verbose: bool) -> None:
+                    console: 'Console', verbose: bool) -> None:
   ############################################################################
   if chmod_ro:
     _MakeReadonly(output_path, console=console, verbose=verbose)
@@ -308,7 +497,7 @@ def _SealOutputFile(output_path: Path, chmod: Optional[str], chmod_ro: bool,
                     style='bold green')
 
 
-def _MakeBackup(output_path: Path, console: Console,
+def _MakeBackup(output_path: Path, console: 'Console',
                 verbose: bool) -> Optional[Path]:
   if not output_path.exists():
     if verbose:
@@ -324,39 +513,691 @@ def _MakeBackup(output_path: Path, console: Console,
   return backup_path
 
 
-class _CustomRichHelpFormatter(RichHelpFormatter):
+class _LazyConsole:
+  """A rich Console that is only created when it is first used.
 
-  def __init__(self, *args, **kwargs):
-    if kwargs.get('width') is None:
-      width, _ = get_terminal_size()
-      if width == 0:
-        warnings.warn('Terminal width was set to 0, using default width of 80.',
-                      RuntimeWarning,
-                      stacklevel=0)
-        # This is the default in get_terminal_size().
-        width = 80
-      # This is what HelpFormatter does to the width returned by
-      # `get_terminal_size()`.
-      width -= 2
-      kwargs['width'] = width
-    super().__init__(*args, **kwargs)
+  rich is slow to import, and most runs never print anything.
+  """
 
+  def __init__(self, **kwargs: Any) -> None:
+    self._kwargs = kwargs
+    self._console: Optional['Console'] = None
 
-def main() -> None:
-  console = Console(file=sys.stderr)
+  def __getattr__(self, name: str) -> Any:
+    if self._console is None:
+      from rich.console import Console
+      self._console = Console(**self._kwargs)
+    return getattr(self._console, name)
+
+
+def _MakeLazyConsole() -> 'Console':
+  return cast('Console', _LazyConsole(file=sys.stderr))
+
+
+def _MakeHelpFormatter(prog: str) -> argparse.HelpFormatter:
+  # Imported here, because rich_argparse is slow to import, and only needed
+  # for --help and usage errors.
+  from rich_argparse import RichHelpFormatter  # type: ignore[import]
+
+  width, _ = get_terminal_size()
+  if width == 0:
+    warnings.warn('Terminal width was set to 0, using default width of 80.',
+                  RuntimeWarning,
+                  stacklevel=0)
+    # This is the default in get_terminal_size().
+    width = 80
+  # This is what HelpFormatter does to the width returned by
+  # `get_terminal_size()`.
+  width -= 2
+  return RichHelpFormatter(prog=prog, width=width)
+
+
+class _VersionAction(argparse.Action):
+  """Like action='version', but only looks up the (slow) version if asked."""
+
+  def __init__(self,
+               option_strings: List[str],
+               dest: str = argparse.SUPPRESS,
+               default: Any = argparse.SUPPRESS,
+               help: Optional[str] = None) -> None:
+    super().__init__(option_strings=option_strings,
+                     dest=dest,
+                     default=default,
+                     nargs=0,
+                     help=help)
+
+  def __call__(self, parser, namespace, values, option_string=None):
+    from . import _build_version
+    formatter = parser._get_formatter()
+    formatter.add_text(_build_version)
+    parser._print_message(formatter.format_help(), sys.stdout)
+    parser.exit()
+
+
+def _LoadManifest(manifest_path: Path) -> List[Dict[str, Any]]:
+  manifest: Any
+  if manifest_path.suffix == '.toml':
+    if sys.version_info >= (3, 11):
+      import tomllib
+    else:
+      try:
+        import tomli as tomllib
+      except ImportError as e:
+        raise ImportError(
+            'TOML manifests require Python 3.11+, or the "tomli" package.'
+            ' Alternatively, use a JSON manifest.') from e
+    with manifest_path.open('rb') as f:
+      manifest = tomllib.load(f)
+  else:
+    with manifest_path.open('r') as f:
+      manifest = json.load(f)
+  if not isinstance(manifest, dict) or not isinstance(manifest.get('templates'),
+                                                      list):
+    raise ValueError(
+        f'Invalid manifest {json.dumps(str(manifest_path))}: expected an object'
+        ' with a "templates" list.')
+  return manifest['templates']
+
+
+def _GetBatch(args: argparse.Namespace) -> List[argparse.Namespace]:
+  """Returns the args of each template to render."""
+  entries: List[Dict[str, Any]]
+  if args.manifest is not None:
+    if args.output is not None:
+      raise ValueError('Cannot use -o/--output with --manifest')
+    entries = _LoadManifest(GetPath(args.manifest))
+  else:
+    outputs: List[str] = ['-'] if args.output is None else args.output
+    if len(outputs) != len(args.template):
+      raise ValueError(
+          '-o/--output must be given once for each -t/--template, got'
+          f' {len(args.template)} templates and {len(outputs)} outputs')
+    entries = [{
+        'template': template,
+        'output': output
+    } for template, output in zip(args.template, outputs)]
+
+  batch: List[argparse.Namespace] = []
+  stdin_count = 0
+  for entry in entries:
+    batch_args = argparse.Namespace(**vars(args))
+    batch_args.output = '-'
+    for key, value in entry.items():
+      if key in _BATCH_GLOBAL_OPTIONS or not hasattr(batch_args, key):
+        raise ValueError(f'Invalid option in manifest entry: {json.dumps(key)}')
+      if key == 'args' and isinstance(value, str):
+        value = json.loads(value)
+      elif key in ('template_newline', 'output_newline'):
+        value = _ParseNewline(value)
+      elif key in ('make_backup', 'make_tmp_backup') and isinstance(
+          value, bool):
+        value = str(value).lower()
+      setattr(batch_args, key, value)
+    if not isinstance(batch_args.template, str):
+      raise ValueError(
+          f'Manifest entry is missing a "template": {json.dumps(entry)}')
+    if batch_args.template == '-':
+      stdin_count += 1
+    batch.append(batch_args)
+  if stdin_count > 1:
+    raise ValueError('Only one template can be read from stdin')
+  depfiles = [
+      batch_args.depfile
+      for batch_args in batch
+      if batch_args.depfile is not None
+  ]
+  if len(depfiles) != len(set(depfiles)):
+    raise ValueError('Each template needs its own --depfile, set "depfile" in'
+                     ' the --manifest entries instead')
+  return batch
+
+
+def _GetOptionsKey(args: argparse.Namespace) -> str:
+  """Returns a key of all the options that affect the rendered output."""
+  options = {
+      key: value
+      for key, value in vars(args).items()
+      if key not in _NON_RENDER_OPTIONS
+  }
+  from . import _build_version
+  options['snipinator_version'] = _build_version
+  return json.dumps(options, sort_keys=True, default=str)
+
+
+def _WriteDependencies(*, deps_path: Optional[Path],
+                       depfile_path: Optional[Path], options_key: str,
+                       output_path: Path,
+                       dependencies: RenderDependencies) -> None:
+  if deps_path is not None:
+    WriteDeps(deps_path=deps_path,
+              options_key=options_key,
+              output_path=output_path,
+              dependencies=dependencies)
+  if depfile_path is not None:
+    WriteDepfile(depfile_path=depfile_path,
+                 output_path=output_path,
+                 dependencies=dependencies)
+
+
+def _Render(args: argparse.Namespace,
+            cache: SnipinateCache,
+            written_files: MutableSet[Path],
+            console: 'Console',
+            dependencies: Optional[RenderDependencies] = None) -> _RenderStatus:
+  """Renders a single template, as specified by the (possibly batch) args.
+
+  Args:
+      dependencies (Optional[RenderDependencies], optional): If specified,
+        receives everything the render depended on. Defaults to None.
+  """
+  cwd: Path = GetPath(args.cwd)
+  template: str = args.template
+  template_file_name: Union[Path, Literal['-']] = GetIOPath(template)
+  output: Union[Path, Literal['-']] = GetIOPath(args.output)
+  output_base_path: Optional[Path] = args.output_base_path
+  if output_base_path is None:
+    if output == '-':
+      output_base_path = GetPath(cwd)
+    else:
+      output_base_path = output.parent
+  output_base_path = GetPath(output_base_path)
+
+  artifact_path: Optional[Path] = args.artifact_path
+  if artifact_path is None:
+    if template_file_name == '-':
+      artifact_path = cwd
+    else:
+      artifact_path = template_file_name.parent
+  artifact_path = GetPath(artifact_path)
+
+  template_args: Dict[str, Any] = args.args
+  templates_searchpath: Optional[Path] = GetPath(args.templates_searchpath)
+  verbose: bool = args.verbose
+  template_newline: Optional[str] = args.template_newline
+  output_newline: Optional[str] = args.output_newline
+  block_comment = BlockCommentStyle(*args.block_comment)
+  warning_header: str
+  if args.warning_message is not None:
+    warnings.warn(
+        'The --warning-message option is deprecated, use --warning-header instead.',
+        DeprecationWarning,
+        stacklevel=2)
+    warning_header = f'<!--\n{html.escape(args.warning_message)}\n-->'
+  else:
+    warning_header = args.warning_header
+
+  make_backup: bool
+  if args.make_backup is None:
+    make_backup = False
+  else:
+    make_backup = args.make_backup in _ARGPARSE_BOOL_TRUE
+
+  make_tmp_backup: bool
+  if args.make_tmp_backup is None:
+    make_tmp_backup = not make_backup and output != '-'
+  else:
+    make_tmp_backup = args.make_tmp_backup in _ARGPARSE_BOOL_TRUE
+
+  if args.rm and output == '-':
+    raise ValueError('Cannot use --rm with stdout')
+  if args.move and output == '-':
+    raise ValueError('Cannot use --move with stdout')
+  if make_backup and output == '-':
+    raise ValueError('Cannot use --make-backup true with stdout')
+  if make_tmp_backup and output == '-':
+    raise ValueError('Cannot use --make-tmp-backup true with stdout')
+  if args.chmod and output == '-':
+    raise ValueError('Cannot use --chmod with stdout')
+  if args.chmod_ro and output == '-':
+    raise ValueError('Cannot use --chmod-ro with stdout')
+  if args.create and output == '-':
+    raise ValueError('Cannot use --create with stdout')
+  if args.check and output == '-':
+    raise ValueError('Cannot use --check with stdout')
+  if args.incremental and output == '-':
+    raise ValueError('Cannot use --incremental with stdout')
+  if args.incremental and template_file_name == '-':
+    raise ValueError('Cannot use --incremental with stdin')
+  if args.depfile is not None and output == '-':
+    raise ValueError('Cannot use --depfile with stdout')
+  ############################################################################
+  depfile_path: Optional[Path] = None
+  if args.depfile is not None:
+    depfile_path = GetPath(args.depfile)
+  deps_path: Optional[Path] = None
+  options_key: str = ''
+  if args.incremental and output != '-':
+    deps_path = GetDepsPath(output)
+    options_key = _GetOptionsKey(args)
+    reason = CheckDeps(deps_path=deps_path, options_key=options_key)
+    if (reason is None and depfile_path is not None
+        and not depfile_path.exists()):
+      reason = f'{depfile_path} does not exist'
+    if reason is None:
+      if verbose:
+        console.print(
+            f'Skipping {output} because none of its dependencies changed.',
+            style='bold yellow')
+      if dependencies is not None:
+        recorded = ReadDeps(deps_path)
+        dependencies.files.update(recorded.files)
+        dependencies.paths.update(recorded.paths)
+        dependencies.artifacts.update(recorded.artifacts)
+        dependencies.shell_calls.extend(recorded.shell_calls)
+      return 'check-passed' if args.check else 'unchanged'
+    if verbose:
+      console.print(f'Rendering {output} because {reason}.', style='bold blue')
+  if dependencies is None:
+    dependencies = RenderDependencies()
+  ############################################################################
+  template_string: str
+  if template_file_name != '-':
+    # If we are not dealing with stdin:
+
+    # Treat it as a path.
+    if template_file_name.is_absolute():
+      # If the path is absolute, we want a relative path for the file name
+      # (which is used for debugging and error messages).
+      #
+      # TODO: Do we want this behavior?
+      template_file_path = template_file_name
+      template_file_name = template_file_name.relative_to(cwd)
+    else:
+      # If the path is relative, we want to resolve it to an absolute path.
+      template_file_path = cwd / template_file_name
+    dependencies.files.add(template_file_path)
+    with template_file_path.open('r', encoding=None,
+                                 newline=template_newline) as f:
+      template_string = f.read()
+  else:
+    # Template is to be read from stdin.
+    if template_newline is None:
+      # Simple case, nothing was specified for newlines.
+      template_string = sys.stdin.read()
+    else:
+      template_buffer: bytes = sys.stdin.buffer.read()
+      decode_kwargs: Dict[str, Any] = {}
+      template_string = _TranslateNewlines(
+          template_buffer.decode(**decode_kwargs),
+          template_newline=template_newline,
+          output_newline=None)
+  ############################################################################
+  if args.create:
+    if output == '-':
+      raise ValueError('Cannot use --create with stdout')
+    output_path = output
+    if not output_path.exists():
+      output_path.touch()
+  ############################################################################
+  snipinate_kwargs: Dict[str,
+                         Any] = dict(template_file_name=template_file_name,
+                                     template_string=template_string,
+                                     cwd=cwd,
+                                     artifact_path=artifact_path,
+                                     output_base_path=output_base_path,
+                                     template_args=template_args,
+                                     templates_searchpath=templates_searchpath,
+                                     block_comment=block_comment,
+                                     warning_header=warning_header,
+                                     skip_unchanged=args.skip_unchanged,
+                                     cache=cache,
+                                     jobs=args.jobs,
+                                     svg_processes=args.svg_processes,
+                                     shell_session=args.shell_session,
+                                     shell_timeout=args.shell_timeout,
+                                     render_budget=args.render_budget,
+                                     written_files=written_files,
+                                     dependencies=dependencies)
+  if args.stream:
+    chunks = _Rechunk(SnipinateGenerate(**snipinate_kwargs), _STREAM_CHUNK_SIZE)
+    if output == '-':
+      _StreamToStdout(chunks,
+                      template_newline=template_newline,
+                      output_newline=output_newline)
+      return 'stdout'
+    comparator: Optional[_StreamComparator] = None
+    if args.check or args.skip_unchanged:
+      comparator = _StreamComparator(output, output_newline=output_newline)
+    # Only written to the output file after the render succeeds.
+    scratch_file = _StreamToScratchFile(chunks,
+                                        template_newline=template_newline,
+                                        output_newline=output_newline,
+                                        comparator=comparator,
+                                        write=not args.check)
+    try:
+      return _WriteRendered(
+          args,
+          rendered=scratch_file,
+          unchanged=comparator.Finish() if comparator is not None else None,
+          output_path=output,
+          template_newline=template_newline,
+          output_newline=output_newline,
+          make_backup=make_backup,
+          make_tmp_backup=make_tmp_backup,
+          deps_path=deps_path,
+          depfile_path=depfile_path,
+          options_key=options_key,
+          dependencies=dependencies,
+          console=console)
+    finally:
+      if scratch_file is not None:
+        scratch_file.close()
+
+  rendered = Snipinate(**snipinate_kwargs)
+  ############################################################################
+  if output == '-':
+    # Deal with the stdout case.
+    if output_newline is not None and template_newline is None:
+      # Simple case, nothing was specified for newlines, use python defaults.
+      sys.stdout.write(rendered)
+      return 'stdout'
+    else:
+      # Transfer the text from the rendered string to stdout, with the
+      # specified newlines.
+      if output_newline is None:
+        _WriteToFile(rendered=rendered,
+                     template_newline=template_newline,
+                     output_io=sys.stdout)
+      else:
+        # This seems like the only clean way to write custom newlines to
+        # stdout.
+        _WriteToBuffer(rendered=rendered,
+                       template_newline=template_newline,
+                       output_newline=output_newline,
+                       buffer_io=sys.stdout.buffer)
+      return 'stdout'
+  ############################################################################
+  unchanged: Optional[bool] = None
+  if args.check or args.skip_unchanged:
+    original_output: Optional[str] = None
+    if output.exists():
+      with output.open('r', encoding=None, newline=output_newline) as f:
+        original_output = f.read()
+    unchanged = rendered == original_output
+  return _WriteRendered(args,
+                        rendered=rendered,
+                        unchanged=unchanged,
+                        output_path=output,
+                        template_newline=template_newline,
+                        output_newline=output_newline,
+                        make_backup=make_backup,
+                        make_tmp_backup=make_tmp_backup,
+                        deps_path=deps_path,
+                        depfile_path=depfile_path,
+                        options_key=options_key,
+                        dependencies=dependencies,
+                        console=console)
+
+
+def _WriteRendered(args: argparse.Namespace, *, rendered: Optional[_Rendered],
+                   unchanged: Optional[bool], output_path: Path,
+                   template_newline: Optional[str],
+                   output_newline: Optional[str], make_backup: bool,
+                   make_tmp_backup: bool, deps_path: Optional[Path],
+                   depfile_path: Optional[Path], options_key: str,
+                   dependencies: RenderDependencies,
+                   console: 'Console') -> _RenderStatus:
+  """The second half of _Render(): writes the rendered text to the output file.
+
+  Args:
+      rendered (Optional[_Rendered]): The rendered text. None only with
+        --check and --stream.
+      unchanged (Optional[bool]): Whether the rendered text is the same as the
+        existing output file; None unless --check or --skip-unchanged.
+  """
+  verbose: bool = args.verbose
+  ############################################################################
+  if args.check or args.skip_unchanged:
+    if args.check:
+      return 'check-passed' if unchanged else 'check-failed'
+    elif args.skip_unchanged:
+      if unchanged:
+        if verbose:
+          console.print(f'Skipping {output_path} because it is unchanged.',
+                        style='bold yellow')
+        _WriteDependencies(deps_path=deps_path,
+                           depfile_path=depfile_path,
+                           options_key=options_key,
+                           output_path=output_path,
+                           dependencies=dependencies)
+        return 'unchanged'
+  ############################################################################
+  assert rendered is not None
+  backup_path: Optional[Path] = None
+  if make_backup or make_tmp_backup:
+    backup_path = _MakeBackup(output_path, console, verbose=verbose)
+  ############################################################################
+  if args.move:
+    tmp_output_path = output_path.with_suffix(output_path.suffix + '.tmp')
+    _CreateOutputFile(template_newline=template_newline,
+                      output_newline=output_newline,
+                      output_path=tmp_output_path,
+                      rendered=rendered,
+                      console=console)
+    if output_path.exists() and args.rm:
+      _RemoveOutputPath(output_path,
+                        force=args.force,
+                        console=console,
+                        verbose=verbose)
+    _Move(src=tmp_output_path,
+          dst=output_path,
+          force=args.force,
+          console=console,
+          verbose=verbose)
+  else:
+    if output_path.exists() and args.rm:
+      _RemoveOutputPath(output_path,
+                        force=args.force,
+                        console=console,
+                        verbose=verbose)
+    _CreateOutputFile(template_newline=template_newline,
+                      output_newline=output_newline,
+                      output_path=output_path,
+                      rendered=rendered,
+                      console=console)
+  ############################################################################
+  _SealOutputFile(output_path=output_path,
+                  chmod=args.chmod,
+                  chmod_ro=args.chmod_ro,
+                  console=console,
+                  verbose=verbose)
+  ############################################################################
+  # If everything was succesful, and --make-tmp-backup was specified, delete
+  # the backup.
+  if make_tmp_backup and backup_path is not None:
+    backup_path.unlink()
+  ############################################################################
+  _WriteDependencies(deps_path=deps_path,
+                     depfile_path=depfile_path,
+                     options_key=options_key,
+                     output_path=output_path,
+                     dependencies=dependencies)
+  ############################################################################
+  return 'written'
+
+
+class _SharedWrittenFiles(MutableSet[Path]):
+  """The artifacts written by the templates of a --processes batch.
+
+  Like the set of written files that a batch rendered in one process shares
+  between its templates, but backed by a dict in a multiprocessing manager, so
+  that the worker processes see each other's artifacts. Adding is atomic: of two
+  templates writing the same artifact, the second fails before writing it.
+  """
+
+  def __init__(self, claims: MutableMapping[Path, int], index: int):
+    # The index, in the batch, of the template that wrote each artifact.
+    self._claims = claims
+    self._index = index
+
+  def __contains__(self, path: object) -> bool:
+    return path in self._claims
+
+  def __iter__(self) -> Iterator[Path]:
+    return iter(list(self._claims.keys()))
+
+  def __len__(self) -> int:
+    return len(self._claims)
+
+  def add(self, path: Path) -> None:
+    index = self._claims.setdefault(path, self._index)
+    if index != self._index:
+      raise ValueError(f'File already written: {json.dumps(str(path))}, by'
+                       ' another template rendered together.')
+
+  def discard(self, path: Path) -> None:
+    if self._claims.get(path) == self._index:
+      del self._claims[path]
+
+
+# The modules that snipinate.py only imports once a render needs them (e.g for
+# rich shell() calls), which each worker process of --processes imports as it
+# starts instead, so that its first render finds them already loaded.
+_WORKER_PRELOAD_MODULES = [
+    'importlib.metadata', 'pexpect', 'rich.ansi', 'rich.console',
+    'rich.terminal_theme', 'rich.text', 'rich.themes', 'xml.dom.minidom',
+    'xml.parsers.expat'
+]
+# The cache of each worker process of --processes, shared by all the templates
+# rendered by that worker.
+_worker_cache: Optional[SnipinateCache] = None
+# The artifacts written by all the workers, see _SharedWrittenFiles.
+_worker_claims: Optional[MutableMapping[Path, int]] = None
+
+
+def _InitWorker(cache_dir: Optional[Path], cache_max_bytes: int,
+                claims: MutableMapping[Path, int]) -> None:
+  global _worker_cache, _worker_claims
+  for module in _WORKER_PRELOAD_MODULES:
+    importlib.import_module(module)
+  disk_cache: Optional[DiskCache] = None
+  if cache_dir is not None:
+    disk_cache = DiskCache(cache_dir, max_bytes=cache_max_bytes)
+  _worker_cache = SnipinateCache(disk_cache=disk_cache)
+  _worker_claims = claims
+
+
+def _RenderInWorker(index: int,
+                    batch_args: argparse.Namespace) -> _RenderStatus:
+  console = _MakeLazyConsole()
+  if _worker_cache is None or _worker_claims is None:
+    raise AssertionError('_InitWorker() was not called')
+  try:
+    return _Render(batch_args,
+                   cache=_worker_cache,
+                   written_files=_SharedWrittenFiles(_worker_claims,
+                                                     index=index),
+                   console=console)
+  except Exception:
+    console.print_exception()
+    return 'error'
+
+
+def _RenderBatchInProcesses(batch: List[argparse.Namespace], *, processes: int,
+                            cache_dir: Optional[Path],
+                            cache_max_bytes: int) -> List[_RenderStatus]:
+  """Renders the templates in a pool of processes, returns results in order."""
+  for batch_args in batch:
+    if batch_args.template == '-' or batch_args.output == '-':
+      raise ValueError('Cannot use stdin/stdout with --processes')
+  import concurrent.futures
+  import multiprocessing
+  with multiprocessing.Manager() as manager:
+    claims: MutableMapping[Path, int] = manager.dict()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes,
+                                                initializer=_InitWorker,
+                                                initargs=(cache_dir,
+                                                          cache_max_bytes,
+                                                          claims)) as executor:
+      return list(executor.map(_RenderInWorker, range(len(batch)), batch))
+
+
+def _Watch(batch: List[argparse.Namespace], cache: SnipinateCache,
+           disk_cache: Optional[DiskCache], console: 'Console') -> None:
+  """Renders the templates, then re-renders them whenever their inputs change.
+
+  Only the templates whose recorded inputs changed are re-rendered, and only
+  the changed files are invalidated in the cache. Runs until interrupted.
+  """
+  from .private.watch import Watcher
+  watcher = Watcher()
+  # The inputs of each template.
+  input_paths: List[Set[Path]] = [set() for _ in batch]
+  pending: List[int] = list(range(len(batch)))
+  while True:
+    written_files: Set[Path] = set()
+    for index in pending:
+      batch_args = batch[index]
+      dependencies = RenderDependencies()
+      try:
+        status = _Render(batch_args,
+                         cache=cache,
+                         written_files=written_files,
+                         console=console,
+                         dependencies=dependencies)
+        input_paths[index] = dependencies.GetInputPaths()
+      except Exception:
+        console.print_exception()
+        status = 'error'
+        # Keep watching the old inputs too, in case the render failed early.
+        input_paths[index] |= dependencies.GetInputPaths()
+      console.print(
+          f'{batch_args.template} -> {batch_args.output}: {status}',
+          style='bold red' if status in _FAILED_STATUSES else 'bold green')
+    if disk_cache is not None:
+      disk_cache.Prune()
+    # Taken after rendering, so that templates reading their own outputs do
+    # not trigger themselves forever.
+    snapshot = watcher.Snapshot(set().union(*input_paths))
+    console.print(f'Watching {len(snapshot)} files for changes...',
+                  style='bold blue')
+    changed = watcher.WaitForChanges(snapshot)
+    console.print('Changed: ' + ', '.join(sorted(str(path)
+                                                 for path in changed)),
+                  style='bold blue')
+    cache.Invalidate(changed)
+    pending = [
+        index for index in range(len(batch)) if input_paths[index] & changed
+    ]
+
+
+# Identifies a SnipinateCache by its --cache-dir and --cache-max-mb.
+_CacheConfig = Tuple[Optional[str], int]
+
+
+def _Run(argv: Optional[List[str]], caches: Dict[_CacheConfig,
+                                                 SnipinateCache]) -> None:
+  """Runs the CLI with the given arguments (default: sys.argv[1:]).
+
+  Args:
+      caches (Dict[_CacheConfig, SnipinateCache]): Caches to reuse, and to add
+        new caches to, e.g to keep them warm across runs in `snipinator serve`.
+  """
+  console = _MakeLazyConsole()
   args: Optional[argparse.Namespace] = None
   try:
-    # Windows<10 requires this.
-    colorama.init()
-
-    p = argparse.ArgumentParser(prog=_GetProgramName(),
-                                description=__doc__,
-                                formatter_class=_CustomRichHelpFormatter)
-    p.add_argument('-t',
-                   '--template',
-                   type=str,
-                   required=True,
-                   help='Path to the template file. Use "-" for stdin.')
+    p = argparse.ArgumentParser(prog=_GetProgramName(), description=__doc__)
+    template_group = p.add_mutually_exclusive_group(required=True)
+    template_group.add_argument(
+        '-t',
+        '--template',
+        type=str,
+        action='append',
+        help='Path to the template file. Use "-" for stdin. Can be repeated,'
+        ' along with -o/--output, to render multiple templates in one process,'
+        ' sharing caches.')
+    template_group.add_argument(
+        '--manifest',
+        type=Path,
+        default=None,
+        help='Path to a JSON or TOML (.toml) file, with a list of templates to'
+        ' render in one process, sharing caches. It should look like'
+        ' `{"templates": [{"template": ..., "output": ..., "args": {...}}]}`.'
+        ' Each entry can also set any other option, using the option name with'
+        ' underscores instead of dashes, e.g "skip_unchanged" or'
+        ' "output_newline"; options not set in an entry are taken from the'
+        ' command line. Relative paths are relative to the current directory,'
+        ' as on the command line.')
     p.add_argument(
         '--cwd',
         type=Path,
@@ -398,8 +1239,11 @@ def main() -> None:
         '-o',
         '--output',
         type=str,
-        default='-',
-        help='Path to the output file. Use "-" for stdout. Defaults to "-".')
+        action='append',
+        default=None,
+        help='Path to the output file. Use "-" for stdout. Must be given once'
+        ' for each -t/--template, if more than one template is given. Defaults'
+        ' to "-".')
     p.add_argument(
         '--rm',
         action='store_true',
@@ -442,6 +1286,109 @@ def main() -> None:
         help=
         'Skip modifying the file if the rendered text is the same as the existing file.'
     )
+    p.add_argument(
+        '--stream',
+        action='store_true',
+        default=False,
+        help='Write the output as it is rendered, in chunks, instead of'
+        ' rendering all of it in memory first; for very large outputs. The'
+        ' output file is still only changed if the render succeeds (it is'
+        ' streamed to a temporary file first), and --check and'
+        ' --skip-unchanged compare it with the existing file chunk by chunk.'
+        ' Defaults to False.')
+    p.add_argument(
+        '--incremental',
+        action='store_true',
+        default=False,
+        help='Record everything the render depended on (the template, its'
+        ' includes, files used by pysnippet() etc., artifacts, cached shell()'
+        ' calls, and the options) in a sidecar file next to the output'
+        ' (<output>.snipinator-deps.json). If none of them changed since, the'
+        ' render is skipped entirely. Renders with uncached shell() calls are'
+        ' never skipped. Defaults to False.')
+    p.add_argument(
+        '--depfile',
+        type=str,
+        default=None,
+        help='Write a Make-format depfile (as used by Make and Ninja) to this'
+        ' path, listing the template, its includes, and every file and path'
+        ' used while rendering as the inputs; and the output and every'
+        ' artifact as the outputs. Not written with --check. Defaults to None.')
+    p.add_argument(
+        '--watch',
+        action='store_true',
+        default=False,
+        help='After rendering, keep running, and re-render a template whenever'
+        ' the template, or any file it depends on, changes. Uses inotify where'
+        ' available, and polls otherwise. Defaults to False.')
+    p.add_argument(
+        '--cache-dir',
+        type=Path,
+        default=None,
+        help='Directory to cache expensive intermediate results in (e.g parsed'
+        ' python symbols, compiled templates, terminal SVGs), across runs.'
+        ' Entries are keyed by the content of their inputs, so the cache can be'
+        ' shared between checkouts and between concurrent runs. Defaults to'
+        ' None, which means no caching across runs.')
+    p.add_argument(
+        '--cache-max-mb',
+        type=int,
+        default=256,
+        help='Maximum size of --cache-dir in MiB; the least recently used'
+        ' entries are evicted after each run. Defaults to 256.')
+    p.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of shell() commands to run concurrently, per template.'
+        ' Only calls with'
+        ' constant arguments, outside of if/for/macro blocks, are run ahead of'
+        ' time; their outputs are still used in template order. Commands that'
+        ' depend on the side effects of other commands should not be run'
+        ' concurrently. Defaults to 1.')
+    p.add_argument(
+        '--svg-processes',
+        type=int,
+        default=1,
+        help='Number of processes to render the terminal SVGs of'
+        ' shell(rich=...) calls in, per template, while the rest of the'
+        ' template renders. With more than 1, the output of a'
+        " shell(rich='svg'|'img+svg') call is a placeholder until the end of"
+        ' the render, so it must be used as is, not changed by a filter.'
+        ' Defaults to 1.')
+    p.add_argument(
+        '--shell-session',
+        action='store_true',
+        default=False,
+        help='Run the shell() commands that are not rich in one long-lived'
+        ' shell per template, instead of starting a shell for each command.'
+        ' Each command still runs in its own subshell, so changes to the'
+        ' working directory or environment do not carry over; commands read'
+        ' stdin from /dev/null. Defaults to False.')
+    p.add_argument(
+        '--shell-timeout',
+        type=float,
+        default=None,
+        help='Timeout in seconds of each shell() command, unless the call'
+        ' specifies its own timeout=. A command that times out is killed, and'
+        ' the render fails with the template line of the call. Defaults to no'
+        ' timeout.')
+    p.add_argument(
+        '--render-budget',
+        type=float,
+        default=None,
+        help='Maximum number of seconds, from the start of the render of a'
+        ' template, for all its shell() commands to finish. A command that is'
+        ' still running then is killed, and the render fails. Defaults to no'
+        ' limit.')
+    p.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+        help='Number of processes to render multiple templates (see'
+        ' --manifest) in. Each process has its own (in-memory) caches.'
+        ' Defaults to 1.')
     warning_group = p.add_mutually_exclusive_group(required=False)
     # TODO(realz): Remove in next major release.
     warning_group.add_argument(
@@ -525,215 +1472,88 @@ def main() -> None:
                    help=_NEWLINE_HELP)
 
     p.add_argument('--version',
-                   action='version',
-                   version=_build_version,
+                   action=_VersionAction,
                    help='Show the version and exit.')
     p.add_argument('--verbose',
                    action='store_true',
                    default=False,
                    help='Print more information.')
-    args = p.parse_args()
-
-    cwd: Path = GetPath(args.cwd)
-    template: str = args.template
-    template_file_name: Union[Path, Literal['-']] = GetIOPath(template)
-    output: Union[Path, Literal['-']] = GetIOPath(args.output)
-    output_base_path: Optional[Path] = args.output_base_path
-    if output_base_path is None:
-      if output == '-':
-        output_base_path = GetPath(cwd)
-      else:
-        output_base_path = output.parent
-    output_base_path = GetPath(output_base_path)
+    # Set only now, because argparse creates a formatter for each
+    # add_argument(), and the rich one is slow to import.
+    p.formatter_class = _MakeHelpFormatter
+    args = p.parse_args(argv)
 
-    artifact_path: Optional[Path] = args.artifact_path
-    if artifact_path is None:
-      if template_file_name == '-':
-        artifact_path = cwd
-      else:
-        artifact_path = template_file_name.parent
-    artifact_path = GetPath(artifact_path)
-
-    template_args: Dict[str, Any] = args.args
-    templates_searchpath: Optional[Path] = GetPath(args.templates_searchpath)
-    verbose: bool = args.verbose
-    template_newline: Optional[str] = args.template_newline
-    output_newline: Optional[str] = args.output_newline
-    block_comment = BlockCommentStyle(*args.block_comment)
-    warning_header: str
-    if args.warning_message is not None:
-      warnings.warn(
-          'The --warning-message option is deprecated, use --warning-header instead.',
-          DeprecationWarning,
-          stacklevel=2)
-      warning_header = f'<!--\n{html.escape(args.warning_message)}\n-->'
-    else:
-      warning_header = args.warning_header
-
-    make_backup: bool
-    if args.make_backup is None:
-      make_backup = False
-    else:
-      make_backup = args.make_backup in _ARGPARSE_BOOL_TRUE
-
-    make_tmp_backup: bool
-    if args.make_tmp_backup is None:
-      make_tmp_backup = not make_backup and output != '-'
-    else:
-      make_tmp_backup = args.make_tmp_backup in _ARGPARSE_BOOL_TRUE
-
-    if args.rm and output == '-':
-      raise ValueError('Cannot use --rm with stdout')
-    if args.move and output == '-':
-      raise ValueError('Cannot use --move with stdout')
-    if make_backup and output == '-':
-      raise ValueError('Cannot use --make-backup true with stdout')
-    if make_tmp_backup and output == '-':
-      raise ValueError('Cannot use --make-tmp-backup true with stdout')
-    if args.chmod and output == '-':
-      raise ValueError('Cannot use --chmod with stdout')
-    if args.chmod_ro and output == '-':
-      raise ValueError('Cannot use --chmod-ro with stdout')
-    if args.create and output == '-':
-      raise ValueError('Cannot use --create with stdout')
-    if args.check and output == '-':
-      raise ValueError('Cannot use --check with stdout')
     ############################################################################
-    template_string: str
-    if template_file_name != '-':
-      # If we are not dealing with stdin:
-
-      # Treat it as a path.
-      if template_file_name.is_absolute():
-        # If the path is absolute, we want a relative path for the file name
-        # (which is used for debugging and error messages).
-        #
-        # TODO: Do we want this behavior?
-        template_file_path = template_file_name
-        template_file_name = template_file_name.relative_to(cwd)
-      else:
-        # If the path is relative, we want to resolve it to an absolute path.
-        template_file_path = cwd / template_file_name
-      with template_file_path.open('r', encoding=None,
-                                   newline=template_newline) as f:
-        template_string = f.read()
-    else:
-      # Template is to be read from stdin.
-      if template_newline is None:
-        # Simple case, nothing was specified for newlines.
-        template_string = sys.stdin.read()
-      else:
-        template_buffer: bytes = sys.stdin.buffer.read()
-        decode_kwargs: Dict[str, Any] = {}
-        with io.StringIO(template_buffer.decode(**decode_kwargs),
-                         newline=template_newline) as template_io:
-          template_string = template_io.read()
+    # Shared by all the templates that are rendered.
+    cache_config: _CacheConfig = (args.cache_dir, args.cache_max_mb)
+    cache = caches.get(cache_config)
+    if cache is None:
+      disk_cache: Optional[DiskCache] = None
+      if args.cache_dir is not None:
+        disk_cache = DiskCache(GetPath(args.cache_dir),
+                               max_bytes=args.cache_max_mb * 1024 * 1024)
+      cache = SnipinateCache(disk_cache=disk_cache)
+      caches[cache_config] = cache
+    disk_cache = cache.disk_cache
     ############################################################################
-    if args.create:
-      if output == '-':
-        raise ValueError('Cannot use --create with stdout')
-      output_path = output
-      if not output_path.exists():
-        output_path.touch()
+    batch = _GetBatch(args)
+    if any(batch_args.output == '-' for batch_args in batch):
+      # Windows<10 requires this, for the output written to stdout.
+      import colorama
+      colorama.init()
+    if args.watch:
+      if args.processes > 1:
+        raise ValueError('Cannot use --processes with --watch')
+      if any(batch_args.template == '-' for batch_args in batch):
+        raise ValueError('Cannot use --watch with stdin')
+      try:
+        _Watch(batch, cache=cache, disk_cache=disk_cache, console=console)
+      except KeyboardInterrupt:
+        pass
+      sys.exit(0)
+      return
+    if len(batch) == 1:
+      status = _Render(batch[0],
+                       cache=cache,
+                       written_files=set(),
+                       console=console)
+      if disk_cache is not None:
+        disk_cache.Prune()
+      sys.exit(1 if status in _FAILED_STATUSES else 0)
+      return
     ############################################################################
-    rendered = Snipinate(template_file_name=template_file_name,
-                         template_string=template_string,
-                         cwd=cwd,
-                         artifact_path=artifact_path,
-                         output_base_path=output_base_path,
-                         template_args=template_args,
-                         templates_searchpath=templates_searchpath,
-                         block_comment=block_comment,
-                         warning_header=warning_header,
-                         skip_unchanged=args.skip_unchanged)
-    ############################################################################
-    if output == '-':
-      # Deal with the stdout case.
-      if output_newline is not None and template_newline is None:
-        # Simple case, nothing was specified for newlines, use python defaults.
-        sys.stdout.write(rendered)
-        sys.exit(0)
-        return
-      else:
-        # Transfer the text from the rendered string to stdout, with the
-        # specified newlines.
-        if output_newline is None:
-          _WriteToFile(rendered=rendered,
-                       template_newline=template_newline,
-                       output_io=sys.stdout)
-        else:
-          # This seems like the only clean way to write custom newlines to
-          # stdout.
-          _WriteToBuffer(rendered=rendered,
-                         template_newline=template_newline,
-                         output_newline=output_newline,
-                         buffer_io=sys.stdout.buffer)
-        sys.exit(0)
-        return
-    ############################################################################
-    output_path = output
-    ############################################################################
-    if args.check or args.skip_unchanged:
-      original_output: Optional[str] = None
-      if output_path.exists():
-        with output_path.open('r', encoding=None, newline=output_newline) as f:
-          original_output = f.read()
-      if args.check:
-        sys.exit(0 if rendered == original_output else 1)
-        return
-      elif args.skip_unchanged:
-        if rendered == original_output:
-          if verbose:
-            console.print(f'Skipping {output_path} because it is unchanged.',
-                          style='bold yellow')
-          sys.exit(0)
-          return
-    ############################################################################
-    backup_path: Optional[Path] = None
-    if make_backup or make_tmp_backup:
-      backup_path = _MakeBackup(output_path, console, verbose=verbose)
-    ############################################################################
-    if args.move:
-      tmp_output_path = output_path.with_suffix(output_path.suffix + '.tmp')
-      _CreateOutputFile(template_newline=template_newline,
-                        output_newline=output_newline,
-                        output_path=tmp_output_path,
-                        rendered=rendered,
-                        console=console)
-      if output_path.exists() and args.rm:
-        _RemoveOutputPath(output_path,
-                          force=args.force,
-                          console=console,
-                          verbose=verbose)
-      _Move(src=tmp_output_path,
-            dst=output_path,
-            force=args.force,
-            console=console,
-            verbose=verbose)
+    results: List[_RenderStatus]
+    if args.processes > 1:
+      results = _RenderBatchInProcesses(
+          batch,
+          processes=args.processes,
+          cache_dir=None if disk_cache is None else disk_cache.path,
+          cache_max_bytes=args.cache_max_mb * 1024 * 1024)
     else:
-      if output_path.exists() and args.rm:
-        _RemoveOutputPath(output_path,
-                          force=args.force,
-                          console=console,
-                          verbose=verbose)
-      _CreateOutputFile(template_newline=template_newline,
-                        output_newline=output_newline,
-                        output_path=output_path,
-                        rendered=rendered,
-                        console=console)
-    ############################################################################
-    _SealOutputFile(output_path=output_path,
-                    chmod=args.chmod,
-                    chmod_ro=args.chmod_ro,
-                    console=console,
-                    verbose=verbose)
+      # Shared by all the templates, so that they cannot overwrite each other's
+      # artifacts.
+      written_files: Set[Path] = set()
+      results = []
+      for batch_args in batch:
+        try:
+          status = _Render(batch_args,
+                           cache=cache,
+                           written_files=written_files,
+                           console=console)
+        except Exception:
+          console.print_exception()
+          status = 'error'
+        results.append(status)
     ############################################################################
-    # If everything was succesful, and --make-tmp-backup was specified, delete
-    # the backup.
-    if make_tmp_backup and backup_path is not None:
-      backup_path.unlink()
-    ############################################################################
-    sys.exit(0)
+    failed = False
+    for batch_args, status in zip(batch, results):
+      failed = failed or status in _FAILED_STATUSES
+      console.print(
+          f'{batch_args.template} -> {batch_args.output}: {status}',
+          style='bold red' if status in _FAILED_STATUSES else 'bold green')
+    if disk_cache is not None:
+      disk_cache.Prune()
+    sys.exit(1 if failed else 0)
     return
   except Exception:
     console.print_exception()
@@ -744,5 +1564,13 @@ def main() -> None:
     return
 
 
+def main() -> None:
+  if sys.argv[1:2] == ['serve']:
+    from . import server
+    server.main(sys.argv[2:])
+    return
+  _Run(None, caches={})
+
+
 if __name__ == '__main__':
   main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, TextIO, Tuple
+
+from .cli import (_SharedWrittenFiles, _TranslateNewlines, _WriteToBuffer,
+                  _WriteToFile)
+
+# Modules that only some features need, and so should not be imported by a
+# render that does not use those features.
+_LAZY_MODULES = [
+    'colorama', 'concurrent.futures', 'defusedxml', 'pexpect', 'rich',
+    'rich_argparse', 'yaml'
+]
+# Total time spent importing modules (excluding the interpreter's own startup)
+# for a pysnippet()-only render. Override with $SNIPINATOR_IMPORT_BUDGET_MS on
+# slow machines.
+_IMPORT_BUDGET_MS = float(os.environ.get('SNIPINATOR_IMPORT_BUDGET_MS', 150))
+
+
+def _ParseImportTimes(stderr: str) -> List[Tuple[str, int]]:
+  """Returns (module, self time in us) of the modules imported after `site`."""
+  imports: List[Tuple[str, int]] = []
+  for line in stderr.splitlines():
+    if not line.startswith('import time:') or 'imported package' in line:
+      continue
+    # import time: <self us> | <cumulative us> | <indentation><module>
+    self_us, _, name = line[len('import time:'):].split('|')
+    name = name.strip()
+    if name == 'site':
+      # Everything before this was the interpreter's startup.
+      imports = []
+      continue
+    imports.append((name, int(self_us)))
+  return imports
+
+
+class StartupTest(unittest.TestCase):
+
+  def test_pysnippet_import_budget(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cwd = Path(tmp_dir)
+      (cwd / 'code.py').write_text(
+          textwrap.dedent('''
+          def f():
+            return 1
+          '''))
+      (cwd / 'README.md.jinja2').write_text("{{ pysnippet('code.py', 'f') }}")
+      result = subprocess.run([
+          sys.executable, '-X', 'importtime', '-m', 'snipinator.cli', '--cwd',
+          str(cwd), '-t',
+          str(cwd / 'README.md.jinja2'), '-o',
+          str(cwd / 'README.md')
+      ],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE,
+                              text=True,
+                              check=False)
+      self.assertEqual(0, result.returncode, result.stderr)
+      self.assertIn('return 1', (cwd / 'README.md').read_text())
+
+    imports = _ParseImportTimes(result.stderr)
+    self.assertTrue(imports, result.stderr)
+    for name, _ in imports:
+      for lazy_module in _LAZY_MODULES:
+        self.assertFalse(
+            name == lazy_module or name.startswith(f'{lazy_module}.'),
+            f'{name} should only be imported when needed')
+    total_ms = sum(self_us for _, self_us in imports) / 1000
+    self.assertLess(
+        total_ms, _IMPORT_BUDGET_MS, 'Slowest imports:\n' +
+        '\n'.join(f'  {name}: {self_us / 1000:.1f}ms' for name, self_us in
+                  sorted(imports, key=lambda item: item[1], reverse=True)[:10]))
+
+  def test_worker_preloads_render_imports(self):
+    # Lists the modules that a rich shell() render imports, in a --processes
+    # worker.
+    script = textwrap.dedent('''\
+        import sys
+        import tempfile
+        from pathlib import Path
+
+        from snipinator.cli import _InitWorker
+        from snipinator.snipinate import BlockCommentStyle, Snipinate
+
+        _InitWorker(None, 0, {})
+        before = set(sys.modules)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+          cwd = Path(tmp_dir)
+          Snipinate(template_file_name='-',
+                    template_string="{{ shell('echo hi', rich='svg') }}",
+                    cwd=cwd,
+                    template_args={},
+                    templates_searchpath=None,
+                    block_comment=BlockCommentStyle(open='<!--', close='-->'),
+                    warning_header='',
+                    artifact_path=cwd,
+                    output_base_path=cwd)
+        print('\\n'.join(sorted(set(sys.modules) - before)))
+        ''')
+    result = subprocess.run([sys.executable, '-c', script],
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            text=True,
+                            check=False)
+    self.assertEqual(0, result.returncode, result.stderr)
+    for name in result.stdout.split():
+      for lazy_module in _LAZY_MODULES:
+        self.assertFalse(
+            name == lazy_module or name.startswith(f'{lazy_module}.'),
+            f'{name} should be imported by _InitWorker()')
+
+
+def _ReferenceWriteToBuffer(rendered: str, template_newline: Optional[str],
+                            output_newline: Optional[str], buffer_io: BinaryIO):
+  """The original, line by line, _WriteToBuffer()."""
+  with io.StringIO(rendered, newline=template_newline) as rendered_io:
+    with io.StringIO(newline=output_newline) as output_io:
+      for line in rendered_io:
+        output_io.write(line)
+      buffer_io.write(output_io.getvalue().encode())
+
+
+def _ReferenceWriteToFile(rendered: str, template_newline: Optional[str],
+                          output_io: TextIO):
+  """The original, line by line, _WriteToFile()."""
+  with io.StringIO(rendered, newline=template_newline) as rendered_io:
+    for line in rendered_io:
+      output_io.write(line)
+
+
+class NewlinesTest(unittest.TestCase):
+
+  def test_same_as_reference(self):
+    rng = random.Random(0)
+    newlines = [None, '', '\n', '\r\n', '\r']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = Path(tmp_dir) / 'output'
+      for _ in range(300):
+        rendered = ''.join(
+            rng.choice(['a', '\n', '\r', '\r\n', '\u00e9'])
+            for _ in range(rng.randint(0, 10)))
+        for template_newline in newlines:
+          if template_newline is not None:
+            with io.StringIO(rendered, newline=template_newline) as f:
+              self.assertEqual(
+                  f.read(),
+                  _TranslateNewlines(rendered,
+                                     template_newline=template_newline,
+                                     output_newline=None))
+          for output_newline in newlines:
+            msg = f'{rendered!r}, {template_newline!r}, {output_newline!r}'
+            with path.open('w', newline=output_newline) as f:
+              _ReferenceWriteToFile(rendered, template_newline, f)
+            expected = path.read_bytes()
+            with path.open('w', newline=output_newline) as f:
+              _WriteToFile(rendered, template_newline, f)
+            self.assertEqual(expected, path.read_bytes(), msg)
+            if output_newline is None:
+              # _WriteToBuffer() is only used for explicit output newlines.
+              continue
+            expected_buffer = io.BytesIO()
+            _ReferenceWriteToBuffer(rendered, template_newline, output_newline,
+                                    expected_buffer)
+            buffer = io.BytesIO()
+            _WriteToBuffer(rendered, template_newline, output_newline, buffer)
+            self.assertEqual(expected_buffer.getvalue(), buffer.getvalue(), msg)
+
+
+class SharedWrittenFilesTest(unittest.TestCase):
+
+  def test_claims(self):
+    claims: Dict[Path, int] = {}
+    first = _SharedWrittenFiles(claims, index=0)
+    second = _SharedWrittenFiles(claims, index=1)
+    first.add(Path('a.svg'))
+    self.assertIn(Path('a.svg'), second)
+    # E.g both templates checked that the artifact was not written yet.
+    with self.assertRaisesRegex(ValueError, 'File already written'):
+      second.add(Path('a.svg'))
+    second.discard(Path('a.svg'))
+    self.assertEqual({Path('a.svg')}, set(first))
+    first.discard(Path('a.svg'))
+    self.assertEqual(0, len(second))
+
+
+if __name__ == '__main__':
+  unittest.main()
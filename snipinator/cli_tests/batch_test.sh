@@ -0,0 +1,115 @@
+#!/bin/bash
+# https://gist.github.com/mohanpedala/1e2ff5661761d3abd0385e8223e16425
+set -e -x -v -u -o pipefail
+
+RED='\033[0;31m'
+GREEN='\033[0;32m'
+NC='\033[0m'
+
+TMP_DIR=$(mktemp -d)
+
+function delete_tmp_dir {
+  rm -rf "${TMP_DIR}"
+}
+trap delete_tmp_dir EXIT
+
+echo 'A {{ name }}' > "${TMP_DIR}/A.md.jinja2"
+echo 'B {{ name }}' > "${TMP_DIR}/B.md.jinja2"
+
+################################################################################
+# Repeated -t/-o pairs.
+python -m snipinator.cli --cwd "${TMP_DIR}" \
+  --args '{"name": "cli"}' \
+  --warning-header '' \
+  -t "${TMP_DIR}/A.md.jinja2" -o "${TMP_DIR}/A.md" \
+  -t "${TMP_DIR}/B.md.jinja2" -o "${TMP_DIR}/B.md"
+
+if [[ "$(cat "${TMP_DIR}/A.md")" != "A cli" || "$(cat "${TMP_DIR}/B.md")" != "B cli" ]]; then
+  echo -e "${RED}Expected both templates to be rendered${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully rendered -t/-o pairs${NC}"
+
+EXIT_CODE=0
+python -m snipinator.cli --cwd "${TMP_DIR}" \
+  -t "${TMP_DIR}/A.md.jinja2" \
+  -t "${TMP_DIR}/B.md.jinja2" -o "${TMP_DIR}/B.md" || EXIT_CODE=$?
+if [[ ${EXIT_CODE} -eq 0 ]]; then
+  echo -e "${RED}Expected mismatched -t/-o to fail${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully failed on mismatched -t/-o${NC}"
+################################################################################
+# Manifest, with per-template options.
+cat <<EOF > "${TMP_DIR}/manifest.json"
+{
+  "templates": [
+    {"template": "${TMP_DIR}/A.md.jinja2", "output": "${TMP_DIR}/A.md"},
+    {"template": "${TMP_DIR}/B.md.jinja2", "output": "${TMP_DIR}/B.md",
+     "args": {"name": "manifest"}}
+  ]
+}
+EOF
+
+# B.md was rendered with different args, so the check should fail, but A.md
+# should pass.
+EXIT_CODE=0
+python -m snipinator.cli --cwd "${TMP_DIR}" \
+  --args '{"name": "cli"}' \
+  --warning-header '' \
+  --manifest "${TMP_DIR}/manifest.json" \
+  --check 2> "${TMP_DIR}/stderr.txt" || EXIT_CODE=$?
+if [[ ${EXIT_CODE} -eq 0 ]]; then
+  echo -e "${RED}Expected --check to fail${NC}"
+  exit 1
+fi
+grep -q 'A.md: check-passed' "${TMP_DIR}/stderr.txt"
+grep -q 'B.md: check-failed' "${TMP_DIR}/stderr.txt"
+echo -e "${GREEN}--check successfully reported per-template status${NC}"
+
+python -m snipinator.cli --cwd "${TMP_DIR}" \
+  --args '{"name": "cli"}' \
+  --warning-header '' \
+  --manifest "${TMP_DIR}/manifest.json"
+if [[ "$(cat "${TMP_DIR}/B.md")" != "B manifest" ]]; then
+  echo -e "${RED}Expected manifest args to be used${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully rendered manifest${NC}"
+################################################################################
+# Multiple processes.
+rm "${TMP_DIR}/A.md" "${TMP_DIR}/B.md"
+python -m snipinator.cli --cwd "${TMP_DIR}" \
+  --args '{"name": "cli"}' \
+  --warning-header '' \
+  --manifest "${TMP_DIR}/manifest.json" \
+  --processes 2
+if [[ "$(cat "${TMP_DIR}/A.md")" != "A cli" || "$(cat "${TMP_DIR}/B.md")" != "B manifest" ]]; then
+  echo -e "${RED}Expected both templates to be rendered${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully rendered manifest with --processes${NC}"
+
+# Two templates writing the same artifact.
+echo "{{ shell('echo hi', rich='same.svg') }}" > "${TMP_DIR}/C.md.jinja2"
+for PROCESSES in 1 2; do
+  rm -f "${TMP_DIR}/C1.md" "${TMP_DIR}/C2.md"
+  EXIT_CODE=0
+  python -m snipinator.cli --cwd "${TMP_DIR}" \
+    --processes "${PROCESSES}" \
+    -t "${TMP_DIR}/C.md.jinja2" -o "${TMP_DIR}/C1.md" \
+    -t "${TMP_DIR}/C.md.jinja2" -o "${TMP_DIR}/C2.md" || EXIT_CODE=$?
+  if [[ ${EXIT_CODE} -eq 0 ]]; then
+    echo -e "${RED}Expected artifact collision to fail, with --processes ${PROCESSES}${NC}"
+    exit 1
+  fi
+  # The template that lost the artifact fails before writing anything.
+  if [[ -f "${TMP_DIR}/C1.md" && -f "${TMP_DIR}/C2.md" ]]; then
+    echo -e "${RED}Expected only one template to be rendered, with --processes ${PROCESSES}${NC}"
+    exit 1
+  fi
+done
+echo -e "${GREEN}Successfully detected artifact collisions${NC}"
+################################################################################
+
+echo -e "${GREEN}${BASH_SOURCE[0]}: All tests passed${NC}"
@@ -0,0 +1,55 @@
+#!/bin/bash
+# https://gist.github.com/mohanpedala/1e2ff5661761d3abd0385e8223e16425
+set -e -x -v -u -o pipefail
+
+RED='\033[0;31m'
+GREEN='\033[0;32m'
+NC='\033[0m'
+
+TMP_DIR=$(mktemp -d)
+
+function delete_tmp_dir {
+  rm -rf "${TMP_DIR}"
+}
+trap delete_tmp_dir EXIT
+
+mkdir -p "${TMP_DIR}/includes"
+echo 'included' > "${TMP_DIR}/includes/part.md.jinja2"
+echo 'data' > "${TMP_DIR}/my data.txt"
+cat <<'EOF' > "${TMP_DIR}/README.md.jinja2"
+{% include 'part.md.jinja2' %}
+{{ rawsnippet('my data.txt') }}
+{{ shell('echo hi', rich='hi.svg') }}
+EOF
+
+python -m snipinator.cli --cwd "${TMP_DIR}" \
+  --templates-searchpath "${TMP_DIR}/includes" \
+  -t "${TMP_DIR}/README.md.jinja2" -o "${TMP_DIR}/README.md" \
+  --depfile "${TMP_DIR}/README.md.d"
+
+cat "${TMP_DIR}/README.md.d"
+head -n 1 "${TMP_DIR}/README.md.d" | grep -q 'README.md .*hi.svg:'
+grep -q 'README.md.jinja2' "${TMP_DIR}/README.md.d"
+grep -q 'includes/part.md.jinja2' "${TMP_DIR}/README.md.d"
+grep -q 'my\\ data.txt' "${TMP_DIR}/README.md.d"
+echo -e "${GREEN}Successfully wrote the depfile${NC}"
+################################################################################
+if command -v make &> /dev/null; then
+  # The depfile paths are relative to the directory snipinator ran in.
+  OUTPUT=$(python -c 'import os,sys; print(os.path.relpath(sys.argv[1]))' "${TMP_DIR}/README.md")
+  printf -- '-include %s.d\n%s:\n\ttouch $@\n' "${OUTPUT}" "${OUTPUT}" > "${TMP_DIR}/Makefile"
+  make -f "${TMP_DIR}/Makefile" -q "${OUTPUT}"
+
+  sleep 1
+  touch "${TMP_DIR}/includes/part.md.jinja2"
+  EXIT_CODE=0
+  make -f "${TMP_DIR}/Makefile" -q "${OUTPUT}" || EXIT_CODE=$?
+  if [[ ${EXIT_CODE} -eq 0 ]]; then
+    echo -e "${RED}Expected make to consider README.md out of date${NC}"
+    exit 1
+  fi
+  echo -e "${GREEN}make successfully read the depfile${NC}"
+fi
+################################################################################
+
+echo -e "${GREEN}${BASH_SOURCE[0]}: All tests passed${NC}"
@@ -0,0 +1,76 @@
+#!/bin/bash
+# https://gist.github.com/mohanpedala/1e2ff5661761d3abd0385e8223e16425
+set -e -x -v -u -o pipefail
+
+RED='\033[0;31m'
+GREEN='\033[0;32m'
+NC='\033[0m'
+
+TMP_DIR=$(mktemp -d)
+
+function delete_tmp_dir {
+  rm -rf "${TMP_DIR}"
+}
+trap delete_tmp_dir EXIT
+
+echo 'line' > "${TMP_DIR}/data.txt"
+cat <<'EOF' > "${TMP_DIR}/README.md.jinja2"
+{{ rawsnippet('data.txt') }}
+{{ shell('cat data.txt', cache=True, inputs=['data.txt']) }}
+EOF
+
+function render {
+  COLUMNS=1000 python -m snipinator.cli --cwd "${TMP_DIR}" \
+    --warning-header '' \
+    --incremental \
+    --verbose \
+    "$@" \
+    -t "${TMP_DIR}/README.md.jinja2" -o "${TMP_DIR}/README.md" \
+    2> "${TMP_DIR}/stderr.txt"
+}
+
+################################################################################
+render
+if [[ ! -f "${TMP_DIR}/README.md.snipinator-deps.json" ]]; then
+  echo -e "${RED}Expected the sidecar manifest to be written${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully wrote the sidecar manifest${NC}"
+
+render
+grep -q 'none of its dependencies changed' "${TMP_DIR}/stderr.txt"
+echo -e "${GREEN}Successfully skipped the unchanged render${NC}"
+
+# Touched, but the content is the same.
+touch "${TMP_DIR}/data.txt"
+render
+grep -q 'none of its dependencies changed' "${TMP_DIR}/stderr.txt"
+echo -e "${GREEN}Successfully skipped the touched render${NC}"
+
+render --args '{"name": "other"}'
+grep -q 'options' "${TMP_DIR}/stderr.txt"
+render
+echo -e "${GREEN}Successfully re-rendered after the options changed${NC}"
+
+echo 'changed' > "${TMP_DIR}/data.txt"
+render
+grep -q 'data.txt changed' "${TMP_DIR}/stderr.txt"
+if [[ "$(grep -c changed "${TMP_DIR}/README.md")" != "2" ]]; then
+  echo -e "${RED}Expected the output to be re-rendered${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully re-rendered after a dependency changed${NC}"
+
+render --check
+grep -q 'none of its dependencies changed' "${TMP_DIR}/stderr.txt"
+echo -e "${GREEN}Successfully passed --check without rendering${NC}"
+################################################################################
+# Uncached shell() calls are never skipped.
+echo "{{ shell('echo hi') }}" > "${TMP_DIR}/README.md.jinja2"
+render
+render
+grep -q 'is not cached' "${TMP_DIR}/stderr.txt"
+echo -e "${GREEN}Successfully re-rendered a volatile template${NC}"
+################################################################################
+
+echo -e "${GREEN}${BASH_SOURCE[0]}: All tests passed${NC}"
@@ -0,0 +1,107 @@
+#!/bin/bash
+# https://gist.github.com/mohanpedala/1e2ff5661761d3abd0385e8223e16425
+set -e -x -v -u -o pipefail
+
+RED='\033[0;31m'
+GREEN='\033[0;32m'
+NC='\033[0m'
+
+TMP_DIR=$(mktemp -d)
+SOCKET="${TMP_DIR}/snipinator.sock"
+SERVE_PID=""
+
+function cleanup {
+  if [[ -n "${SERVE_PID}" ]]; then
+    kill "${SERVE_PID}" || true
+    wait "${SERVE_PID}" || true
+  fi
+  rm -rf "${TMP_DIR}"
+}
+trap cleanup EXIT
+
+python -m snipinator.cli serve --socket "${SOCKET}" 2> "${TMP_DIR}/serve.txt" &
+SERVE_PID=$!
+for _ in $(seq 1 100); do
+  if [[ -S "${SOCKET}" ]]; then
+    break
+  fi
+  sleep 0.1
+done
+
+echo 'hello {{ name }}' > "${TMP_DIR}/A.md.jinja2"
+################################################################################
+python -m snipinator.client --socket "${SOCKET}" \
+  --cwd "${TMP_DIR}" --args '{"name": "client"}' \
+  -t "${TMP_DIR}/A.md.jinja2" > "${TMP_DIR}/client.md"
+python -m snipinator.cli \
+  --cwd "${TMP_DIR}" --args '{"name": "client"}' \
+  -t "${TMP_DIR}/A.md.jinja2" > "${TMP_DIR}/cli.md"
+if ! cmp "${TMP_DIR}/client.md" "${TMP_DIR}/cli.md"; then
+  echo -e "${RED}Expected the client and the cli to render the same${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully rendered through the daemon${NC}"
+
+echo 'stdin {{ 1 + 1 }}' | SNIPINATOR_SOCKET="${SOCKET}" \
+  python -m snipinator.client --warning-header '' -t - > "${TMP_DIR}/stdin.md"
+if [[ "$(cat "${TMP_DIR}/stdin.md")" != "stdin 2" ]]; then
+  echo -e "${RED}Expected stdin to be forwarded${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully forwarded stdin${NC}"
+
+EXIT_CODE=0
+python -m snipinator.client --socket "${SOCKET}" \
+  --cwd "${TMP_DIR}" \
+  -t "${TMP_DIR}/A.md.jinja2" -o "${TMP_DIR}/missing.md" \
+  --check 2> "${TMP_DIR}/stderr.txt" || EXIT_CODE=$?
+if [[ ${EXIT_CODE} -ne 1 ]]; then
+  echo -e "${RED}Expected the exit code of the failed check to be forwarded${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully forwarded the exit code${NC}"
+
+chmod 755 "${TMP_DIR}"
+python -m snipinator.client --socket "${SOCKET}" \
+  --cwd "${TMP_DIR}" --args '{"name": "client"}' \
+  -t "${TMP_DIR}/A.md.jinja2" > "${TMP_DIR}/local.md" \
+  2> "${TMP_DIR}/stderr.txt"
+chmod 700 "${TMP_DIR}"
+if ! grep -q 'rendering locally' "${TMP_DIR}/stderr.txt"; then
+  echo -e "${RED}Expected the client not to use a socket others can access${NC}"
+  exit 1
+fi
+if ! cmp "${TMP_DIR}/local.md" "${TMP_DIR}/cli.md"; then
+  echo -e "${RED}Expected the client to render locally instead${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully refused a socket others can access${NC}"
+################################################################################
+kill "${SERVE_PID}"
+wait "${SERVE_PID}" || true
+SERVE_PID=""
+if [[ -e "${SOCKET}" ]]; then
+  echo -e "${RED}Expected the socket to be removed${NC}"
+  exit 1
+fi
+EXIT_CODE=0
+python -m snipinator.client --socket "${SOCKET}" \
+  -t "${TMP_DIR}/A.md.jinja2" 2> /dev/null || EXIT_CODE=$?
+if [[ ${EXIT_CODE} -eq 0 ]]; then
+  echo -e "${RED}Expected the client to fail without a daemon${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully stopped the daemon${NC}"
+
+mkdir -m 755 "${TMP_DIR}/shared"
+EXIT_CODE=0
+python -m snipinator.cli serve --socket "${TMP_DIR}/shared/snipinator.sock" \
+  2> "${TMP_DIR}/stderr.txt" || EXIT_CODE=$?
+if [[ ${EXIT_CODE} -eq 0 ]] || ! grep -q 'accessible by other users' "${TMP_DIR}/stderr.txt"; then
+  echo -e "${RED}Expected the daemon not to serve in a shared directory${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully refused to serve in a shared directory${NC}"
+################################################################################
+
+echo -e "${GREEN}${BASH_SOURCE[0]}: All tests passed${NC}"
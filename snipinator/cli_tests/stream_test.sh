@@ -0,0 +1,83 @@
+#!/bin/bash
+# https://gist.github.com/mohanpedala/1e2ff5661761d3abd0385e8223e16425
+set -e -x -v -u -o pipefail
+
+RED='\033[0;31m'
+GREEN='\033[0;32m'
+NC='\033[0m'
+
+TMP_DIR=$(mktemp -d)
+
+function delete_tmp_dir {
+  rm -rf "${TMP_DIR}"
+}
+trap delete_tmp_dir EXIT
+
+# Larger than a chunk, with all kinds of newlines, including a '\r\n' split
+# between two chunks.
+python - "${TMP_DIR}/A.md.jinja2" <<'EOF'
+import sys
+text = ('lf\n' 'crlf\r\n' 'cr\r' '{{ "x" * 10 }}\n') * 5000
+text = 'a' * (64 * 1024 - 1) + '\r\n' + text
+open(sys.argv[1], 'w', newline='').write(text)
+EOF
+################################################################################
+set +x +v
+for TEMPLATE_NEWLINE in auto lf crlf cr; do
+  for OUTPUT_NEWLINE in auto lf crlf cr; do
+    OPTIONS=(--cwd "${TMP_DIR}" -t "${TMP_DIR}/A.md.jinja2"
+      --template-newline "${TEMPLATE_NEWLINE}"
+      --output-newline "${OUTPUT_NEWLINE}")
+    python -m snipinator.cli "${OPTIONS[@]}" -o "${TMP_DIR}/expected.md"
+    python -m snipinator.cli "${OPTIONS[@]}" -o "${TMP_DIR}/actual.md" --stream
+    python -m snipinator.cli "${OPTIONS[@]}" > "${TMP_DIR}/expected.stdout"
+    python -m snipinator.cli "${OPTIONS[@]}" --stream > "${TMP_DIR}/actual.stdout"
+    if ! cmp "${TMP_DIR}/expected.md" "${TMP_DIR}/actual.md" \
+      || ! cmp "${TMP_DIR}/expected.stdout" "${TMP_DIR}/actual.stdout"; then
+      echo -e "${RED}Expected --stream to write the same output, with" \
+        "--template-newline ${TEMPLATE_NEWLINE}" \
+        "--output-newline ${OUTPUT_NEWLINE}${NC}"
+      exit 1
+    fi
+    EXPECTED_EXIT_CODE=0
+    python -m snipinator.cli "${OPTIONS[@]}" -o "${TMP_DIR}/expected.md" \
+      --check 2> /dev/null || EXPECTED_EXIT_CODE=$?
+    EXIT_CODE=0
+    python -m snipinator.cli "${OPTIONS[@]}" -o "${TMP_DIR}/expected.md" \
+      --check --stream 2> /dev/null || EXIT_CODE=$?
+    if [[ ${EXIT_CODE} -ne ${EXPECTED_EXIT_CODE} ]]; then
+      echo -e "${RED}Expected --stream to --check the same, with" \
+        "--template-newline ${TEMPLATE_NEWLINE}" \
+        "--output-newline ${OUTPUT_NEWLINE}${NC}"
+      exit 1
+    fi
+  done
+done
+set -x -v
+echo -e "${GREEN}Successfully streamed the same output${NC}"
+################################################################################
+OPTIONS=(--cwd "${TMP_DIR}" -t "${TMP_DIR}/A.md.jinja2" -o "${TMP_DIR}/A.md"
+  --stream)
+python -m snipinator.cli "${OPTIONS[@]}"
+python -m snipinator.cli "${OPTIONS[@]}" --check
+echo 'extra' >> "${TMP_DIR}/A.md"
+EXIT_CODE=0
+python -m snipinator.cli "${OPTIONS[@]}" --check 2> /dev/null || EXIT_CODE=$?
+if [[ ${EXIT_CODE} -eq 0 ]]; then
+  echo -e "${RED}Expected --check to fail on a different file${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully checked chunk by chunk${NC}"
+
+cp "${TMP_DIR}/A.md" "${TMP_DIR}/before.md"
+echo '{{ "y" * 100000 }}{{ missing() }}' >> "${TMP_DIR}/A.md.jinja2"
+EXIT_CODE=0
+python -m snipinator.cli "${OPTIONS[@]}" 2> /dev/null || EXIT_CODE=$?
+if [[ ${EXIT_CODE} -eq 0 ]] || ! cmp "${TMP_DIR}/before.md" "${TMP_DIR}/A.md"; then
+  echo -e "${RED}Expected a failed render to leave the output alone${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully left the output alone on failure${NC}"
+################################################################################
+
+echo -e "${GREEN}${BASH_SOURCE[0]}: All tests passed${NC}"
@@ -0,0 +1,69 @@
+#!/bin/bash
+# https://gist.github.com/mohanpedala/1e2ff5661761d3abd0385e8223e16425
+set -e -x -v -u -o pipefail
+
+RED='\033[0;31m'
+GREEN='\033[0;32m'
+NC='\033[0m'
+
+TMP_DIR=$(mktemp -d)
+WATCH_PID=""
+
+function cleanup {
+  if [[ -n "${WATCH_PID}" ]]; then
+    kill "${WATCH_PID}" || true
+    wait "${WATCH_PID}" || true
+  fi
+  rm -rf "${TMP_DIR}"
+}
+trap cleanup EXIT
+
+# Waits until the file contains the text, or fails after 20 seconds.
+function wait_for {
+  for _ in $(seq 1 200); do
+    if grep -q "$2" "$1" 2> /dev/null; then
+      return 0
+    fi
+    sleep 0.1
+  done
+  echo -e "${RED}Timed out waiting for $1 to contain $2${NC}"
+  cat "${TMP_DIR}/stderr.txt"
+  exit 1
+}
+
+echo 'a1' > "${TMP_DIR}/a.txt"
+echo 'b1' > "${TMP_DIR}/b.txt"
+echo "{{ rawsnippet('a.txt') }}" > "${TMP_DIR}/A.md.jinja2"
+echo "{{ rawsnippet('b.txt') }}" > "${TMP_DIR}/B.md.jinja2"
+
+python -m snipinator.cli --cwd "${TMP_DIR}" \
+  --warning-header '' \
+  --watch \
+  -t "${TMP_DIR}/A.md.jinja2" -o "${TMP_DIR}/A.md" \
+  -t "${TMP_DIR}/B.md.jinja2" -o "${TMP_DIR}/B.md" \
+  2> "${TMP_DIR}/stderr.txt" &
+WATCH_PID=$!
+
+wait_for "${TMP_DIR}/A.md" 'a1'
+wait_for "${TMP_DIR}/B.md" 'b1'
+wait_for "${TMP_DIR}/stderr.txt" 'Watching'
+echo -e "${GREEN}Successfully rendered before watching${NC}"
+################################################################################
+B_MTIME=$(python -c 'import os,sys; print(os.stat(sys.argv[1]).st_mtime_ns)' "${TMP_DIR}/B.md")
+
+echo 'a2' > "${TMP_DIR}/a.txt"
+wait_for "${TMP_DIR}/A.md" 'a2'
+echo -e "${GREEN}Successfully re-rendered after a dependency changed${NC}"
+
+if [[ "$(python -c 'import os,sys; print(os.stat(sys.argv[1]).st_mtime_ns)' "${TMP_DIR}/B.md")" != "${B_MTIME}" ]]; then
+  echo -e "${RED}Expected the unaffected template to not be re-rendered${NC}"
+  exit 1
+fi
+echo -e "${GREEN}Successfully skipped the unaffected template${NC}"
+
+echo "B {{ rawsnippet('b.txt') }}" > "${TMP_DIR}/B.md.jinja2"
+wait_for "${TMP_DIR}/B.md" 'B b1'
+echo -e "${GREEN}Successfully re-rendered after the template changed${NC}"
+################################################################################
+
+echo -e "${GREEN}${BASH_SOURCE[0]}: All tests passed${NC}"
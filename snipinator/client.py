@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Thin client of `snipinator serve`.
+
+Takes the same arguments as snipinator.cli, and has the daemon run them, in the
+current working directory and environment. Prints the daemon's stdout and
+stderr, and exits with its exit code.
+
+If the socket, or its directory, is accessible by other users, it is not used,
+and the arguments are run locally instead.
+
+Usage: python -m snipinator.client [--socket PATH] <snipinator.cli args...>
+"""
+
+import base64
+import os
+import socket
+import sys
+from pathlib import Path
+from typing import List
+
+from .private.daemon import (GetAccessProblem, GetDefaultSocketPath,
+                             ReceiveMessage, SendMessage)
+
+
+def _ReadsStdin(argv: List[str]) -> bool:
+  for index, arg in enumerate(argv):
+    if arg in ('-t', '--template') and argv[index + 1:index + 2] == ['-']:
+      return True
+    if arg in ('-t-', '--template=-'):
+      return True
+  return False
+
+
+def main() -> None:
+  argv = sys.argv[1:]
+  socket_path = GetDefaultSocketPath()
+  if argv[:1] == ['--socket'] and len(argv) >= 2:
+    socket_path = Path(argv[1])
+    argv = argv[2:]
+
+  for path in (socket_path.parent, socket_path):
+    problem = GetAccessProblem(path)
+    if problem is not None:
+      sys.stderr.write(f'Not using `snipinator serve` at {socket_path}:'
+                       f' {problem}; rendering locally\n')
+      # Imported here, because it is slow to import.
+      from . import cli
+      cli._Run(argv, caches={})
+      return
+
+  stdin = None
+  if _ReadsStdin(argv):
+    stdin = base64.b64encode(sys.stdin.buffer.read()).decode()
+  request = {
+      'argv': argv,
+      'cwd': os.getcwd(),
+      'env': dict(os.environ),
+      'stdin': stdin
+  }
+
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    try:
+      sock.connect(str(socket_path))
+    except OSError as e:
+      sys.stderr.write(f'Could not connect to `snipinator serve` at'
+                       f' {socket_path}: {e}\n')
+      sys.exit(1)
+      return
+    SendMessage(sock, request)
+    response = ReceiveMessage(sock)
+  finally:
+    sock.close()
+
+  sys.stdout.buffer.write(base64.b64decode(response['stdout']))
+  sys.stdout.buffer.flush()
+  sys.stderr.buffer.write(base64.b64decode(response['stderr']))
+  sys.stderr.buffer.flush()
+  sys.exit(response['exit_code'])
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Protocol between `snipinator serve` and snipinator.client.
+
+One request and one response per connection, each a JSON object, terminated by
+the sender shutting down its side of the socket.
+
+This module is imported by the client, so it should only import the standard
+library, to keep the client fast to start.
+"""
+
+import json
+import os
+import socket
+import stat
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+SOCKET_ENV_VAR = 'SNIPINATOR_SOCKET'
+
+
+def GetDefaultSocketPath() -> Path:
+  socket_path = os.environ.get(SOCKET_ENV_VAR)
+  if socket_path:
+    return Path(socket_path)
+  runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+  if runtime_dir:
+    return Path(runtime_dir) / 'snipinator.sock'
+  tmp_dir = os.environ.get('TMPDIR', '/tmp')
+  # The temporary directory is shared, so the socket is in a directory that
+  # only the current user can access, see GetAccessProblem().
+  return Path(tmp_dir) / f'snipinator-{os.getuid()}' / 'snipinator.sock'
+
+
+def GetAccessProblem(path: Path) -> Optional[str]:
+  """Checks that only the current user can access the socket or its directory.
+
+  Otherwise, another user could listen on the socket, and get the requests
+  (which include the client's environment), or answer them.
+
+  Returns:
+      Optional[str]: Why the path should not be used, or None if it is only
+        accessible by the current user, or does not exist.
+  """
+  try:
+    path_stat = os.lstat(path)
+  except FileNotFoundError:
+    return None
+  if path_stat.st_uid != os.getuid():
+    return f'{path} is owned by another user'
+  if path_stat.st_mode & 0o077:
+    return (f'{path} is accessible by other users'
+            f' (mode {stat.S_IMODE(path_stat.st_mode):o})')
+  return None
+
+
+def SendMessage(sock: socket.socket, message: Dict[str, Any]) -> None:
+  sock.sendall(json.dumps(message).encode())
+  sock.shutdown(socket.SHUT_WR)
+
+
+def ReceiveMessage(sock: socket.socket) -> Dict[str, Any]:
+  chunks = []
+  while True:
+    chunk = sock.recv(64 * 1024)
+    if not chunk:
+      break
+    chunks.append(chunk)
+  return json.loads(b''.join(chunks))
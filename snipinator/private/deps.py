@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Files recording what a render depended on.
+
+* Sidecar manifests, used by --incremental to skip unchanged renders.
+* Make-format depfiles, used by --depfile to let Make/Ninja skip them.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from ..snipinate import (RenderDependencies, _OutputWindow, _ShellCacheKey,
+                         _ShellCall)
+
+# Bump this if the format of the sidecar manifest changes.
+_DEPS_FORMAT_VERSION = 1
+
+
+def GetDepsPath(output_path: Path) -> Path:
+  """Returns the path of the sidecar manifest of `output_path`."""
+  return output_path.with_name(output_path.name + '.snipinator-deps.json')
+
+
+def _Fingerprint(path: Path) -> Optional[Dict[str, Any]]:
+  """Returns None if the path does not exist."""
+  try:
+    stat = path.stat()
+  except FileNotFoundError:
+    return None
+  if path.is_dir():
+    return {'dir': True}
+  return {
+      'size': stat.st_size,
+      'mtime_ns': stat.st_mtime_ns,
+      'sha256': hashlib.sha256(path.read_bytes()).hexdigest()
+  }
+
+
+def _FingerprintMatches(path: Path, fingerprint: Dict[str, Any]) -> bool:
+  try:
+    stat = path.stat()
+  except FileNotFoundError:
+    return False
+  if path.is_dir() or fingerprint.get('dir'):
+    return path.is_dir() == bool(fingerprint.get('dir'))
+  if stat.st_size != fingerprint['size']:
+    return False
+  if stat.st_mtime_ns == fingerprint['mtime_ns']:
+    return True
+  # Touched, but maybe not changed, e.g by a fresh checkout.
+  return hashlib.sha256(path.read_bytes()).hexdigest() == fingerprint['sha256']
+
+
+def _RelPath(path: Path, base: Path) -> str:
+  return os.path.relpath(path.resolve(), base.resolve())
+
+
+def WriteDeps(*, deps_path: Path, options_key: str, output_path: Path,
+              dependencies: RenderDependencies) -> None:
+  """Writes the sidecar manifest, after `output_path` was rendered."""
+  base = deps_path.parent
+
+  def _Files(paths) -> List[Dict[str, Any]]:
+    return [{
+        'path': _RelPath(path, base),
+        'fingerprint': _Fingerprint(path)
+    } for path in sorted(paths)]
+
+  shell_calls: List[Dict[str, Any]] = []
+  for call, cwd in dependencies.shell_calls:
+    key = _ShellCacheKey(mode=call.mode,
+                         args=call.args,
+                         cwd=cwd,
+                         term=call.term,
+                         rows=call.rows,
+                         cols=call.cols,
+                         inputs=call.inputs,
+                         window=call.window)
+    shell_calls.append({
+        'call': call._asdict(),
+        'cwd': _RelPath(cwd, base),
+        'key': key
+    })
+
+  deps: Dict[str, Any] = {
+      'version': _DEPS_FORMAT_VERSION,
+      'options_key': options_key,
+      'volatile_reasons': dependencies.volatile_reasons,
+      'output': _Files([output_path])[0],
+      'files': _Files(dependencies.files),
+      'paths': [_RelPath(path, base) for path in sorted(dependencies.paths)],
+      'artifacts': _Files(dependencies.artifacts),
+      'shell_calls': shell_calls,
+  }
+  deps_path.write_text(json.dumps(deps, indent=2) + '\n')
+
+
+def CheckDeps(*, deps_path: Path, options_key: str) -> Optional[str]:
+  """Checks if the render can be skipped.
+
+  Returns:
+      Optional[str]: None if nothing that the render depended on changed since
+        the sidecar manifest was written. Otherwise, the reason to render.
+  """
+  if not deps_path.exists():
+    return f'{deps_path} does not exist'
+  try:
+    deps = json.loads(deps_path.read_text())
+  except ValueError:
+    return f'{deps_path} is corrupt'
+  if not isinstance(deps, dict) or deps.get('version') != _DEPS_FORMAT_VERSION:
+    return f'{deps_path} has an unsupported version'
+  if deps['options_key'] != options_key:
+    return 'the options, or the snipinator version, changed'
+  if deps['volatile_reasons']:
+    return ', '.join(deps['volatile_reasons'])
+
+  base = deps_path.parent
+  for entry in [deps['output']] + deps['files'] + deps['artifacts']:
+    path = base / entry['path']
+    if entry['fingerprint'] is None:
+      if path.exists():
+        return f'{path} was created'
+    elif not _FingerprintMatches(path, entry['fingerprint']):
+      return f'{path} changed'
+  for rel_path in deps['paths']:
+    if not (base / rel_path).exists():
+      return f'{base / rel_path} no longer exists'
+  for shell_call in deps['shell_calls']:
+    call = shell_call['call']
+    try:
+      key = _ShellCacheKey(mode=call['mode'],
+                           args=call['args'],
+                           cwd=base / shell_call['cwd'],
+                           term=call['term'],
+                           rows=call['rows'],
+                           cols=call['cols'],
+                           inputs=call['inputs'],
+                           window=_ReadWindow(call.get('window')))
+    except ValueError as e:
+      return str(e)
+    if key != shell_call['key']:
+      return f'the inputs or environment of shell({json.dumps(call["args"])}) changed'
+  return None
+
+
+def _ReadWindow(window: Optional[List[Any]]) -> Optional[_OutputWindow]:
+  return None if window is None else _OutputWindow(*window)
+
+
+def ReadDeps(deps_path: Path) -> RenderDependencies:
+  """Reads the dependencies back from a sidecar manifest that CheckDeps()
+  accepted."""
+  deps = json.loads(deps_path.read_text())
+  base = deps_path.parent
+  dependencies = RenderDependencies()
+  dependencies.files.update(base / entry['path'] for entry in deps['files'])
+  dependencies.paths.update(base / rel_path for rel_path in deps['paths'])
+  dependencies.artifacts.update(base / entry['path']
+                                for entry in deps['artifacts'])
+  for shell_call in deps['shell_calls']:
+    call = dict(shell_call['call'])
+    if call['inputs'] is not None:
+      call['inputs'] = tuple(call['inputs'])
+    if 'window' in call:
+      call['window'] = _ReadWindow(call['window'])
+    dependencies.shell_calls.append(
+        (_ShellCall(**call), base / shell_call['cwd']))
+  dependencies.volatile_reasons.extend(deps['volatile_reasons'])
+  return dependencies
+
+
+def _DepfilePath(path: Path) -> str:
+  try:
+    path_str = os.path.relpath(path)
+  except ValueError:
+    # Different drive on Windows.
+    path_str = str(path.resolve())
+  return (path_str.replace('\\', '/').replace('$',
+                                              '$$').replace('#', '\\#').replace(
+                                                  ' ', '\\ '))
+
+
+def WriteDepfile(*, depfile_path: Path, output_path: Path,
+                 dependencies: RenderDependencies) -> None:
+  """Writes a Make-format depfile, after `output_path` was rendered.
+
+  The artifacts are listed as additional outputs of the rule. All paths are
+  relative to the current working directory, which is where Make/Ninja run
+  snipinator from.
+  """
+  targets = [output_path] + sorted(dependencies.artifacts)
+  # The same file might have been recorded as two different paths, e.g by the
+  # template loader and by rawsnippet().
+  inputs = sorted(
+      {_DepfilePath(path)
+       for path in dependencies.files | dependencies.paths})
+  lines = [' '.join(_DepfilePath(target) for target in targets) + ':']
+  lines += [f'  {path}' for path in inputs]
+  depfile_path.write_text(' \\\n'.join(lines) + '\n')
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""A small on-disk key-value cache, shared between snipinator runs."""
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+# Bump this if the layout of the cache directory changes; old entries are then
+# simply ignored (and eventually pruned by hand).
+_FORMAT_VERSION = 1
+_DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def HashKey(*parts: Union[str, bytes]) -> str:
+  """Hashes the parts into a key suitable for DiskCache."""
+  h = hashlib.sha256()
+  for part in parts:
+    if isinstance(part, str):
+      part = part.encode()
+    # Length-prefix each part so that ('ab', 'c') != ('a', 'bc').
+    h.update(str(len(part)).encode() + b':')
+    h.update(part)
+  return h.hexdigest()
+
+
+class DiskCache:
+  """Content-addressed cache of blobs in a directory.
+
+  * Entries are written to a temporary file, and then atomically renamed into
+    place, so concurrent readers (e.g parallel CI jobs sharing a cache) never
+    see a partial entry.
+  * Every hit refreshes the entry's mtime, and Prune() removes the least
+    recently used entries until the cache fits in `max_bytes`.
+
+  Args:
+      path (Path): The cache directory. Created if it does not exist.
+      max_bytes (Optional[int], optional): Size cap enforced by Prune(). None
+        means unlimited. Defaults to 256MiB.
+  """
+
+  def __init__(self,
+               path: Path,
+               max_bytes: Optional[int] = _DEFAULT_MAX_BYTES) -> None:
+    self.path = path
+    self.max_bytes = max_bytes
+    self._root = path / f'v{_FORMAT_VERSION}'
+
+  def _EntryPath(self, namespace: str, key: str) -> Path:
+    return self._root / namespace / key[:2] / key
+
+  def Get(self, namespace: str, key: str) -> Optional[bytes]:
+    entry_path = self._EntryPath(namespace, key)
+    try:
+      data = entry_path.read_bytes()
+    except FileNotFoundError:
+      return None
+    try:
+      os.utime(entry_path)
+    except OSError:
+      # Might have been pruned by a concurrent process, or read-only.
+      pass
+    return data
+
+  def Put(self, namespace: str, key: str, data: bytes) -> None:
+    entry_path = self._EntryPath(namespace, key)
+    entry_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=entry_path.parent,
+                                    prefix=f'.{key}.',
+                                    suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+      os.replace(tmp_path, entry_path)
+    except BaseException:
+      try:
+        os.unlink(tmp_path)
+      except OSError:
+        pass
+      raise
+
+  def Prune(self) -> None:
+    """Removes the least recently used entries until the cache fits."""
+    if self.max_bytes is None or not self._root.exists():
+      return
+    entries: List[Tuple[int, int, Path]] = []
+    total = 0
+    for dirpath, _, filenames in os.walk(self._root):
+      for filename in filenames:
+        if filename.endswith('.tmp'):
+          continue
+        entry_path = Path(dirpath) / filename
+        try:
+          stat = entry_path.stat()
+        except FileNotFoundError:
+          continue
+        entries.append((stat.st_mtime_ns, stat.st_size, entry_path))
+        total += stat.st_size
+    entries.sort()
+    for _, size, entry_path in entries:
+      if total <= self.max_bytes:
+        break
+      try:
+        entry_path.unlink()
+      except FileNotFoundError:
+        pass
+      total -= size
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from .disk_cache import DiskCache, HashKey
+
+
+class DiskCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self.path = Path(self._tmp_dir.name)
+
+  def tearDown(self):
+    self._tmp_dir.cleanup()
+
+  def test_get_put(self):
+    cache = DiskCache(self.path)
+    key = HashKey('a', 'b')
+    self.assertIsNone(cache.Get('ns', key))
+    cache.Put('ns', key, b'value')
+    self.assertEqual(b'value', cache.Get('ns', key))
+    self.assertIsNone(cache.Get('other-ns', key))
+    self.assertNotEqual(HashKey('ab', ''), HashKey('a', 'b'))
+
+  def test_prune_evicts_least_recently_used(self):
+    cache = DiskCache(self.path, max_bytes=20)
+    keys = [HashKey(str(i)) for i in range(3)]
+    for i, key in enumerate(keys):
+      cache.Put('ns', key, b'x' * 10)
+      # Make the mtimes deterministic, oldest first.
+      entry_path = self.path / 'v1' / 'ns' / key[:2] / key
+      os.utime(entry_path, ns=(i * 10**9, i * 10**9))
+    # A hit makes the oldest entry the most recently used.
+    self.assertIsNotNone(cache.Get('ns', keys[0]))
+    cache.Prune()
+    self.assertIsNotNone(cache.Get('ns', keys[0]))
+    self.assertIsNone(cache.Get('ns', keys[1]))
+    self.assertIsNotNone(cache.Get('ns', keys[2]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Pretty prints XML (the terminal SVGs of shell()) in one pass."""
+
+import functools
+from typing import Callable, List, Optional, Tuple
+
+# The state of an open element.
+#
+# The start tag is not closed yet; there are no children so far, or only text.
+_OPEN = 0
+# The start tag is closed, and the children are written one per line.
+_CHILDREN = 1
+
+
+class _Unsupported(Exception):
+  """The XML has something that PrettyXML() does not handle itself."""
+
+
+def MinidomPrettyXML(xml: str) -> str:
+  """Pretty prints the XML with minidom, and drops the blank lines.
+
+  This is the reference that PrettyXML() is the same as. The DOM is slow to
+  build, and quadratic in the length of long text nodes.
+  """
+  from defusedxml import minidom  # type: ignore[import]
+
+  dom = minidom.parseString(xml)
+  pretty_xml = dom.toprettyxml(indent='')
+  # minidom adds extra lines; remove them
+  return '\n'.join([line for line in pretty_xml.split('\n') if line.strip()])
+
+
+def _MakeEscape(escapes: List[Tuple[str, str]]) -> Callable[[str], str]:
+
+  def _Escape(data: str) -> str:
+    for char, escaped in escapes:
+      if char in data:
+        data = data.replace(char, escaped)
+    return data
+
+  return _Escape
+
+
+@functools.lru_cache(maxsize=None)
+def _MinidomEscapes() -> Tuple[Callable[[str], str], Callable[[str], str]]:
+  """Returns how minidom escapes (text, attribute values).
+
+  Which changes between python versions, e.g 3.13 no longer escapes quotes in
+  text, but does escape newlines in attribute values.
+  """
+  from xml.dom import minidom
+
+  document = minidom.Document()
+  text_escapes: List[Tuple[str, str]] = []
+  attr_escapes: List[Tuple[str, str]] = []
+  # '&' first, because the other escapes start with '&'.
+  for char in '&<>"\'\r\n\t':
+    text_escaped = document.createTextNode(char).toxml()
+    if text_escaped != char:
+      text_escapes.append((char, text_escaped))
+    element = document.createElement('e')
+    element.setAttribute('a', char)
+    attr_escaped = element.toxml()[len('<e a="'):-len('"/>')]
+    if attr_escaped != char:
+      attr_escapes.append((char, attr_escaped))
+  return _MakeEscape(text_escapes), _MakeEscape(attr_escapes)
+
+
+def _QualifiedName(name: str) -> str:
+  """Returns the qualified name from expat's "uri localname prefix" name."""
+  if ' ' not in name:
+    return name
+  parts = name.split(' ')
+  if len(parts) == 3:
+    return f'{parts[2]}:{parts[1]}'
+  if len(parts) == 2:
+    return parts[1]
+  raise _Unsupported(f'Spaces in namespace URIs: {name!r}')
+
+
+class _PrettyXMLWriter:
+  """Writes the pretty XML from expat's events, like minidom's toprettyxml().
+
+  Instead of building the DOM, only the open elements are kept, with the text
+  seen since their last child.
+  """
+
+  def __init__(self) -> None:
+    self._escape_text, self._escape_attr = _MinidomEscapes()
+    self.parts: List[str] = ['<?xml version="1.0" ?>\n']
+    # (qualified name, _OPEN or _CHILDREN) of the open elements.
+    self._open: List[List] = []
+    # The character data since the last event of the innermost open element,
+    # that minidom would merge into a single text node.
+    self._text: List[str] = []
+    # The namespace declarations of the next element.
+    self._namespaces: List[Tuple[Optional[str], Optional[str]]] = []
+
+  def _StartChild(self) -> None:
+    """Writes what comes before a non-text child of the innermost element."""
+    if not self._open:
+      return
+    element = self._open[-1]
+    if element[1] == _OPEN:
+      self.parts.append('>\n')
+      element[1] = _CHILDREN
+    if self._text:
+      self.parts.append(self._escape_text(''.join(self._text)) + '\n')
+      self._text = []
+
+  def StartNamespaceDecl(self, prefix: Optional[str],
+                         uri: Optional[str]) -> None:
+    self._namespaces.append((prefix, uri))
+
+  def StartElement(self, name: str, attributes: List[str]) -> None:
+    self._StartChild()
+    qname = _QualifiedName(name)
+    parts = self.parts
+    parts.append('<' + qname)
+    # Like minidom, the namespace declarations come first.
+    for prefix, uri in self._namespaces:
+      if uri is None:
+        raise _Unsupported('Undeclared default namespace')
+      xmlns = f'xmlns:{prefix}' if prefix else 'xmlns'
+      parts.append(f' {xmlns}="{self._escape_attr(uri)}"')
+    self._namespaces = []
+    escape_attr = self._escape_attr
+    names = attributes[0::2]
+    if any(' ' in attr_name for attr_name in names):
+      names = [_QualifiedName(attr_name) for attr_name in names]
+    parts.extend([
+        f' {attr_name}="{escape_attr(value)}"'
+        for attr_name, value in zip(names, attributes[1::2])
+    ])
+    self._open.append([qname, _OPEN])
+
+  def EndElement(self, name: str) -> None:
+    qname, state = self._open.pop()
+    if state == _CHILDREN:
+      if self._text:
+        self.parts.append(self._escape_text(''.join(self._text)) + '\n')
+      self.parts.append(f'</{qname}>\n')
+    elif self._text:
+      # A single text child is written inline.
+      self.parts.append('>' + self._escape_text(''.join(self._text)) +
+                        f'</{qname}>\n')
+    else:
+      self.parts.append('/>\n')
+    self._text = []
+
+  def CharacterData(self, data: str) -> None:
+    self._text.append(data)
+
+  def Comment(self, data: str) -> None:
+    self._StartChild()
+    self.parts.append(f'<!--{data}-->\n')
+
+  def Unsupported(self, *args) -> None:
+    raise _Unsupported(f'Unsupported XML construct: {args!r}')
+
+  def ExternalEntityRef(self, context: str, base: Optional[str],
+                        system_id: Optional[str],
+                        public_id: Optional[str]) -> int:
+    raise _Unsupported(f'Unsupported external entity: {system_id!r}')
+
+
+def PrettyXML(xml: str) -> str:
+  """Pretty prints the XML, and drops the blank lines.
+
+  Byte for byte the same as MinidomPrettyXML(), but in one pass over expat's
+  events, without building a DOM. XML with a DTD, processing instructions,
+  CDATA sections and the like (which rich's SVGs never have), and invalid XML,
+  fall back to MinidomPrettyXML(), so that they fail in the same way.
+  """
+  from xml.parsers import expat
+
+  writer = _PrettyXMLWriter()
+  # The same parser settings as minidom's ExpatBuilderNS.
+  parser = expat.ParserCreate(namespace_separator=' ')
+  parser.namespace_prefixes = True
+  parser.buffer_text = True
+  parser.ordered_attributes = True
+  parser.specified_attributes = True
+  parser.StartNamespaceDeclHandler = writer.StartNamespaceDecl
+  parser.StartElementHandler = writer.StartElement
+  parser.EndElementHandler = writer.EndElement
+  parser.CharacterDataHandler = writer.CharacterData
+  parser.CommentHandler = writer.Comment
+  parser.XmlDeclHandler = writer.Unsupported
+  parser.StartDoctypeDeclHandler = writer.Unsupported
+  parser.ProcessingInstructionHandler = writer.Unsupported
+  parser.StartCdataSectionHandler = writer.Unsupported
+  parser.ExternalEntityRefHandler = writer.ExternalEntityRef
+  try:
+    parser.Parse(xml, True)
+  except (_Unsupported, expat.ExpatError):
+    return MinidomPrettyXML(xml)
+  pretty_xml = ''.join(writer.parts)
+  return '\n'.join([line for line in pretty_xml.split('\n') if line.strip()])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import random
+import unittest
+
+from .pretty_xml import MinidomPrettyXML, PrettyXML
+
+_ATTRIBUTE_VALUES = [
+    'x', '&amp;&lt;&gt;&quot;', '\t\n', '&#10;&#9;', 'é', '&apos;'
+]
+
+
+def _RandomXML(rng: random.Random, depth: int = 0) -> str:
+  tag = rng.choice(['a', 'b', 'svg:c'])
+  attrs = ''.join(f' {name}="{rng.choice(_ATTRIBUTE_VALUES)}"'
+                  for name in rng.sample(['p', 'q', 'r'], rng.randint(0, 3)))
+  children = []
+  for _ in range(rng.randint(0, 4) if depth < 4 else 0):
+    kind = rng.random()
+    if kind < 0.4:
+      children.append(_RandomXML(rng, depth + 1))
+    elif kind < 0.8:
+      children.append(
+          rng.choice([
+              'text', '  ', '\n', '&amp;&lt;&gt;"\'', '&#160;', '\r\n x',
+              '&#13;', 'é \n  y '
+          ]))
+    else:
+      children.append(rng.choice(['<!-- c -->', '<!--\n-->']))
+  return f'<{tag}{attrs}>' + ''.join(children) + f'</{tag}>'
+
+
+class PrettyXMLTest(unittest.TestCase):
+
+  def test_same_as_minidom(self):
+    rng = random.Random(0)
+    for _ in range(1000):
+      xml = (f'<!-- before --><root xmlns="urn:d" xmlns:svg="urn:s">'
+             f'{_RandomXML(rng)}</root>')
+      self.assertEqual(MinidomPrettyXML(xml), PrettyXML(xml), xml)
+
+  def test_rich_svg(self):
+    from io import StringIO
+
+    from rich.console import Console
+    from rich.terminal_theme import MONOKAI
+    from rich.text import Text
+
+    console = Console(record=True,
+                      force_terminal=True,
+                      width=40,
+                      file=StringIO())
+    console.print(
+        Text.from_ansi('\x1b[32mPASSED\x1b[0m <&"\'>  é\n\x1b[1;31m1 failed'
+                       '\x1b[0m\t\r\n'))
+    svg = console.export_svg(theme=MONOKAI)
+    self.assertEqual(MinidomPrettyXML(svg), PrettyXML(svg))
+
+  def test_falls_back(self):
+    for xml in [
+        '<?xml version="1.0"?><a/>', '<!DOCTYPE a><a/>',
+        '<a><![CDATA[x<]]></a>', '<a><?pi x?></a>'
+    ]:
+      self.assertEqual(MinidomPrettyXML(xml), PrettyXML(xml), xml)
+    with self.assertRaises(Exception):
+      PrettyXML('<a>')
+
+
+if __name__ == '__main__':
+  unittest.main()
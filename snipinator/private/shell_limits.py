@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Reads the output of shell commands within a time and size limit."""
+
+import contextlib
+import errno
+import os
+import select
+import signal
+import time
+from typing import NamedTuple, Optional
+
+
+class ShellLimitError(Exception):
+  """A shell command ran out of time, or wrote too much output."""
+
+
+class ShellLimits(NamedTuple):
+  """The limits of a shell command.
+
+  `deadline` is in time.monotonic() seconds, and `timeout_message` says why
+  (e.g "timed out after 5s"). None means no limit.
+  """
+
+  deadline: Optional[float] = None
+  timeout_message: str = ''
+  max_output_bytes: Optional[int] = None
+
+  def CheckTime(self) -> None:
+    """Raises ShellLimitError if the deadline has passed."""
+    if self.deadline is not None and time.monotonic() >= self.deadline:
+      raise ShellLimitError(self.timeout_message)
+
+  def Remaining(self) -> Optional[float]:
+    """The seconds left until the deadline, if any; raises if none are left."""
+    if self.deadline is None:
+      return None
+    self.CheckTime()
+    return self.deadline - time.monotonic()
+
+
+def ReadChunk(fd: int, *, limits: ShellLimits, output_size: int) -> bytes:
+  """Reads the next chunk of output from `fd`, or b'' at the end.
+
+  Args:
+      fd (int): A pipe, or the controller side of a pseudo-terminal.
+      limits (ShellLimits): The limits of the command.
+      output_size (int): The number of bytes of output read so far.
+
+  Raises:
+      ShellLimitError: If the deadline passes before there is more output, or
+        the output would be more than `max_output_bytes`.
+  """
+  remaining = limits.Remaining()
+  if remaining is not None and not select.select([fd], [], [], remaining)[0]:
+    raise ShellLimitError(limits.timeout_message)
+  try:
+    chunk = os.read(fd, 64 * 1024)
+  except OSError as e:
+    # A pseudo-terminal signals the end of the output with EIO.
+    if e.errno != errno.EIO:
+      raise
+    chunk = b''
+  if (limits.max_output_bytes is not None
+      and output_size + len(chunk) > limits.max_output_bytes):
+    raise ShellLimitError(
+        f'wrote more than {limits.max_output_bytes} bytes of output')
+  return chunk
+
+
+def KillProcessGroup(pid: int) -> None:
+  """Kills the command started in its own session, with its subprocesses."""
+  with contextlib.suppress(ProcessLookupError):
+    os.killpg(pid, signal.SIGKILL)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Runs many shell commands through one long-lived shell process."""
+
+import locale
+import os
+import secrets
+import shlex
+import subprocess
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+from .shell_limits import (KillProcessGroup, ReadChunk, ShellLimitError,
+                           ShellLimits)
+
+
+class ShellSession:
+  """A /bin/sh process that runs commands like `sh -c`, one at a time.
+
+  Starting a shell for every command is what dominates the time of many small
+  commands. Instead, each command runs in a subshell of this shell, so that
+  changes to the working directory, environment variables etc. do not leak
+  into the next command. The output of each command (stdout and stderr) is
+  followed by a random sentinel line with its exit code.
+
+  Unlike `sh -c`, the commands read their stdin from /dev/null. If a command
+  exceeds its limits, the whole session is killed, and the next command starts
+  a new one.
+
+  The shell is started by the first command, and is thread safe; the commands
+  run one at a time.
+  """
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._process: Optional[subprocess.Popen] = None
+    self._sentinel = f'snipinator-{secrets.token_hex(16)}'.encode()
+    # What is left of the output after the last sentinel line, normally empty.
+    self._pending = b''
+
+  def _Start(self) -> subprocess.Popen:
+    if self._process is None:
+      self._process = subprocess.Popen(['/bin/sh'],
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT,
+                                       start_new_session=True)
+    return self._process
+
+  def Run(self, args: str, cwd: Path,
+          limits: ShellLimits = ShellLimits()) -> str:
+    """Same as subprocess.run(args, cwd=cwd, shell=True, text=True, check=True).
+
+    With stdout and stderr captured together.
+
+    Args:
+        args (str): The command.
+        cwd (Path): The working directory of the command.
+        limits (ShellLimits, optional): The limits of the command. Defaults to
+          no limits.
+
+    Returns:
+        str: The output of the command, with universal newlines.
+
+    Raises:
+        subprocess.CalledProcessError: If the command fails.
+        ShellLimitError: If the command exceeds its limits.
+    """
+    command = (f'( cd -- {shlex.quote(os.path.abspath(cwd))} &&'
+               f' eval {shlex.quote(args)} ) </dev/null\n'
+               f'printf \'\\n%s %s\\n\' {self._sentinel.decode()} "$?"\n')
+    with self._lock:
+      process = self._Start()
+      assert process.stdin is not None
+      process.stdin.write(command.encode())
+      process.stdin.flush()
+      try:
+        output, returncode = self._ReadUntilSentinel(process, limits)
+      except ShellLimitError:
+        KillProcessGroup(process.pid)
+        self._Stop()
+        raise
+    text = output.decode(locale.getpreferredencoding(False))
+    # Like text=True.
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if returncode != 0:
+      raise subprocess.CalledProcessError(returncode, args, output=text)
+    return text
+
+  def _ReadUntilSentinel(self, process: subprocess.Popen,
+                         limits: ShellLimits) -> Tuple[bytes, int]:
+    assert process.stdout is not None
+    marker = b'\n' + self._sentinel + b' '
+    # Room for the sentinel line (with an exit code of up to 3 digits).
+    sentinel_size = len(marker) + 4
+    buffer = bytearray(self._pending)
+    # Where to look for the marker next, so that each byte is searched once.
+    search_start = 0
+    while True:
+      start = buffer.find(marker, search_start)
+      if start != -1:
+        end = buffer.find(b'\n', start + len(marker))
+        if end != -1:
+          if (limits.max_output_bytes is not None
+              and start > limits.max_output_bytes):
+            raise ShellLimitError(
+                f'wrote more than {limits.max_output_bytes} bytes of output')
+          self._pending = bytes(buffer[end + 1:])
+          return bytes(buffer[:start]), int(buffer[start + len(marker):end])
+      else:
+        search_start = max(0, len(buffer) - len(marker) + 1)
+      # Not counting the sentinel line, which can be in the same chunk.
+      chunk = ReadChunk(process.stdout.fileno(),
+                        limits=limits,
+                        output_size=len(buffer) - sentinel_size)
+      if not chunk:
+        self._Stop()
+        raise Exception('The shell session exited unexpectedly')
+      buffer += chunk
+
+  def _Stop(self) -> None:
+    process, self._process = self._process, None
+    self._pending = b''
+    if process is None:
+      return
+    assert process.stdin is not None
+    assert process.stdout is not None
+    try:
+      process.stdin.close()
+    except BrokenPipeError:
+      pass
+    process.wait()
+    process.stdout.close()
+
+  def Close(self) -> None:
+    """Stops the shell; a later command starts a new one."""
+    with self._lock:
+      self._Stop()
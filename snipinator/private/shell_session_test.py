@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from .shell_limits import ShellLimitError, ShellLimits
+from .shell_session import ShellSession
+
+_COMMANDS = [
+    'echo hello', 'printf "no newline"', 'echo out; echo err >&2', 'pwd',
+    'printf "a\\r\\nb\\rc"', 'echo é', 'true', 'echo "$X"', 'echo x | tr x y',
+    'cat <<EOF\nheredoc\nEOF', 'exec echo replaced', 'umask',
+    "printf '%s\\n' \"$(seq 1 20000)\" | tail -n 1"
+]
+
+
+def _Run(args: str, cwd: Path) -> subprocess.CompletedProcess:
+  return subprocess.run(args,
+                        cwd=cwd,
+                        stdin=subprocess.DEVNULL,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT,
+                        text=True,
+                        shell=True)
+
+
+class ShellSessionTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self.cwd = Path(self._tmp_dir.name)
+    self.session = ShellSession()
+
+  def tearDown(self):
+    self.session.Close()
+    self._tmp_dir.cleanup()
+
+  def test_same_as_sh_c(self):
+    for args in _COMMANDS:
+      self.assertEqual(
+          _Run(args, self.cwd).stdout, self.session.Run(args, self.cwd), args)
+
+  def test_isolated(self):
+    self.session.Run('cd /; export X=1; umask 077; f() { echo f; }',
+                     cwd=self.cwd)
+    self.assertEqual(f'{self.cwd.resolve()}\n\n0022\n',
+                     self.session.Run('pwd -P; echo "$X"; umask', self.cwd))
+    with self.assertRaises(subprocess.CalledProcessError):
+      self.session.Run('f', self.cwd)
+
+  def test_large_output(self):
+    args = 'seq 1 200000'
+    self.assertEqual(
+        _Run(args, self.cwd).stdout, self.session.Run(args, self.cwd))
+
+  def test_fails(self):
+    for args in ['echo out; exit 3', 'if then', 'false']:
+      expected = _Run(args, self.cwd)
+      with self.assertRaises(subprocess.CalledProcessError) as cm:
+        self.session.Run(args, self.cwd)
+      self.assertEqual(expected.returncode, cm.exception.returncode, args)
+    self.assertEqual('after\n', self.session.Run('echo after', self.cwd))
+
+  def test_sentinel_in_output(self):
+    args = "printf '\\nsnipinator-0 1\\n'"
+    self.assertEqual(
+        _Run(args, self.cwd).stdout, self.session.Run(args, self.cwd))
+
+  def test_limits(self):
+    with self.assertRaisesRegex(ShellLimitError, 'timed out'):
+      self.session.Run('sleep 10',
+                       self.cwd,
+                       limits=ShellLimits(deadline=time.monotonic() + 0.1,
+                                          timeout_message='timed out'))
+    with self.assertRaisesRegex(ShellLimitError, 'more than 10 bytes'):
+      self.session.Run('seq 1 100', self.cwd, ShellLimits(max_output_bytes=10))
+    self.assertEqual(
+        '1\n2\n3\n4\n5\n',
+        self.session.Run('seq 1 5', self.cwd, ShellLimits(max_output_bytes=10)))
+
+  def test_restarts(self):
+    self.assertEqual('1\n', self.session.Run('echo 1', self.cwd))
+    self.session.Close()
+    self.assertEqual('2\n', self.session.Run('echo 2', self.cwd))
+
+  def test_threads(self):
+    outputs = {}
+
+    def _Worker(i: int) -> None:
+      outputs[i] = self.session.Run(f'echo {i}', self.cwd)
+
+    threads = [threading.Thread(target=_Worker, args=(i, )) for i in range(20)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual({i: f'{i}\n' for i in range(20)}, outputs)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""Waits for files to change, using inotify where available, else polling."""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_POLL_INTERVAL = 0.5
+_DEFAULT_DEBOUNCE = 0.2
+
+# From <sys/inotify.h>.
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM
+            | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF
+            | _IN_MOVE_SELF)
+
+# None: the file does not exist. For directories, only their existence matters.
+_StatKey = Optional[Union[Tuple[int, int], str]]
+_Snapshot = Dict[Path, _StatKey]
+
+
+def _GetStatKey(path: Path) -> _StatKey:
+  try:
+    stat = path.stat()
+  except (FileNotFoundError, NotADirectoryError):
+    return None
+  if path.is_dir():
+    return 'dir'
+  return (stat.st_size, stat.st_mtime_ns)
+
+
+class _Inotify:
+  """Wakes up on any change in a set of directories.
+
+  The events themselves are not parsed; after waking up, the caller compares
+  the stats of the files it cares about.
+  """
+
+  def __init__(self, fd: int) -> None:
+    self._fd = fd
+
+  @staticmethod
+  def Create(dirs: Iterable[Path]) -> Optional['_Inotify']:
+    """Returns None if inotify is not available."""
+    if not sys.platform.startswith('linux'):
+      return None
+    libc_name = ctypes.util.find_library('c')
+    if libc_name is None:
+      return None
+    try:
+      libc = ctypes.CDLL(libc_name, use_errno=True)
+      inotify_init1 = libc.inotify_init1
+      inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+      return None
+    inotify_add_watch.argtypes = [
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+    ]
+    fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+      logger.debug('inotify_init1 failed: %s', os.strerror(ctypes.get_errno()))
+      return None
+    for dir_path in dirs:
+      if inotify_add_watch(fd, os.fsencode(dir_path), _IN_MASK) < 0:
+        logger.debug('inotify_add_watch(%s) failed: %s', dir_path,
+                     os.strerror(ctypes.get_errno()))
+        os.close(fd)
+        return None
+    return _Inotify(fd)
+
+  def Wait(self, timeout: Optional[float]) -> bool:
+    """Returns True if there were any events before the timeout."""
+    readable, _, _ = select.select([self._fd], [], [], timeout)
+    if not readable:
+      return False
+    # Drain the events.
+    try:
+      while os.read(self._fd, 64 * 1024):
+        pass
+    except BlockingIOError:
+      pass
+    return True
+
+  def Close(self) -> None:
+    os.close(self._fd)
+
+
+def _GetWatchDirs(paths: Iterable[Path]) -> Set[Path]:
+  """Returns the directories to watch, to see changes to `paths`.
+
+  Editors often save by writing a new file and renaming it over the old one, so
+  the parent directories are watched, rather than the files themselves. Missing
+  files are watched through their nearest existing ancestor.
+  """
+  dirs: Set[Path] = set()
+  for path in paths:
+    path = path.resolve()
+    if path.is_dir():
+      dirs.add(path)
+    parent = path.parent
+    while not parent.is_dir() and parent != parent.parent:
+      parent = parent.parent
+    dirs.add(parent)
+  return dirs
+
+
+class Watcher:
+  """Waits for any of a set of files to change.
+
+  Args:
+      poll_interval (float, optional): Seconds between checks, when inotify is
+        not available. Defaults to 0.5.
+      debounce (float, optional): Waits until there were no changes for this
+        many seconds, so that a burst of saves is reported once. Defaults to
+        0.2.
+      use_inotify (bool, optional): Set to False to always poll. Defaults to
+        True.
+  """
+
+  def __init__(self,
+               poll_interval: float = _DEFAULT_POLL_INTERVAL,
+               debounce: float = _DEFAULT_DEBOUNCE,
+               use_inotify: bool = True) -> None:
+    self.poll_interval = poll_interval
+    self.debounce = debounce
+    self.use_inotify = use_inotify
+
+  def Snapshot(self, paths: Iterable[Path]) -> _Snapshot:
+    return {path: _GetStatKey(path) for path in paths}
+
+  def WaitForChanges(self, snapshot: _Snapshot) -> Set[Path]:
+    """Blocks until some of the files in the snapshot change.
+
+    Returns:
+        Set[Path]: The files whose stats differ from the snapshot.
+    """
+    notifier: Optional[_Inotify] = None
+    if self.use_inotify:
+      notifier = _Inotify.Create(_GetWatchDirs(snapshot))
+    try:
+      while True:
+        # Checked before waiting, in case something changed before the
+        # watches were added.
+        current = self.Snapshot(snapshot)
+        if current == snapshot:
+          if notifier is not None:
+            notifier.Wait(None)
+          else:
+            time.sleep(self.poll_interval)
+          continue
+        # Debounce.
+        while True:
+          if notifier is not None:
+            if not notifier.Wait(self.debounce):
+              break
+            current = self.Snapshot(snapshot)
+          else:
+            time.sleep(self.debounce)
+            again = self.Snapshot(snapshot)
+            if again == current:
+              break
+            current = again
+        changed = {
+            path
+            for path, key in current.items()
+            if key != snapshot[path]
+        }
+        if changed:
+          return changed
+    finally:
+      if notifier is not None:
+        notifier.Close()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from .watch import Watcher
+
+
+class WatcherTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self.path = Path(self._tmp_dir.name)
+    self.a = self.path / 'a.txt'
+    self.b = self.path / 'b.txt'
+    self.missing = self.path / 'sub' / 'missing.txt'
+    self.a.write_text('a')
+    self.b.write_text('b')
+
+  def tearDown(self):
+    self._tmp_dir.cleanup()
+
+  def _WaitWhile(self, watcher: Watcher, action) -> set:
+    snapshot = watcher.Snapshot([self.a, self.b, self.missing])
+
+    def _Act():
+      time.sleep(0.2)
+      action()
+
+    thread = threading.Thread(target=_Act)
+    thread.start()
+    try:
+      return watcher.WaitForChanges(snapshot)
+    finally:
+      thread.join()
+
+  def _Save(self, path: Path, text: str):
+    # Save the way editors do, by renaming a new file over the old one.
+    tmp_path = path.with_suffix('.tmp')
+    tmp_path.write_text(text)
+    tmp_path.replace(path)
+
+  def test_changes(self):
+    for use_inotify in (True, False):
+      with self.subTest(use_inotify=use_inotify):
+        watcher = Watcher(poll_interval=0.05,
+                          debounce=0.1,
+                          use_inotify=use_inotify)
+        self.assertEqual({self.a},
+                         self._WaitWhile(watcher,
+                                         lambda: self._Save(self.a, 'aa')))
+
+        def _Create():
+          self.missing.parent.mkdir()
+          self.missing.write_text('created')
+
+        self.assertEqual({self.missing}, self._WaitWhile(watcher, _Create))
+        self.missing.unlink()
+        self.missing.parent.rmdir()
+
+  def test_debounces_bursts(self):
+    watcher = Watcher(poll_interval=0.05, debounce=0.3)
+
+    def _Burst():
+      self._Save(self.a, 'a1')
+      time.sleep(0.1)
+      self._Save(self.b, 'b1')
+
+    self.assertEqual({self.a, self.b}, self._WaitWhile(watcher, _Burst))
+
+
+if __name__ == '__main__':
+  unittest.main()
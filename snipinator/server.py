@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Snipinator project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+"""`snipinator serve`: a daemon that runs snipinator.cli for snipinator.client.
+
+The daemon pays for the imports once, and keeps its caches (parsed python
+symbols, shell() results) warm across requests. Requests are handled one at a
+time, because each runs in the client's working directory and environment.
+"""
+
+import argparse
+import base64
+import io
+import os
+import shlex
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from rich.console import Console
+
+from . import cli
+from .private.daemon import (GetAccessProblem, GetDefaultSocketPath,
+                             ReceiveMessage, SendMessage)
+from .snipinate import SnipinateCache
+
+
+def _GetExitCode(code: Any) -> int:
+  if code is None:
+    return 0
+  if isinstance(code, int):
+    return code
+  sys.stderr.write(f'{code}\n')
+  return 1
+
+
+def _HandleRequest(
+    request: Dict[str, Any], caches: Dict[cli._CacheConfig,
+                                          SnipinateCache]) -> Dict[str, Any]:
+  argv: List[str] = request['argv']
+  stdin = b''
+  if request['stdin'] is not None:
+    stdin = base64.b64decode(request['stdin'])
+  stdout_buffer = io.BytesIO()
+  stderr_buffer = io.BytesIO()
+
+  original_streams = (sys.stdin, sys.stdout, sys.stderr)
+  original_cwd = os.getcwd()
+  original_env = dict(os.environ)
+  streams = (io.TextIOWrapper(io.BytesIO(stdin)),
+             io.TextIOWrapper(stdout_buffer, write_through=True),
+             io.TextIOWrapper(stderr_buffer, write_through=True))
+  sys.stdin, sys.stdout, sys.stderr = streams
+  exit_code = 0
+  try:
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    if '--watch' in argv:
+      raise ValueError('Cannot use --watch with `snipinator serve`')
+    cli._Run(argv, caches=caches)
+  except SystemExit as e:
+    exit_code = _GetExitCode(e.code)
+  except Exception as e:
+    sys.stderr.write(f'{type(e).__name__}: {e}\n')
+    exit_code = 1
+  finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    sys.stdin, sys.stdout, sys.stderr = original_streams
+    # Otherwise the buffers are closed along with the wrappers, once those are
+    # garbage collected.
+    for stream in streams:
+      stream.detach()
+    os.environ.clear()
+    os.environ.update(original_env)
+    os.chdir(original_cwd)
+  return {
+      'exit_code': exit_code,
+      'stdout': base64.b64encode(stdout_buffer.getvalue()).decode(),
+      'stderr': base64.b64encode(stderr_buffer.getvalue()).decode()
+  }
+
+
+def _IsListening(socket_path: Path) -> bool:
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(str(socket_path))
+    return True
+  except OSError:
+    return False
+  finally:
+    sock.close()
+
+
+def Serve(socket_path: Path, console: Console) -> None:
+  """Serves requests on the unix socket until interrupted."""
+  if not socket_path.parent.exists():
+    # E.g the per-user directory of the default socket.
+    socket_path.parent.mkdir(mode=0o700, parents=True)
+  problem = GetAccessProblem(socket_path.parent)
+  if problem is not None:
+    raise ValueError(f'Cannot serve on {socket_path}: {problem}')
+  if socket_path.exists():
+    if _IsListening(socket_path):
+      raise ValueError(f'Already serving on {socket_path}')
+    # Left over from a daemon that was killed.
+    socket_path.unlink()
+
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  # Only the current user may connect.
+  original_umask = os.umask(0o177)
+  try:
+    server.bind(str(socket_path))
+  finally:
+    os.umask(original_umask)
+  try:
+    server.listen()
+    console.print(f'Serving on {socket_path}', style='bold green')
+    caches: Dict[cli._CacheConfig, SnipinateCache] = {}
+    while True:
+      conn, _ = server.accept()
+      with conn:
+        start = time.monotonic()
+        try:
+          request = ReceiveMessage(conn)
+        except (OSError, ValueError) as e:
+          console.print(f'Ignoring bad request: {e}', style='bold red')
+          continue
+        response = _HandleRequest(request, caches=caches)
+        try:
+          SendMessage(conn, response)
+        except OSError as e:
+          console.print(f'Failed to respond: {e}', style='bold red')
+        elapsed_ms = (time.monotonic() - start) * 1000
+        console.print(
+            f'{shlex.join(request["argv"])}: exit code'
+            f' {response["exit_code"]}, {elapsed_ms:.0f}ms',
+            style='bold red' if response['exit_code'] else 'bold green')
+  finally:
+    server.close()
+    socket_path.unlink()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+  console = Console(file=sys.stderr)
+  p = argparse.ArgumentParser(prog='snipinator serve', description=__doc__)
+  p.add_argument('--socket',
+                 type=Path,
+                 default=GetDefaultSocketPath(),
+                 help='The unix socket to listen on. Defaults to'
+                 ' $SNIPINATOR_SOCKET, else $XDG_RUNTIME_DIR/snipinator.sock,'
+                 ' else a per-user socket in the temporary directory. Its'
+                 ' directory must only be accessible by the current user.')
+  args = p.parse_args(argv)
+  # Exit cleanly (removing the socket) when killed.
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  try:
+    Serve(args.socket, console=console)
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == '__main__':
+  main()
@@ -8,30 +8,49 @@
 
 import ast
 import base64
+import codecs
+import collections
+import contextlib
+import contextvars
+import functools
 import html
+import inspect
+import io
 import json
+import locale
 import logging
 import os
 import re
 import subprocess
 import sys
 import textwrap
-from functools import partial
+import time
+from array import array
 from io import StringIO
 from pathlib import Path
-from typing import Generator, List, NamedTuple, Optional, Set, Union
+from types import FrameType
+from typing import (TYPE_CHECKING, Any, Callable, Deque, Dict, Generator,
+                    Iterable, Iterator, List, MutableSet, NamedTuple, Optional,
+                    Sequence, Set, Tuple, Union)
 
 import markupsafe
-import pexpect  # type: ignore[import]
-import yaml
-from defusedxml import minidom  # type: ignore[import]
-from jinja2 import Environment, FileSystemLoader, TemplateSyntaxError
-from rich.console import Console
-from rich.terminal_theme import MONOKAI
-from rich.text import Text
-from rich.themes import DEFAULT as DEFAULT_THEME
+from jinja2 import (BytecodeCache, Environment, FileSystemLoader, Template,
+                    TemplateSyntaxError)
+from jinja2 import __version__ as _JINJA2_VERSION
+from jinja2 import nodes
+from jinja2.bccache import Bucket
 from typing_extensions import Literal
 
+from .private.disk_cache import DiskCache, HashKey
+from .private.pretty_xml import PrettyXML
+from .private.shell_limits import (KillProcessGroup, ReadChunk, ShellLimitError,
+                                   ShellLimits)
+from .private.shell_session import ShellSession
+
+if TYPE_CHECKING:
+  import mmap
+  from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
 logger = logging.getLogger(__name__)
 
 
@@ -66,7 +85,15 @@ def Snipinate(template_file_name: Union[Path, Literal['-']],
               warning_header: str,
               artifact_path: Path,
               output_base_path: Path,
-              skip_unchanged: bool = False) -> str:
+              skip_unchanged: bool = False,
+              cache: Optional['SnipinateCache'] = None,
+              jobs: int = 1,
+              svg_processes: int = 1,
+              shell_session: bool = False,
+              shell_timeout: Optional[float] = None,
+              render_budget: Optional[float] = None,
+              written_files: Optional[MutableSet[Path]] = None,
+              dependencies: Optional['RenderDependencies'] = None) -> str:
   """Render the markdown template.
 
   Args:
@@ -93,22 +120,121 @@ def Snipinate(template_file_name: Union[Path, Literal['-']],
         README to the artifacts.
       skip_unchanged: If True, will skip writing any files (e.g SVGs) if the the
         same as the existing file. Defaults to False.
+      cache (SnipinateCache, optional): Caches of parsed files, shell outputs
+        etc. Pass the same cache to multiple calls to share the work between
+        renders. Defaults to None, which means a fresh cache for this render.
+      jobs (int, optional): If greater than 1, shell() calls with constant
+        arguments, that are always evaluated (i.e not inside of an if, a for
+        loop, a macro, etc.), are run ahead of time in a pool of this many
+        threads. Their outputs are used in template order, so the rendered
+        output is the same as with 1 job, as long as the commands do not
+        depend on each other's side effects. Defaults to 1.
+      svg_processes (int, optional): If greater than 1, the terminal SVGs of
+        shell(rich=...) calls are rendered in a pool of this many processes,
+        while the rest of the template renders. The output of a
+        shell(rich='svg'|'img+svg') call is a placeholder until then, so it
+        must be put into the template as is, not changed (e.g by a filter).
+        Defaults to 1, which renders them in place.
+      shell_session (bool, optional): If True, the shell() calls that run in
+        a plain shell (i.e not rich) run in one long-lived shell for the whole
+        render, instead of starting a shell for each call, which is much faster
+        for many small commands. Each command still runs in its own subshell,
+        so changes to the working directory, environment variables etc. do not
+        carry over to the next command. The commands read their stdin from
+        /dev/null, and run one at a time. Defaults to False.
+      shell_timeout (float, optional): The timeout in seconds of the shell()
+        calls that do not specify their own `timeout`. Defaults to None, which
+        means no timeout.
+      render_budget (float, optional): If specified, the shell() commands must
+        all finish within this many seconds of the start of the render. A
+        command that is still running then is killed, and the render fails.
+        Defaults to None.
+      written_files (MutableSet[Path], optional): The (resolved) paths of the
+        artifacts written by the render are added to this set. Writing an
+        artifact that is already in the set is an error; pass the same set to
+        multiple renders to detect them overwriting each other's artifacts.
+        Defaults to None, which means a fresh set for this render.
+      dependencies (RenderDependencies, optional): If specified, everything
+        the render depends on (files, includes, shell() calls) and the
+        artifacts it writes are recorded here. Defaults to None.
 
   Returns:
       str: Rendered markdown.
   """
+  return ''.join(
+      SnipinateGenerate(template_file_name=template_file_name,
+                        template_string=template_string,
+                        cwd=cwd,
+                        template_args=template_args,
+                        templates_searchpath=templates_searchpath,
+                        block_comment=block_comment,
+                        warning_header=warning_header,
+                        artifact_path=artifact_path,
+                        output_base_path=output_base_path,
+                        skip_unchanged=skip_unchanged,
+                        cache=cache,
+                        jobs=jobs,
+                        svg_processes=svg_processes,
+                        shell_session=shell_session,
+                        shell_timeout=shell_timeout,
+                        render_budget=render_budget,
+                        written_files=written_files,
+                        dependencies=dependencies))
+
+
+def SnipinateGenerate(
+    template_file_name: Union[Path, Literal['-']],
+    template_string: str,
+    cwd: Path,
+    template_args: dict,
+    templates_searchpath: Optional[Path],
+    block_comment: BlockCommentStyle,
+    warning_header: str,
+    artifact_path: Path,
+    output_base_path: Path,
+    skip_unchanged: bool = False,
+    cache: Optional['SnipinateCache'] = None,
+    jobs: int = 1,
+    svg_processes: int = 1,
+    shell_session: bool = False,
+    shell_timeout: Optional[float] = None,
+    render_budget: Optional[float] = None,
+    written_files: Optional[MutableSet[Path]] = None,
+    dependencies: Optional['RenderDependencies'] = None
+) -> Generator[str, None, None]:
+  """Same as Snipinate(), but yields the rendered markdown in chunks.
+
+  The chunks are yielded as they are rendered, so the whole output never has to
+  be in memory. If the render fails, some chunks might already have been
+  yielded.
+
+  Args:
+      See Snipinate().
+
+  Yields:
+      str: Consecutive chunks of the rendered markdown.
+  """
+  session: Optional[ShellSession] = None
+  render_deadline: Optional[float] = None
+  if render_budget is not None:
+    render_deadline = time.monotonic() + render_budget
   try:
     warning_header = warning_header.format(
         template_file_name=template_file_name)
 
-    loader: Optional[FileSystemLoader] = None
-    if templates_searchpath is not None:
-      loader = FileSystemLoader(templates_searchpath)
-    # TODO: Set newline_sequence. comment_start_string, comment_end_string,
-    # line_comment_prefix, autoescape?
-    env = Environment(loader=loader,
-                      autoescape=True,
-                      keep_trailing_newline=True)
+    if cache is None:
+      cache = SnipinateCache()
+    env = cache._GetEnvironment(templates_searchpath)
+    if written_files is None:
+      written_files = set()
+    if dependencies is None:
+      dependencies = RenderDependencies()
+    pending_svgs: Optional[_PendingSVGs] = None
+    if svg_processes > 1:
+      pending_svgs = _PendingSVGs(processes=svg_processes,
+                                  cache=cache.terminal_svg_cache)
+    if shell_session:
+      session = ShellSession()
 
     # This is the context that will be passed to the Jinja2 functions, if they
     # need access to more global state.
@@ -116,19 +242,49 @@ def Snipinate(template_file_name: Union[Path, Literal['-']],
                    template_file_name=template_file_name,
                    artifact_path=artifact_path,
                    output_base_path=output_base_path,
-                   written_files=set(),
+                   written_files=written_files,
                    block_comment=block_comment,
-                   skip_unchanged=skip_unchanged)
-    env.globals['pysignature'] = partial(pysignature, _ctx=ctx)
-    env.globals['pysnippet'] = partial(pysnippet, _ctx=ctx)
-    env.globals['rawsnippet'] = partial(rawsnippet, _ctx=ctx)
-    env.globals['snippet'] = partial(snippet, _ctx=ctx)
-    env.globals['path'] = partial(path, _ctx=ctx)
-    env.globals['shell'] = partial(shell, _ctx=ctx)
-
-    template_ = env.from_string(template_string)
-    rendered = template_.render(**template_args)
-    return warning_header + rendered
+                   skip_unchanged=skip_unchanged,
+                   symbol_index=cache.symbol_index,
+                   shell_cache=cache.shell_cache,
+                   terminal_svg_cache=cache.terminal_svg_cache,
+                   pending_svgs=pending_svgs,
+                   shell_session=session,
+                   shell_timeout=shell_timeout,
+                   render_deadline=render_deadline,
+                   shell_prefetch={},
+                   dependencies=dependencies,
+                   delimited_files={},
+                   shared_shell_outputs={})
+    # The render runs in its own contextvars.Context, so that the consumer of
+    # the chunks (or another render, interleaved with this one) does not see
+    # or change its _CURRENT_CONTEXT.
+    render_context = contextvars.copy_context()
+    render_context.run(_CURRENT_CONTEXT.set, ctx)
+    template_ = _LoadTemplateString(env,
+                                    template_string,
+                                    name=str(template_file_name))
+    chunks: Iterable[str] = _GenerateInContext(
+        render_context, template_.generate(**template_args))
+    if pending_svgs is not None:
+      chunks = pending_svgs.Resolve(chunks, _ctx=ctx)
+    yield warning_header
+    if jobs <= 1:
+      yield from chunks
+    else:
+      from concurrent.futures import ThreadPoolExecutor
+      with ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+          _PrefetchShellCalls(template_ast=env.parse(template_string),
+                              executor=executor,
+                              _ctx=ctx)
+          yield from chunks
+        finally:
+          # Don't run commands that the render did not get to, e.g because of
+          # an error.
+          for futures in ctx.shell_prefetch.values():
+            for future in futures:
+              future.cancel()
   except TemplateSyntaxError as e:
     print(f'Error: {json.dumps(str(e))}', file=sys.stderr)
     print('template_file_name:', template_file_name, file=sys.stderr)
@@ -143,6 +299,195 @@ def Snipinate(template_file_name: Union[Path, Literal['-']],
     print('template_args:', template_args, file=sys.stderr)
     print('templates_searchpath:', templates_searchpath, file=sys.stderr)
     raise
+  finally:
+    if session is not None:
+      session.Close()
+
+
+def _GenerateInContext(context: contextvars.Context,
+                       chunks: Iterator[str]) -> Generator[str, None, None]:
+  try:
+    while True:
+      try:
+        chunk = context.run(next, chunks)
+      except StopIteration:
+        return
+      yield chunk
+  finally:
+    # Template.generate() returns a generator, but is typed as an iterator.
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+      close()
+
+
+class SnipinateCache:
+  """Caches that can be shared between multiple calls to Snipinate().
+
+  This includes the Jinja2 environment (per templates searchpath), so that
+  included templates are loaded and compiled once, and the compiled templates.
+
+  Args:
+      disk_cache (DiskCache, optional): If specified, results that are
+        expensive to compute (e.g parsed python symbols, compiled templates,
+        terminal SVGs)
+        are also stored in, and reused from, this cache across runs. Defaults
+        to None.
+  """
+
+  def __init__(self, disk_cache: Optional[DiskCache] = None) -> None:
+    self.disk_cache = disk_cache
+    self.symbol_index = _SymbolIndex(disk_cache=disk_cache)
+    self.shell_cache = _ShellCache(disk_cache=disk_cache)
+    self.terminal_svg_cache = _TerminalSVGCache(disk_cache=disk_cache)
+    self._bytecode_cache = _BytecodeCache(disk_cache=disk_cache)
+    self._environments: Dict[Optional[Path], Environment] = {}
+
+  def Invalidate(self, paths: Iterable[Path]) -> None:
+    """Forgets anything cached in memory about these (changed) files."""
+    self.symbol_index.Invalidate(paths)
+    # The loaded templates are checked by modification time, which might not
+    # have changed, e.g if the file was changed twice in quick succession.
+    for env in self._environments.values():
+      if env.cache is not None:
+        env.cache.clear()
+
+  def _GetEnvironment(self,
+                      templates_searchpath: Optional[Path]) -> Environment:
+    env = self._environments.get(templates_searchpath)
+    if env is not None:
+      return env
+    loader: Optional[FileSystemLoader] = None
+    if templates_searchpath is not None:
+      loader = _RecordingFileSystemLoader(templates_searchpath)
+    # TODO: Set newline_sequence. comment_start_string, comment_end_string,
+    # line_comment_prefix, autoescape?
+    env = Environment(loader=loader,
+                      autoescape=True,
+                      keep_trailing_newline=True,
+                      bytecode_cache=self._bytecode_cache)
+    # The environment is shared between renders, so the functions look up the
+    # context of the render that calls them.
+    functions: List[Callable[..., Any]] = [
+        pysignature, pysnippet, rawsnippet, snippet, lines, path, shell
+    ]
+    for function in functions:
+      env.globals[function.__name__] = _WithCurrentContext(function)
+    self._environments[templates_searchpath] = env
+    return env
+
+
+# Bump this if the configuration of the Jinja2 environment changes, to
+# invalidate the compiled templates in the on-disk cache.
+_TEMPLATE_CACHE_VERSION = 1
+
+
+class _BytecodeCache(BytecodeCache):
+  """Keeps compiled templates in memory, and in the DiskCache (if any).
+
+  Entries are keyed by the name and the content of the template.
+  """
+
+  def __init__(self, disk_cache: Optional[DiskCache]) -> None:
+    self._disk_cache = disk_cache
+    # Bucket key (i.e template name) -> (checksum, bytecode) of its latest
+    # version.
+    self._memory: Dict[str, Tuple[str, bytes]] = {}
+
+  def _DiskKey(self, bucket: Bucket) -> str:
+    return HashKey(str(_TEMPLATE_CACHE_VERSION), _JINJA2_VERSION, bucket.key,
+                   bucket.checksum)
+
+  def load_bytecode(self, bucket: Bucket) -> None:
+    data: Optional[bytes] = None
+    checksum, memory_data = self._memory.get(bucket.key, ('', b''))
+    if checksum == bucket.checksum:
+      data = memory_data
+    elif self._disk_cache is not None:
+      data = self._disk_cache.Get('templates', self._DiskKey(bucket))
+    if data is not None:
+      # Checks the python version and the checksum, and leaves the bucket
+      # empty if they do not match.
+      bucket.bytecode_from_string(data)
+      if bucket.code is not None:
+        self._memory[bucket.key] = (bucket.checksum, data)
+
+  def dump_bytecode(self, bucket: Bucket) -> None:
+    data = bucket.bytecode_to_string()
+    self._memory[bucket.key] = (bucket.checksum, data)
+    if self._disk_cache is not None:
+      self._disk_cache.Put('templates', self._DiskKey(bucket), data)
+
+
+def _LoadTemplateString(env: Environment, source: str, *,
+                        name: str) -> Template:
+  """Same as env.from_string(source), but uses the bytecode cache."""
+  bytecode_cache = env.bytecode_cache
+  assert bytecode_cache is not None
+  bucket = bytecode_cache.get_bucket(env, name, None, source)
+  if bucket.code is None:
+    bucket.code = env.compile(source)
+    bytecode_cache.set_bucket(bucket)
+  return env.template_class.from_code(env, bucket.code, env.make_globals(None))
+
+
+class RenderDependencies:
+  """Everything a render depended on, and the artifacts it wrote."""
+
+  def __init__(self) -> None:
+    # Files whose content was used, e.g by pysnippet() or {% include %}.
+    self.files: Set[Path] = set()
+    # Paths whose existence was checked, by path().
+    self.paths: Set[Path] = set()
+    # Artifacts that were written (or left unchanged), e.g SVGs.
+    self.artifacts: Set[Path] = set()
+    # The cached shell() calls, and the cwd they were run in. Their outputs
+    # are determined by their cache keys.
+    self.shell_calls: List[Tuple['_ShellCall', Path]] = []
+    # Why the output might change even if none of the above change, e.g
+    # uncached shell() calls.
+    self.volatile_reasons: List[str] = []
+
+  def GetInputPaths(self) -> Set[Path]:
+    """Returns the files and paths that were read, including the inputs of
+    the cached shell() calls."""
+    input_paths = self.files | self.paths
+    for call, cwd in self.shell_calls:
+      for pattern in call.inputs or ():
+        input_paths.update(match for match in cwd.glob(pattern)
+                           if match.is_file())
+    return input_paths
+
+
+class _RecordingFileSystemLoader(FileSystemLoader):
+  """A FileSystemLoader that records the templates it loads as dependencies.
+
+  They are recorded in the dependencies of the current render.
+  """
+
+  def get_source(self, environment: Environment,
+                 template: str) -> Tuple[str, str, Callable[[], bool]]:
+    source, filename, uptodate = super().get_source(environment, template)
+    path = Path(filename)
+    _RecordTemplate(path)
+
+    def _UpToDate() -> bool:
+      # The environment calls this, instead of get_source(), when it reuses
+      # the loaded template, e.g in a later render.
+      _RecordTemplate(path)
+      return uptodate()
+
+    return source, filename, _UpToDate
+
+
+def _RecordTemplate(path: Path) -> None:
+  ctx = _CURRENT_CONTEXT.get(None)
+  if ctx is not None:
+    ctx.dependencies.files.add(path)
+
+
+# The command, terminal, cache and inputs of a shell(share=True) call, see
+# _SharedShellKey().
+_ShareKey = Tuple[str, Optional[str], int, int, bool, Optional[Tuple[str, ...]]]
 
 
 class _Context(NamedTuple):
@@ -152,9 +497,44 @@ class _Context(NamedTuple):
   artifact_path: Path
   output_base_path: Path
   template_file_name: Union[Path, Literal['-']]
-  written_files: Set[Path]
+  written_files: MutableSet[Path]
   block_comment: Optional[BlockCommentStyle]
   skip_unchanged: bool
+  symbol_index: '_SymbolIndex'
+  shell_cache: '_ShellCache'
+  terminal_svg_cache: '_TerminalSVGCache'
+  # The terminal SVGs being rendered in processes, if any, see svg_processes.
+  pending_svgs: Optional['_PendingSVGs']
+  # Runs the plain shell() commands, if any, see shell_session.
+  shell_session: Optional[ShellSession]
+  # The default timeout of shell() commands, and when the render budget runs
+  # out, in time.monotonic() seconds.
+  shell_timeout: Optional[float]
+  render_deadline: Optional[float]
+  # Outputs of shell() calls that were started ahead of time, see
+  # _PrefetchShellCalls().
+  shell_prefetch: Dict['_ShellCall', List['Future[str]']]
+  dependencies: RenderDependencies
+  # The files searched by snippet() in this render, by resolved path.
+  delimited_files: Dict[Path, '_DelimitedFile']
+  # The outputs of the shell(share=True) commands run in this render, see
+  # _SharedShellKey().
+  shared_shell_outputs: Dict[_ShareKey, str]
+
+
+# The context of the render in progress, for the functions in the (shared)
+# Jinja2 environment.
+_CURRENT_CONTEXT: 'contextvars.ContextVar[_Context]' = contextvars.ContextVar(
+    'snipinator_context')
+
+
+def _WithCurrentContext(function: Callable[..., Any]) -> Callable[..., Any]:
+
+  @functools.wraps(function)
+  def _Function(*args, **kwargs):
+    return function(*args, _ctx=_CURRENT_CONTEXT.get(), **kwargs)
+
+  return _Function
 
 
 def pysignature(path: str,
@@ -194,13 +574,17 @@ def pysignature(path: str,
       str: The signature and docstring.
   """
   path_ = _CheckPath(path=path, cwd=_ctx.cwd)
-  source = path_.read_text()
-  signature = _GetSymbolSignature(source=source, path=str(path_), symbol=symbol)
-
-  signature = _Backtickify(signature, backtickify=backtickify)
-  signature = _Indent(signature, indent=indent)
-  signature = _Indented(signature, indented=indented)
-  signature = _Decomentify(signature, decomentify=decomentify, _ctx=_ctx)
+  _ctx.dependencies.files.add(path_)
+  signature = _GetSymbolSignature(path=path_,
+                                  symbol=symbol,
+                                  symbol_index=_ctx.symbol_index)
+
+  signature = _PostProcess(signature,
+                           backtickify=backtickify,
+                           indent=indent,
+                           indented=indented,
+                           decomentify=decomentify,
+                           _ctx=_ctx)
   if not escape:
     return markupsafe.Markup(signature)
   else:
@@ -243,16 +627,21 @@ def pysnippet(path: str,
       Union[str, markupsafe.Markup]: The snippet.
   """
   path_ = _CheckPath(path=path, cwd=_ctx.cwd)
+  _ctx.dependencies.files.add(path_)
 
   if symbol is None:
     snippet = path_.read_text()
   else:
-    snippet = _GetSymbolSource(path=path_, symbol=symbol)
-
-  snippet = _Backtickify(snippet, backtickify=backtickify)
-  snippet = _Indent(snippet, indent=indent)
-  snippet = _Indented(snippet, indented=indented)
-  snippet = _Decomentify(snippet, decomentify=decomentify, _ctx=_ctx)
+    snippet = _GetSymbolSource(path=path_,
+                               symbol=symbol,
+                               symbol_index=_ctx.symbol_index)
+
+  snippet = _PostProcess(snippet,
+                         backtickify=backtickify,
+                         indent=indent,
+                         indented=indented,
+                         decomentify=decomentify,
+                         _ctx=_ctx)
   if not escape:
     return markupsafe.Markup(snippet)
   else:
@@ -293,11 +682,14 @@ def rawsnippet(path: str,
   """
 
   path_ = _CheckPath(path=path, cwd=_ctx.cwd)
+  _ctx.dependencies.files.add(path_)
   snippet = path_.read_text()
-  snippet = _Backtickify(snippet, backtickify=backtickify)
-  snippet = _Indent(snippet, indent=indent)
-  snippet = _Indented(snippet, indented=indented)
-  snippet = _Decomentify(snippet, decomentify=decomentify, _ctx=_ctx)
+  snippet = _PostProcess(snippet,
+                         backtickify=backtickify,
+                         indent=indent,
+                         indented=indented,
+                         decomentify=decomentify,
+                         _ctx=_ctx)
   if not escape:
     return markupsafe.Markup(snippet)
   else:
@@ -314,6 +706,7 @@ def snippet(path: str,
             backtickify: Union[bool, str] = False,
             decomentify: Union[bool, Literal['nl']] = False,
             regex: Union[bool, str] = False,
+            occurrence: int = 0,
             _ctx: _Context) -> Union[str, markupsafe.Markup]:
   """Returns a _delimited_ snippet from a file.
 
@@ -341,6 +734,9 @@ def snippet(path: str,
         treated as regular expressions. Optionally, can pass in python regex
         flags separated by `|` characters, e.g "IGNORECASE|MULTILINE". Defaults
         to False.
+      occurrence (int, optional): Which occurrence of `start` to use, 0 for the
+        first, 1 for the second, -1 for the last, etc. The snippet ends at the
+        first `end` after it. Defaults to 0.
       _ctx (_Context): This is used by the system and is not available as an
         argument.
 
@@ -349,17 +745,79 @@ def snippet(path: str,
   """
 
   path_ = _CheckPath(path=path, cwd=_ctx.cwd)
+  _ctx.dependencies.files.add(path_)
+
+  resolved_path = path_.resolve()
+  if resolved_path not in _ctx.delimited_files:
+    _ctx.delimited_files[resolved_path] = _DelimitedFile(path_)
+  snippet = _ctx.delimited_files[resolved_path].Extract(name=f'input ({path})',
+                                                        start=start,
+                                                        end=end,
+                                                        regex=regex,
+                                                        occurrence=occurrence)
+  snippet = _PostProcess(snippet,
+                         backtickify=backtickify,
+                         indent=indent,
+                         indented=indented,
+                         decomentify=decomentify,
+                         _ctx=_ctx)
+  if not escape:
+    return markupsafe.Markup(snippet)
+  else:
+    return snippet
+
+
+def lines(path: str,
+          start: int,
+          end: int,
+          *,
+          escape: bool = False,
+          indent: Union[str, int, None] = None,
+          indented: Union[str, int, None] = None,
+          backtickify: Union[bool, str] = False,
+          decomentify: Union[bool, Literal['nl']] = False,
+          _ctx: _Context) -> Union[str, markupsafe.Markup]:
+  """Returns a range of lines from a file.
+
+  Args:
+      path (str): The path to the file.
+      start (int): The first line of the range, counting from 1.
+      end (int): The last line of the range (inclusive).
+      escape (bool, optional): Should use HTML entities escaping? Defaults to
+        False.
+      indent (Union[str, int, None], optional): Should indent? By how much, or
+        with what prefix? Defaults to None.
+      indented (Union[str, int, None], optional): Indents every line except the
+        first. By how much, or with what prefix? Defaults to None.
+      backtickify (Union[bool, str], optional): Should surround with backticks?
+        With what language? Defaults to False.
+      decomentify (Union[bool, Literal['nl']], optional): Assuming that you will
+        be using HTML comments around this call, setting this to true will add
+        correspondingcomments to uncomment the output. This allows you to have
+        the Jinja2 call unmolested by markdown formatters, because they will be
+        inside of a comment section. "nl" adds additional newlines after the
+        newline delimiters. Defaults to False.
+      _ctx (_Context): This is used by the system and is not available as an
+        argument.
+
+  Returns:
+      Union[str, markupsafe.Markup]: The lines, without the last line break.
+  """
+  path_ = _CheckPath(path=path, cwd=_ctx.cwd)
+  _ctx.dependencies.files.add(path_)
 
-  full_source = path_.read_text()
-  snippet = _ExtractDelimted(name=f'input ({path})',
-                             text=full_source,
-                             start=start,
-                             end=end,
-                             regex=regex)
-  snippet = _Backtickify(snippet, backtickify=backtickify)
-  snippet = _Indent(snippet, indent=indent)
-  snippet = _Indented(snippet, indented=indented)
-  snippet = _Decomentify(snippet, decomentify=decomentify, _ctx=_ctx)
+  line_index = _ctx.symbol_index.GetLines(path_)
+  if not 1 <= start <= end <= len(line_index):
+    raise ValueError(
+        f'Lines {start}-{end} are out of range, {json.dumps(path)} has'
+        f' {len(line_index)} lines')
+  snippet = line_index.Slice(start - 1, end)
+  snippet = _PostProcess(snippet,
+                         backtickify=backtickify,
+                         indent=indent,
+                         indented=indented,
+                         decomentify=decomentify,
+                         _ctx=_ctx)
   if not escape:
     return markupsafe.Markup(snippet)
   else:
@@ -410,7 +868,7 @@ def path(path: str,
       Union[str, markupsafe.Markup]: Just returns the path. If the path doesn't
         exist, it will raise an error.
   """
-  _CheckPath(path=path, cwd=_ctx.cwd)
+  _ctx.dependencies.paths.add(_CheckPath(path=path, cwd=_ctx.cwd))
 
   if not Path(path).exists():
     raise FileNotFoundError(f'File not found: {json.dumps(path)}')
@@ -427,18 +885,29 @@ def path(path: str,
     output = f'<a href="{html.escape(path, quote=True)}">{html.escape(text_str, quote=True)}</a>'
   elif link is None:
     output = text_str
-  output = _Backtickify(output, backtickify=backtickify)
-  output = _Indent(output, indent=indent)
-  output = _Indented(output, indented=indented)
-  output = _Decomentify(output, decomentify=decomentify, _ctx=_ctx)
+  output = _PostProcess(output,
+                        backtickify=backtickify,
+                        indent=indent,
+                        indented=indented,
+                        decomentify=decomentify,
+                        _ctx=_ctx)
   if not escape:
     return markupsafe.Markup(output)
   else:
     return output
 
 
-def _ExecuteANSI(args: str, cwd: Path, term: Optional[str], rows: int,
-                 cols: int) -> str:
+def _ExecuteANSI(args: str,
+                 cwd: Path,
+                 term: Optional[str],
+                 rows: int,
+                 cols: int,
+                 limits: ShellLimits = ShellLimits(),
+                 window: Optional['_OutputWindow'] = None) -> str:
+  # Imported here, because it is slow to import, and only needed for rich
+  # shell() calls.
+  import pexpect  # type: ignore[import]
+
   env = os.environ.copy()
   if term is not None:
     env['TERM'] = term
@@ -447,16 +916,36 @@ def _ExecuteANSI(args: str, cwd: Path, term: Optional[str], rows: int,
       cwd=str(cwd),
       env=env,  # type: ignore
       dimensions=(rows, cols))
-  output: str = pty.read().decode()
+  scanner = None if window is None else _WindowScanner(window)
+  try:
+    output = _ReadShellOutput(pty.child_fd,
+                              limits=limits,
+                              decoder=codecs.getincrementaldecoder('utf-8')(),
+                              scanner=scanner)
+    if scanner is not None and scanner.done:
+      # The rest of the output is not needed.
+      KillProcessGroup(pty.pid)
+      pty.close(force=True)
+      return scanner.Window()
+    # The command might still run after closing the terminal.
+    while limits.deadline is not None and pty.isalive():
+      limits.CheckTime()
+      time.sleep(0.01)
+  except ShellLimitError:
+    # pexpect runs the command in its own session.
+    KillProcessGroup(pty.pid)
+    pty.close(force=True)
+    raise
   returncode = pty.wait()
   if returncode != 0:
+    import yaml
     raise Exception(f'Command failed: {json.dumps(args)}'
                     f'\n  exit code: {returncode}'
                     f'\n  output: {output}'
                     f'\n  cwd: {cwd}'
                     f'\n  env:\n{textwrap.indent(yaml.safe_dump(env), "    ")}')
 
-  return output
+  return output if scanner is None else scanner.Finish()
 
 
 def _GetTerminalSVG(args: str,
@@ -464,6 +953,12 @@ def _GetTerminalSVG(args: str,
                     cols: int,
                     include_args: bool,
                     bg_color: Optional[str] = None) -> str:
+  # Imported here, because they are slow to import, and only needed for rich
+  # shell() calls.
+  from rich.console import Console
+  from rich.terminal_theme import MONOKAI
+  from rich.text import Text
+  from rich.themes import DEFAULT as DEFAULT_THEME
 
   CONSOLE_SVG_FORMAT = """\
     <svg class="rich-terminal" viewBox="0 0 {width} {height}" xmlns="http://www.w3.org/2000/svg">
@@ -524,17 +1019,6 @@ font-family: arial;
 
   CONSOLE_SVG_FORMAT = CONSOLE_SVG_FORMAT.replace('{bg_color}', bg_color)
 
-  def CleanSVG(svg_code):
-    # Parse SVG content
-    dom = minidom.parseString(svg_code)
-    # Get the pretty printed version of the SVG content
-    cleaned_svg = dom.toprettyxml(indent='')
-    # minidom adds extra lines; remove them
-    cleaned_svg = '\n'.join(
-        [line for line in cleaned_svg.split('\n') if line.strip()])
-
-    return cleaned_svg
-
   console = Console(record=True,
                     force_terminal=True,
                     force_interactive=True,
@@ -548,17 +1032,239 @@ font-family: arial;
   console.print(text)
   console.height = len(text.wrap(console, width=cols))
   svg = console.export_svg(theme=MONOKAI, code_format=CONSOLE_SVG_FORMAT)
-  svg = CleanSVG(svg)
-  return svg
+  # Pretty printed, so that the SVGs diff well.
+  return PrettyXML(svg)
 
 
-def _ExtractDelimted(*, name: str, text: str, start: Optional[str],
-                     end: Optional[str], regex: Union[bool, str]) -> str:
+# Bump this if _GetTerminalSVG() changes its output.
+_TERMINAL_SVG_CACHE_VERSION = 1
+
+
+@functools.lru_cache(maxsize=None)
+def _GetRenderingVersions() -> Tuple[str, ...]:
+  """Versions of what _GetTerminalSVG() depends on, besides its arguments."""
+  from importlib.metadata import PackageNotFoundError, version
+
+  from . import _build_version
+  try:
+    rich_version = version('rich')
+  except PackageNotFoundError:
+    rich_version = 'unknown'
+  # The version of python decides e.g how the SVG is escaped, see PrettyXML().
+  return (str(_TERMINAL_SVG_CACHE_VERSION), _build_version, rich_version,
+          sys.version)
+
+
+class _TerminalSVGCache:
+  """Cache of _GetTerminalSVG() outputs, in memory and optionally on disk.
+
+  The SVG is fully determined by the arguments and the versions of snipinator,
+  rich and python, so unlike shell() outputs, it is always cached.
+  """
+
+  def __init__(self, disk_cache: Optional[DiskCache] = None) -> None:
+    self._svgs: Dict[str, str] = {}
+    self._disk_cache = disk_cache
+
+  @staticmethod
+  def Key(*, args: str, terminal_output: str, cols: int, include_args: bool,
+          bg_color: Optional[str]) -> str:
+    """Returns the cache key of the arguments of _GetTerminalSVG()."""
+    return HashKey(
+        *_GetRenderingVersions(), args, terminal_output, str(cols),
+        str(include_args),
+        'bg_color unset' if bg_color is None else f'bg_color={bg_color}')
+
+  def Get(self, key: str) -> Optional[str]:
+    svg = self._svgs.get(key)
+    if svg is None and self._disk_cache is not None:
+      data = self._disk_cache.Get('terminal-svgs', key)
+      if data is not None:
+        svg = data.decode()
+        self._svgs[key] = svg
+    return svg
+
+  def Put(self, key: str, svg: str) -> None:
+    if self._svgs.get(key) == svg:
+      return
+    self._svgs[key] = svg
+    if self._disk_cache is not None:
+      self._disk_cache.Put('terminal-svgs', key, svg.encode())
+
+  def GetTerminalSVG(self, *, args: str, terminal_output: str, cols: int,
+                     include_args: bool, bg_color: Optional[str]) -> str:
+    """Same as _GetTerminalSVG(), but cached."""
+    key = self.Key(args=args,
+                   terminal_output=terminal_output,
+                   cols=cols,
+                   include_args=include_args,
+                   bg_color=bg_color)
+    svg = self.Get(key)
+    if svg is None:
+      svg = _GetTerminalSVG(args=args,
+                            terminal_output=terminal_output,
+                            cols=cols,
+                            include_args=include_args,
+                            bg_color=bg_color)
+      self.Put(key, svg)
+    return svg
+
+
+# Delimits the placeholders of the terminal SVGs that are still being rendered,
+# see _PendingSVGs. U+FDD0 is a noncharacter, reserved for internal use, so it
+# does not otherwise appear in the rendered text.
+_SVG_PLACEHOLDER_MARK = '\ufdd0'
+_SVG_PLACEHOLDER_RE = re.compile('\ufdd0svg:([0-9]+)\ufdd0')
+
+
+class _PendingSVG(NamedTuple):
+  key: str
+  future: 'Future[str]'
+
+
+class _PendingSVGs:
+  """Terminal SVGs that are being rendered in a pool of processes.
+
+  See the `svg_processes` argument of Snipinate(). shell() puts a placeholder
+  into the template for each inline SVG, and defers writing each SVG artifact.
+  Resolve() replaces the placeholders in the rendered chunks, in order. Only
+  the chunks from the first placeholder whose SVG is not ready yet are held
+  back, so the rest of the template keeps rendering in the meantime.
+  """
+
+  def __init__(self, *, processes: int, cache: _TerminalSVGCache) -> None:
+    self._processes = processes
+    self._cache = cache
+    self._executor: Optional['ProcessPoolExecutor'] = None
+    # Cache key -> the SVG, so that each SVG is rendered once.
+    self._svgs: Dict[str, _PendingSVG] = {}
+    # By placeholder index: the SVG, and the function that turns it into the
+    # text that replaces the placeholder.
+    self._placeholders: List[Tuple[_PendingSVG, Callable[[str], str]]] = []
+    # By placeholder index: the text that replaced it.
+    self._texts: Dict[int, str] = {}
+    # The artifacts to write, in order, once their SVGs are ready.
+    self._artifacts: Deque[Tuple[_PendingSVG, Path]] = collections.deque()
+
+  def Submit(self, *, args: str, terminal_output: str, cols: int,
+             include_args: bool, bg_color: Optional[str]) -> _PendingSVG:
+    """Starts rendering the SVG, unless it is cached."""
+    from concurrent.futures import Future, ProcessPoolExecutor
+
+    key = _TerminalSVGCache.Key(args=args,
+                                terminal_output=terminal_output,
+                                cols=cols,
+                                include_args=include_args,
+                                bg_color=bg_color)
+    svg = self._svgs.get(key)
+    if svg is not None:
+      return svg
+    cached_svg = self._cache.Get(key)
+    future: 'Future[str]'
+    if cached_svg is not None:
+      future = Future()
+      future.set_result(cached_svg)
+    else:
+      if self._executor is None:
+        self._executor = ProcessPoolExecutor(max_workers=self._processes)
+      future = self._executor.submit(_GetTerminalSVG,
+                                     args=args,
+                                     terminal_output=terminal_output,
+                                     cols=cols,
+                                     include_args=include_args,
+                                     bg_color=bg_color)
+    svg = _PendingSVG(key=key, future=future)
+    self._svgs[key] = svg
+    return svg
+
+  def AddPlaceholder(self, svg: _PendingSVG, finish: Callable[[str],
+                                                              str]) -> str:
+    """Returns a placeholder for finish(the SVG)."""
+    self._placeholders.append((svg, finish))
+    index = len(self._placeholders) - 1
+    return f'{_SVG_PLACEHOLDER_MARK}svg:{index}{_SVG_PLACEHOLDER_MARK}'
+
+  def AddArtifact(self, svg: _PendingSVG, path: Path) -> None:
+    """Writes the SVG to `path` (see _WriteTextArtifact()) once it is ready."""
+    self._artifacts.append((svg, path))
+
+  def _Result(self, svg: _PendingSVG) -> str:
+    result = svg.future.result()
+    self._cache.Put(svg.key, result)
+    return result
+
+  def _IsReady(self, chunk: str) -> bool:
+    if _SVG_PLACEHOLDER_MARK not in chunk:
+      return True
+    return all(self._placeholders[int(match.group(1))][0].future.done()
+               for match in _SVG_PLACEHOLDER_RE.finditer(chunk))
+
+  def _Text(self, index: int) -> str:
+    if index not in self._texts:
+      svg, finish = self._placeholders[index]
+      self._texts[index] = finish(self._Result(svg))
+    return self._texts[index]
+
+  def _Replace(self, chunk: str) -> str:
+    if _SVG_PLACEHOLDER_MARK not in chunk:
+      return chunk
+    matches = list(_SVG_PLACEHOLDER_RE.finditer(chunk))
+    if chunk.count(_SVG_PLACEHOLDER_MARK) != 2 * len(matches):
+      raise ValueError(
+          'The output of a shell(rich=...) call was changed by the template'
+          ' (e.g by a filter), which is not supported when rendering the'
+          ' terminal SVGs in processes, see svg_processes')
+    parts: List[str] = []
+    end = 0
+    for match in matches:
+      parts.append(chunk[end:match.start()])
+      parts.append(self._Text(int(match.group(1))))
+      end = match.end()
+    parts.append(chunk[end:])
+    return ''.join(parts)
+
+  def _WriteArtifacts(self, *, wait: bool, _ctx: '_Context') -> None:
+    while self._artifacts and (wait or self._artifacts[0][0].future.done()):
+      svg, path = self._artifacts.popleft()
+      _WriteTextArtifact(path=path, text=self._Result(svg), _ctx=_ctx)
+
+  def Resolve(self, chunks: Iterable[str], *,
+              _ctx: '_Context') -> Generator[str, None, None]:
+    """Yields the chunks with the placeholders replaced, writes the artifacts.
+
+    Shuts down the pool when done.
+    """
+    held: Deque[str] = collections.deque()
+    try:
+      for chunk in chunks:
+        held.append(chunk)
+        while held and self._IsReady(held[0]):
+          yield self._Replace(held.popleft())
+        self._WriteArtifacts(wait=False, _ctx=_ctx)
+      while held:
+        yield self._Replace(held.popleft())
+      self._WriteArtifacts(wait=True, _ctx=_ctx)
+    finally:
+      if self._executor is not None:
+        # Don't render SVGs that are no longer needed, e.g because of an error.
+        for svg in self._svgs.values():
+          svg.future.cancel()
+        self._executor.shutdown()
+
+
+def _ParseRegexFlags(regex: Union[bool, str]) -> int:
   flags = 0
   if isinstance(regex, str):
     for flag in regex.split('|'):
       # Use RegexFlag to get the flag value
       flags |= re.RegexFlag[flag].value
+  return flags
+
+
+def _ExtractDelimted(*, name: str, text: str, start: Optional[str],
+                     end: Optional[str], regex: Union[bool, str]) -> str:
+  flags = _ParseRegexFlags(regex)
+  if isinstance(regex, str):
     regex = True
 
   if start is not None and not regex:
@@ -590,7 +1296,345 @@ def _ExtractDelimted(*, name: str, text: str, start: Optional[str],
   return text
 
 
+class _OutputWindow(NamedTuple):
+  """The delimiters of a shell(stop_at_end=True) call, see _WindowScanner."""
+
+  start: Optional[str]
+  end: str
+  regex: Union[bool, str]
+
+
+class _WindowScanner:
+  """Extracts the delimited window of a command's output, while it is read.
+
+  The same as _ExtractDelimted() on the whole output, but only the text after
+  the start delimiter is kept, and Feed() says when the end delimiter has been
+  seen, so that the rest of the output need not be read. Literal delimiters are
+  searched for in each chunk (with the possible start of a delimiter from the
+  previous chunk). Regex delimiters are searched for in all of the output since
+  the previous delimiter, so that anchors and lookbehinds mean the same as in
+  _ExtractDelimted(), and a match only counts once the line after it has been
+  read; so they should match within a line.
+  """
+
+  def __init__(self, window: _OutputWindow) -> None:
+    self._window = window
+    self._is_regex = window.regex is not False
+    flags = _ParseRegexFlags(window.regex)
+    self._start_re = (re.compile(window.start, flags)
+                      if self._is_regex and window.start is not None else None)
+    self._end_re = re.compile(window.end, flags) if self._is_regex else None
+    self._started = window.start is None
+    # The window so far, once started, without `_tail`.
+    self._parts: List[str] = []
+    # The output that still has to be searched for the current delimiter, from
+    # `_pos` on. For a regex, all of the output since the previous delimiter.
+    self._tail = ''
+    self._pos = 0
+    self.done = False
+
+  def _Find(self, delimiter: str, pattern: Optional['re.Pattern[str]'],
+            text: str, pos: int) -> Tuple[Optional[int], Optional[int], int]:
+    """Searches the text for the delimiter, from `pos` on.
+
+    Returns:
+        Tuple[Optional[int], Optional[int], int]: The start and end of the
+          match, and -1. Or if not found, None, None and where the search has
+          to resume.
+    """
+    if pattern is None:
+      index = text.find(delimiter, pos)
+      if index != -1:
+        return index, index + len(delimiter), -1
+      return None, None, max(pos, len(text) - len(delimiter) + 1)
+    # A match on the last line, or up to its newline (e.g of `$`, or of a
+    # greedy repetition), might be different with the rest of the output.
+    last_newline = text.rfind('\n')
+    match = pattern.search(text, pos)
+    if match is not None and match.end() < last_newline:
+      return match.start(), match.end(), -1
+    return None, None, max(pos, text.rfind('\n', 0, max(last_newline, 0)) + 1)
+
+  def _Keep(self, tail: str, resume: int) -> None:
+    """Keeps the rest of the output that has to be searched."""
+    # Searched literal text is not needed any more.
+    keep_from = 0 if self._is_regex else resume
+    if self._started:
+      self._parts.append(tail[:keep_from])
+    self._tail = tail[keep_from:]
+    self._pos = resume - keep_from
+
+  def Feed(self, text: str) -> bool:
+    """Adds the next chunk of the output, returns True once the window ends."""
+    assert not self.done
+    tail = self._tail + text
+    if not self._started:
+      assert self._window.start is not None
+      match_start, match_end, resume = self._Find(self._window.start,
+                                                  self._start_re, tail,
+                                                  self._pos)
+      if match_end is None:
+        self._Keep(tail, resume)
+        return False
+      self._started = True
+      tail = tail[match_end:]
+      self._pos = 0
+    match_start, match_end, resume = self._Find(self._window.end, self._end_re,
+                                                tail, self._pos)
+    if match_start is not None:
+      self._parts.append(tail[:match_start])
+      self._tail = ''
+      self.done = True
+      return True
+    self._Keep(tail, resume)
+    return False
+
+  def Window(self) -> str:
+    """The window, once Feed() returned True."""
+    assert self.done
+    return ''.join(self._parts)
+
+  def Finish(self) -> str:
+    """The window, after the whole output was fed.
+
+    Raises:
+        ValueError: If a delimiter was not found.
+    """
+    if self.done:
+      return self.Window()
+    # The rest of the output might not have been searched completely, e.g the
+    # last line, for a regex.
+    if not self._started:
+      return _ExtractDelimted(name='output',
+                              text=self._tail,
+                              start=self._window.start,
+                              end=self._window.end,
+                              regex=self._window.regex)
+    return ''.join(self._parts) + _ExtractDelimted(name='output',
+                                                   text=self._tail,
+                                                   start=None,
+                                                   end=self._window.end,
+                                                   regex=self._window.regex)
+
+
+# Smaller files are simply read; mapping them is not worth it.
+_MMAP_MIN_SIZE = 1 << 20
+_MMAP_SCAN_CHUNK_SIZE = 1 << 20
+
+
+class _DelimitedFile:
+  """A file that snippet() extracts delimited snippets from.
+
+  Each file is read once per render, its regex delimiters are compiled once,
+  and the occurrences of each start delimiter are found in a single scan, that
+  is resumed only as far as later occurrences are asked for. So many snippets
+  of one file cost little more than one.
+
+  Large files are memory mapped, and searched as bytes where that matches
+  searching the text, so that only the snippets are decoded, and memory use is
+  proportional to the snippets, not the file. A literal delimiter without line
+  breaks is searched without reading the rest of the file; the others need the
+  whole file to be scanned first, once, see _Scan().
+  """
+
+  def __init__(self, path: Path):
+    self._path = path
+    # The text of the file, or None if the file is searched mapped.
+    self._text: Optional[str] = None
+    # Whether the mapped file has no '\r', and whether it is all ASCII, once it
+    # is scanned.
+    self._scan: Optional[Tuple[bool, bool]] = None
+    # (delimiter, regex flags, or None if literal) -> occurrences.
+    self._occurrences: Dict[Tuple[str, Optional[int]], _Occurrences] = {}
+    self._patterns: Dict[Tuple[str, int], 're.Pattern'] = {}
+    if not self._CanMap():
+      self._UseText()
+
+  def _CanMap(self) -> bool:
+    if self._path.stat().st_size < max(1, _MMAP_MIN_SIZE):
+      # Smaller files are simply read; mapping them is not worth it.
+      return False
+    # Path.read_text() decodes with the locale's encoding; UTF-8 can be
+    # searched as bytes, because a UTF-8 string only matches on character
+    # boundaries.
+    if codecs.lookup(locale.getpreferredencoding(False)).name != 'utf-8':
+      return False
+    try:
+      with self._Map():
+        pass
+    except OSError as e:
+      # E.g not a regular file.
+      logger.debug(f'Could not map {self._path}: {e}')
+      return False
+    return True
+
+  def _Scan(self) -> Tuple[bool, bool]:
+    """Returns whether the mapped file has no carriage returns, and is ASCII.
+
+    Reads the whole file, the first time.
+    """
+    if self._scan is None:
+      has_no_cr = True
+      is_ascii = True
+      with self._Map() as mapped:
+        for offset in range(0, len(mapped), _MMAP_SCAN_CHUNK_SIZE):
+          chunk = mapped[offset:offset + _MMAP_SCAN_CHUNK_SIZE]
+          if b'\r' in chunk:
+            has_no_cr = False
+            break
+          is_ascii = is_ascii and chunk.isascii()
+      self._scan = (has_no_cr, is_ascii)
+    return self._scan
+
+  @contextlib.contextmanager
+  def _Map(self) -> Generator['mmap.mmap', None, None]:
+    import mmap
+    with self._path.open('rb') as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+      yield mapped
+
+  @contextlib.contextmanager
+  def _Data(self) -> Generator[Union[str, 'mmap.mmap'], None, None]:
+    if self._text is not None:
+      yield self._text
+    else:
+      with self._Map() as mapped:
+        yield mapped
+
+  def _UseText(self):
+    self._text = self._path.read_text()
+    # Positions in the mapped bytes are not positions in the text.
+    self._occurrences.clear()
+    self._patterns.clear()
+
+  def _CanSearchMapped(self, delimiter: str, flags: Optional[int]) -> bool:
+    if flags is None and '\r' not in delimiter and '\n' not in delimiter:
+      # Path.read_text() only translates the line breaks, which such a delimiter
+      # cannot match, so it occurs in the same places (see Extract() for the
+      # line breaks of the snippet).
+      return True
+    # Path.read_text() translates '\r\n' and '\r' to '\n'.
+    has_no_cr, is_ascii = self._Scan()
+    if not has_no_cr:
+      return False
+    if flags is None:
+      return True
+    # Bytes patterns are matched bytewise, and with ASCII character classes,
+    # which is only the same as matching the text if both are ASCII.
+    if not is_ascii or not delimiter.isascii():
+      return False
+    if flags & (re.UNICODE | re.LOCALE):
+      return False
+    try:
+      self._Pattern(delimiter, flags)
+    except re.error:
+      # E.g a \u escape.
+      return False
+    return True
+
+  def _Needle(self, delimiter: str) -> Union[str, bytes]:
+    return delimiter if self._text is not None else delimiter.encode()
+
+  def _Pattern(self, delimiter: str, flags: int) -> 're.Pattern':
+    key = (delimiter, flags)
+    if key not in self._patterns:
+      self._patterns[key] = re.compile(self._Needle(delimiter), flags)
+    return self._patterns[key]
+
+  def _FindStart(self, data: Union[str, 'mmap.mmap'], delimiter: str,
+                 flags: Optional[int], occurrence: int) -> Optional[int]:
+    """Returns the end of the `occurrence`th match of the start delimiter."""
+    key = (delimiter, flags)
+    if key not in self._occurrences:
+      self._occurrences[key] = _Occurrences()
+    occurrences = self._occurrences[key]
+    while occurrences.resume is not None and (occurrence < 0 or len(
+        occurrences.spans) <= occurrence):
+      pos = occurrences.resume
+      span: Optional[Tuple[int, int]] = None
+      if flags is None:
+        needle = self._Needle(delimiter)
+        index = data.find(needle, pos)  # type: ignore[arg-type]
+        if index != -1:
+          span = (index, index + len(needle))
+      else:
+        match = self._Pattern(delimiter, flags).search(data, pos)
+        if match is not None:
+          span = match.span()
+      if span is None:
+        occurrences.resume = None
+        break
+      occurrences.spans.append(span)
+      # Overlapping occurrences for literals, like str.find(); non-overlapping
+      # matches for regexes, like re.finditer().
+      if flags is None or span[0] == span[1]:
+        occurrences.resume = span[0] + 1
+      else:
+        occurrences.resume = span[1]
+      if occurrences.resume > len(data):
+        occurrences.resume = None
+    try:
+      return occurrences.spans[occurrence][1]
+    except IndexError:
+      return None
+
+  def _FindEnd(self, data: Union[str, 'mmap.mmap'], delimiter: str,
+               flags: Optional[int], pos: int) -> Optional[int]:
+    """Returns the start of the first end delimiter, at or after `pos`."""
+    if flags is None:
+      index = data.find(self._Needle(delimiter), pos)  # type: ignore[arg-type]
+      return None if index == -1 else index
+    pattern = self._Pattern(delimiter, flags)
+    # Search the rest of the text, rather than from a position, so that anchors
+    # and lookbehinds only see the text after the start delimiter.
+    if isinstance(data, str):
+      text_match = pattern.search(data[pos:])
+      return None if text_match is None else pos + text_match.start()
+    with memoryview(data) as view, view[pos:] as rest:
+      bytes_match = pattern.search(rest)
+    return None if bytes_match is None else pos + bytes_match.start()
+
+  def Extract(self, *, name: str, start: str, end: str, regex: Union[bool, str],
+              occurrence: int) -> str:
+    """Returns the text between the `occurrence`th `start`, and the next `end`.
+
+    Same as _ExtractDelimted() on the text of the file, for the 0th occurrence.
+    """
+    flags: Optional[int] = None
+    if regex is not False:
+      flags = _ParseRegexFlags(regex)
+    if self._text is None and not all(
+        self._CanSearchMapped(delimiter, flags) for delimiter in (start, end)):
+      self._UseText()
+
+    with self._Data() as data:
+      start_index = self._FindStart(data, start, flags, occurrence)
+      if start_index is None:
+        which = '' if occurrence == 0 else f' (occurrence {occurrence})'
+        raise ValueError(
+            f'Start delimiter {json.dumps(start)}{which} not found in {name}')
+      end_index = self._FindEnd(data, end, flags, start_index)
+      if end_index is None:
+        raise ValueError(f'End delimiter {json.dumps(end)} not found in {name}')
+      snippet = data[start_index:end_index]
+      if isinstance(snippet, bytes):
+        snippet = snippet.decode('utf-8')
+        # Like Path.read_text(), see _CanSearchMapped().
+        snippet = snippet.replace('\r\n', '\n').replace('\r', '\n')
+      return snippet
+
+
+class _Occurrences:
+  """The occurrences of a delimiter found so far."""
+
+  def __init__(self):
+    self.spans: List[Tuple[int, int]] = []
+    # Where to resume the scan from, or None if there are no more.
+    self.resume: Optional[int] = 0
+
+
 def _WriteTextArtifact(*, path: Path, text: str, _ctx: _Context):
+  _ctx.dependencies.artifacts.add(path)
   if _ctx.skip_unchanged and path.exists():
     existing_text = path.read_text()
     if text == existing_text:
@@ -599,17 +1643,431 @@ def _WriteTextArtifact(*, path: Path, text: str, _ctx: _Context):
     raise ValueError(
         f'Path is not relative to artifact_path: {json.dumps(str(path))}, artifact_path: {json.dumps(str(_ctx.artifact_path))}'
     )
-  if path in _ctx.written_files:
+  if path.resolve() in _ctx.written_files:
     raise ValueError(
         f'File already written: {json.dumps(str(path))},'
-        ' it appears you are writing to the same file twice in the same template.'
-    )
-  _ctx.written_files.add(path)
+        ' it appears you are writing to the same file twice in the same template'
+        ' (or in two templates rendered together).')
+  _ctx.written_files.add(path.resolve())
 
   path.parent.mkdir(parents=True, exist_ok=True)
   path.write_text(text)
 
 
+# Environment variables that commonly influence the output of programs, see the
+# note in shell()'s docstring. These are part of the key of cached shell
+# outputs.
+_SHELL_CACHE_ENV_VARS = ('TERM', 'COLORTERM', 'FORCE_COLOR', 'NO_COLOR',
+                         'CLI_WIDTH', 'COLUMNS', 'LINES')
+# Bump this if the way shell outputs are cached changes.
+_SHELL_CACHE_VERSION = 1
+
+
+def _HashInputs(*, inputs: Sequence[str], cwd: Path) -> List[str]:
+  """Returns (path, content hash) key parts of all the files matching inputs."""
+  parts: List[str] = []
+  for pattern in inputs:
+    if Path(pattern).is_absolute():
+      raise ValueError(
+          f'Input is absolute: {json.dumps(pattern)}, it should be relative')
+    matches = sorted(match for match in cwd.glob(pattern) if match.is_file())
+    if not matches:
+      raise ValueError(
+          f'Input {json.dumps(pattern)} does not match any files in {json.dumps(str(cwd))}'
+      )
+    for match in matches:
+      parts.append(str(match.relative_to(cwd)))
+      parts.append(HashKey(match.read_bytes()))
+  return parts
+
+
+def _ShellCacheKey(*,
+                   mode: Literal['raw', 'pty'],
+                   args: str,
+                   cwd: Path,
+                   term: Optional[str],
+                   rows: int,
+                   cols: int,
+                   inputs: Optional[Sequence[str]],
+                   window: Optional[_OutputWindow] = None) -> str:
+  env = dict(os.environ)
+  if mode == 'pty' and term is not None:
+    env['TERM'] = term
+  parts: List[str] = [str(_SHELL_CACHE_VERSION), mode, args, str(cwd.resolve())]
+  for var in _SHELL_CACHE_ENV_VARS:
+    value = env.get(var)
+    parts.append(f'{var} unset' if value is None else f'{var}={value}')
+  if mode == 'pty':
+    parts += [str(rows), str(cols)]
+  if inputs is not None:
+    parts += _HashInputs(inputs=inputs, cwd=cwd)
+  if window is not None:
+    parts += ['window', json.dumps(window)]
+  return HashKey(*parts)
+
+
+class _ShellCache:
+  """Cache of (undelimited) shell() outputs, in memory and optionally on disk."""
+
+  def __init__(self, disk_cache: Optional[DiskCache] = None) -> None:
+    self._outputs: Dict[str, str] = {}
+    self._disk_cache = disk_cache
+
+  def Get(self, key: str) -> Optional[str]:
+    output = self._outputs.get(key)
+    if output is None and self._disk_cache is not None:
+      data = self._disk_cache.Get('shell', key)
+      if data is not None:
+        output = data.decode()
+        self._outputs[key] = output
+    return output
+
+  def Put(self, key: str, output: str) -> None:
+    self._outputs[key] = output
+    if self._disk_cache is not None:
+      self._disk_cache.Put('shell', key, output.encode())
+
+
+def _RunShell(args: str, cwd: Path) -> str:
+  # Justification for ignoring bandit/B602:
+  # * The user passes the args in, and this is a tool for the user.
+  # * Presumably, this is running on the user's machine.
+  # * Alternatives: The purpose of this tool is to actually run a command on
+  #   the shell on behalf of the user, so there is no getting around this.
+  # * The user is responsible for the ensuring that their own inputs cannot
+  #   be injected. The documentation (README, docstring) has warning about
+  #   the security risks.
+  result = subprocess.run(
+      args,
+      cwd=cwd,
+      stdout=subprocess.PIPE,
+      stderr=subprocess.STDOUT,
+      text=True,
+      # trunk-ignore(bandit/B602)
+      shell=True,
+      check=True)
+  return result.stdout
+
+
+def _ReadShellOutput(fd: int, *, limits: ShellLimits,
+                     decoder: codecs.IncrementalDecoder,
+                     scanner: Optional[_WindowScanner]) -> str:
+  """Reads the output of a command, until it ends, or `scanner` is done.
+
+  Returns:
+      str: The output, or '' if there is a `scanner`, which gets the output
+        instead.
+  """
+  parts: List[str] = []
+  output_size = 0
+  while True:
+    chunk = ReadChunk(fd, limits=limits, output_size=output_size)
+    output_size += len(chunk)
+    text = decoder.decode(chunk, final=not chunk)
+    if scanner is None:
+      parts.append(text)
+    elif scanner.Feed(text):
+      return ''
+    if not chunk:
+      return ''.join(parts)
+
+
+def _RunShellIncrementally(args: str, cwd: Path, limits: ShellLimits,
+                           window: Optional[_OutputWindow]) -> str:
+  """Same as _RunShell(), but reads the output as it is written.
+
+  The command is killed if it exceeds its limits, or, if there is a `window`,
+  as soon as the window ends, and then only the window is returned.
+  """
+  # trunk-ignore(bandit/B602): See _RunShell().
+  process = subprocess.Popen(args,
+                             cwd=cwd,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT,
+                             shell=True,
+                             start_new_session=True)
+  assert process.stdout is not None
+  scanner = None if window is None else _WindowScanner(window)
+  # Like text=True.
+  decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(
+      locale.getpreferredencoding(False))(),
+                                         translate=True)
+  try:
+    output = _ReadShellOutput(process.stdout.fileno(),
+                              limits=limits,
+                              decoder=decoder,
+                              scanner=scanner)
+    if scanner is not None and scanner.done:
+      # The rest of the output is not needed.
+      KillProcessGroup(process.pid)
+      process.wait()
+      return scanner.Window()
+    try:
+      returncode = process.wait(timeout=limits.Remaining())
+    except subprocess.TimeoutExpired:
+      raise ShellLimitError(limits.timeout_message) from None
+  except ShellLimitError:
+    # Kills the commands started by the shell too.
+    KillProcessGroup(process.pid)
+    process.wait()
+    raise
+  finally:
+    process.stdout.close()
+  if returncode != 0:
+    raise subprocess.CalledProcessError(returncode, args, output=output)
+  return output if scanner is None else scanner.Finish()
+
+
+class _ShellCall(NamedTuple):
+  """The arguments of a shell() call that determine the output of the command.
+
+  `mode` 'raw' runs the command in a plain shell, and 'pty' runs it in a
+  pseudo-terminal, so that the output has colors etc. If `share`, the command
+  runs (in a pseudo-terminal) once per render, for all the calls that share it,
+  see _SharedShellKey(). `timeout` and `max_output_bytes` do not change the
+  output, only whether the command is allowed to finish. If `window`, the output
+  is only the delimited window, see shell(stop_at_end=True).
+  """
+
+  mode: Literal['raw', 'pty']
+  args: str
+  term: Optional[str]
+  rows: int
+  cols: int
+  cache: bool
+  inputs: Optional[Tuple[str, ...]]
+  share: bool = False
+  timeout: Optional[float] = None
+  max_output_bytes: Optional[int] = None
+  window: Optional[_OutputWindow] = None
+
+
+def _MakeShellCall(*, args: str, rich: str, rich_term: Optional[str],
+                   rich_rows: int, rich_cols: int, cache: bool,
+                   inputs: Optional[Sequence[str]], share: bool,
+                   timeout: Optional[float], max_output_bytes: Optional[int],
+                   start: Optional[str], end: Optional[str], regex: Union[bool,
+                                                                          str],
+                   stop_at_end: bool) -> Optional[_ShellCall]:
+  """Returns None if `rich` is not supported."""
+  mode: Literal['raw', 'pty']
+  if rich == 'raw':
+    # Shared with the rich calls, see _StripANSI().
+    mode = 'pty' if share else 'raw'
+  elif (rich in ['svg', 'img+svg']
+        or isinstance(rich, str) and rich.endswith('.svg')):
+    mode = 'pty'
+  else:
+    return None
+  return _ShellCall(mode=mode,
+                    args=args,
+                    term=rich_term,
+                    rows=rich_rows,
+                    cols=rich_cols,
+                    cache=cache,
+                    inputs=None if inputs is None else tuple(inputs),
+                    share=share,
+                    timeout=timeout,
+                    max_output_bytes=max_output_bytes,
+                    window=_OutputWindow(start=start, end=end, regex=regex)
+                    if stop_at_end and end is not None and not share else None)
+
+
+def _SharedShellKey(call: _ShellCall) -> _ShareKey:
+  """The calls with share=True and the same key run the command once.
+
+  The key includes `cache` and `inputs`, so that e.g a call with cache=False
+  does not get an output that was cached on disk.
+  """
+  return (call.args, call.term, call.rows, call.cols, call.cache, call.inputs)
+
+
+# CSI sequences (e.g colors, cursor movement), OSC sequences (e.g window
+# titles, hyperlinks), and the other escape sequences (e.g character sets).
+_ANSI_ESCAPE_RE = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-~]'
+                             r'|\][^\x07\x1b]*(?:\x07|\x1b\\)'
+                             r'|[ -/]*[0-~])')
+
+
+def _StripANSI(output: str) -> str:
+  """Turns the output of a command in a pseudo-terminal into plain text."""
+  # The terminal translates '\n' to '\r\n'.
+  return _ANSI_ESCAPE_RE.sub('', output).replace('\r\n', '\n')
+
+
+def _GetShellLimits(call: _ShellCall, *, _ctx: _Context) -> ShellLimits:
+  """The limits of the command, starting now."""
+  deadline: Optional[float] = None
+  timeout_message = ''
+  timeout = call.timeout if call.timeout is not None else _ctx.shell_timeout
+  if timeout is not None:
+    deadline = time.monotonic() + timeout
+    timeout_message = f'timed out after {timeout:g}s'
+  if _ctx.render_deadline is not None and (deadline is None
+                                           or _ctx.render_deadline < deadline):
+    deadline = _ctx.render_deadline
+    timeout_message = 'ran out of the render budget'
+  return ShellLimits(deadline=deadline,
+                     timeout_message=timeout_message,
+                     max_output_bytes=call.max_output_bytes)
+
+
+def _TemplateLocation(*, _ctx: _Context) -> str:
+  """Where the innermost template that is rendering is, e.g 'README.md:12'."""
+  frame: Optional[FrameType] = sys._getframe(1)
+  while frame is not None:
+    template = frame.f_globals.get('__jinja_template__')
+    if template is not None:
+      lineno = template.get_corresponding_lineno(frame.f_lineno)
+      # Only the included templates have names.
+      name = template.name or str(_ctx.template_file_name)
+      return f'{name}:{lineno}'
+    frame = frame.f_back
+  return str(_ctx.template_file_name)
+
+
+def _RunShellCall(call: _ShellCall, *, _ctx: _Context) -> str:
+  """Runs the command (or gets it from the cache), returns the full output."""
+  key: Optional[str] = None
+  if call.cache:
+    key = _ShellCacheKey(mode=call.mode,
+                         args=call.args,
+                         cwd=_ctx.cwd,
+                         term=call.term,
+                         rows=call.rows,
+                         cols=call.cols,
+                         inputs=call.inputs,
+                         window=call.window)
+    output = _ctx.shell_cache.Get(key)
+    if output is not None:
+      return output
+
+  limits = _GetShellLimits(call, _ctx=_ctx)
+  limits.CheckTime()
+  if (call.mode == 'raw' and _ctx.shell_session is not None
+      and call.window is None):
+    output = _ctx.shell_session.Run(call.args, cwd=_ctx.cwd, limits=limits)
+  elif call.mode == 'raw' and (limits != ShellLimits()
+                               or call.window is not None):
+    # Stopping at the end of the window kills the command, so it does not run
+    # in the shell session.
+    output = _RunShellIncrementally(call.args,
+                                    cwd=_ctx.cwd,
+                                    limits=limits,
+                                    window=call.window)
+  elif call.mode == 'raw':
+    output = _RunShell(call.args, cwd=_ctx.cwd)
+  else:
+    output = _ExecuteANSI(call.args,
+                          cwd=_ctx.cwd,
+                          term=call.term,
+                          rows=call.rows,
+                          cols=call.cols,
+                          limits=limits,
+                          window=call.window)
+
+  if key is not None:
+    _ctx.shell_cache.Put(key, output)
+  return output
+
+
+def _GetShellOutput(call: _ShellCall, *, _ctx: _Context) -> str:
+  """Like _RunShellCall(), but uses the prefetched output if there is one."""
+  if call.cache:
+    _ctx.dependencies.shell_calls.append((call, _ctx.cwd))
+  else:
+    _ctx.dependencies.volatile_reasons.append(
+        f'shell({json.dumps(call.args)}) is not cached')
+  shared_key: Optional[_ShareKey] = None
+  if call.share:
+    shared_key = _SharedShellKey(call)
+    shared_output = _ctx.shared_shell_outputs.get(shared_key)
+    if shared_output is not None:
+      return shared_output
+  futures = _ctx.shell_prefetch.get(call)
+  try:
+    if futures:
+      output = futures.pop(0).result()
+    else:
+      output = _RunShellCall(call, _ctx=_ctx)
+  except ShellLimitError as e:
+    raise ShellLimitError(f'Command {json.dumps(call.args)} {e}, in template'
+                          f' {_TemplateLocation(_ctx=_ctx)}') from None
+  if shared_key is not None:
+    _ctx.shared_shell_outputs[shared_key] = output
+  return output
+
+
+# shell() calls inside of these nodes might be evaluated conditionally, or
+# repeatedly, so they are not prefetched.
+_CONDITIONAL_NODES = (nodes.If, nodes.For, nodes.Macro, nodes.CallBlock,
+                      nodes.CondExpr, nodes.And, nodes.Or)
+
+
+def _GetConstShellCall(node: nodes.Call) -> Optional[_ShellCall]:
+  """Returns the _ShellCall if `node` is a shell() call with constant args."""
+  if not isinstance(node.node, nodes.Name) or node.node.name != 'shell':
+    return None
+  if node.dyn_args is not None or node.dyn_kwargs is not None:
+    return None
+  try:
+    call_args = [arg.as_const() for arg in node.args]
+    call_kwargs = {kwarg.key: kwarg.value.as_const() for kwarg in node.kwargs}
+  except nodes.Impossible:
+    return None
+  try:
+    bound = inspect.signature(shell).bind(*call_args, _ctx=None, **call_kwargs)
+  except TypeError:
+    # Let the render report the bad call.
+    return None
+  bound.apply_defaults()
+  params = bound.arguments
+  return _MakeShellCall(args=params['args'],
+                        rich=params['rich'],
+                        rich_term=params['rich_term'],
+                        rich_rows=params['rich_rows'],
+                        rich_cols=params['rich_cols'],
+                        cache=params['cache'],
+                        inputs=params['inputs'],
+                        share=params['share'],
+                        timeout=params['timeout'],
+                        max_output_bytes=params['max_output_bytes'],
+                        start=params['start'],
+                        end=params['end'],
+                        regex=params['regex'],
+                        stop_at_end=params['stop_at_end'])
+
+
+def _FindShellCalls(node: nodes.Node) -> Generator[_ShellCall, None, None]:
+  """Finds the shell() calls that are always evaluated, in template order."""
+  for child_node in node.iter_child_nodes():
+    if isinstance(child_node, _CONDITIONAL_NODES):
+      continue
+    yield from _FindShellCalls(child_node)
+    if isinstance(child_node, nodes.Call):
+      call = _GetConstShellCall(child_node)
+      if call is not None:
+        yield call
+
+
+def _PrefetchShellCalls(*, template_ast: nodes.Template,
+                        executor: 'ThreadPoolExecutor', _ctx: _Context) -> None:
+  """Starts running the template's shell() commands ahead of time.
+
+  The outputs are put into _ctx.shell_prefetch, and are picked up by the
+  shell() calls, in template order, as the template is rendered.
+  """
+  shared_keys: Set[_ShareKey] = set()
+  for call in _FindShellCalls(template_ast):
+    if call.share:
+      if _SharedShellKey(call) in shared_keys:
+        # Only the first of the calls that share the command runs it.
+        continue
+      shared_keys.add(_SharedShellKey(call))
+    future = executor.submit(_RunShellCall, call, _ctx=_ctx)
+    _ctx.shell_prefetch.setdefault(call, []).append(future)
+
+
 def shell(args: str,
           *,
           escape: bool = False,
@@ -628,6 +2086,12 @@ def shell(args: str,
           start: Optional[str] = None,
           end: Optional[str] = None,
           regex: Union[bool, str] = False,
+          cache: bool = False,
+          inputs: Optional[List[str]] = None,
+          share: bool = False,
+          timeout: Optional[float] = None,
+          max_output_bytes: Optional[int] = None,
+          stop_at_end: bool = False,
           _ctx: _Context) -> Union[str, markupsafe.Markup]:
   """Run a shell command and return the output.
 
@@ -701,63 +2165,109 @@ def shell(args: str,
         treated as regular expressions. Optionally, can pass in python regex
         flags separated by `|` characters, e.g "IGNORECASE|MULTILINE". Defaults
         to False.
+      cache (bool, optional): If True, the output of the command is cached, and
+        the command is not run again if the cache already has an output for
+        it. The output is keyed on the command, cwd, the env vars listed in
+        the note above, rich_term/rich_rows/rich_cols and the content of
+        `inputs`. The cache is kept for the duration of the render, and across
+        runs if the CLI is given --cache-dir. Only use this for commands whose
+        output is fully determined by the key. Defaults to False.
+      inputs (List[str], optional): Paths or glob patterns, relative to cwd,
+        of files the output of the command depends on. Their content is part
+        of the cache key. Only used if `cache` is True. Defaults to None.
+      share (bool, optional): If True, the command is run once per render, in
+        a pseudo-terminal, for all the shell() calls with share=True and the
+        same `args`, rich_term, rich_rows, rich_cols, `cache` and `inputs`,
+        whatever their `rich` format. E.g to show a command both as text and
+        as an SVG. With rich='raw', the command then runs like the rich
+        formats, without a shell (use e.g `bash -c '...'` for pipes), and the
+        output is the pseudo-terminal's with the ANSI escape sequences removed,
+        which can differ from the output without a terminal. Defaults to
+        False.
+      timeout (float, optional): If the command runs for longer than this
+        many seconds, it is killed and the render fails. Only applies if the
+        command runs, i.e not if its output is cached. Defaults to None, which
+        means the `shell_timeout` of the render.
+      max_output_bytes (int, optional): If the command writes more than this
+        many bytes of output, it is killed and the render fails. Defaults to
+        None, which means no limit.
+      stop_at_end (bool, optional): If True, the output is searched for the
+        `start` and `end` delimiters while the command runs, only the text
+        between them is kept, and the command is killed as soon as the `end`
+        delimiter is seen (its exit code is then ignored). For commands that
+        write a lot of output after the part that is needed. With `regex`,
+        each delimiter must match within a line. Requires `end`, and cannot be
+        used with `share`. Defaults to False.
       _ctx (_Context): This is used by the system and is not available as an
         argument.
 
   Returns:
       Union[str, markupsafe.Markup]: Returns the output of the command.
   """
-  if rich == 'raw':
-    # Justification for ignoring bandit/B602:
-    # * The user passes the args in, and this is a tool for the user.
-    # * Presumably, this is running on the user's machine.
-    # * Alternatives: The purpose of this tool is to actually run a command on
-    #   the shell on behalf of the user, so there is no getting around this.
-    # * The user is responsible for the ensuring that their own inputs cannot
-    #   be injected. The documentation (README, docstring) has warning about
-    #   the security risks.
-    result = subprocess.run(
-        args,
-        cwd=_ctx.cwd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        # trunk-ignore(bandit/B602)
-        shell=True,
-        check=True)
-    output = _ExtractDelimted(name='output',
-                              text=result.stdout,
-                              start=start,
-                              end=end,
-                              regex=regex)
+  if stop_at_end and end is None:
+    raise ValueError('stop_at_end=True requires an end delimiter')
+  if stop_at_end and share:
+    raise ValueError('stop_at_end=True cannot be used with share=True')
+  call = _MakeShellCall(args=args,
+                        rich=rich,
+                        rich_term=rich_term,
+                        rich_rows=rich_rows,
+                        rich_cols=rich_cols,
+                        cache=cache,
+                        inputs=inputs,
+                        share=share,
+                        timeout=timeout,
+                        max_output_bytes=max_output_bytes,
+                        start=start,
+                        end=end,
+                        regex=regex,
+                        stop_at_end=stop_at_end)
+  if call is not None and rich == 'raw':
+    stdout = _GetShellOutput(call, _ctx=_ctx)
+    if call.mode == 'pty':
+      stdout = _StripANSI(stdout)
+    output = stdout
+    if call.window is None:
+      output = _ExtractDelimted(name='output',
+                                text=stdout,
+                                start=start,
+                                end=end,
+                                regex=regex)
     if include_args:
       prefix = '$ '
       output = f'{prefix}{args}\n{output}'
     if not output.endswith('\n'):
       output += '\n'
-  elif (rich in ['svg', 'img+svg']
-        or isinstance(rich, str) and rich.endswith('.svg')):
-    output = _ExecuteANSI(args,
-                          cwd=_ctx.cwd,
-                          term=rich_term,
-                          rows=rich_rows,
-                          cols=rich_cols)
-    output = _ExtractDelimted(name='output',
-                              text=output,
-                              start=start,
-                              end=end,
-                              regex=regex)
-
-    svg = _GetTerminalSVG(args=args,
-                          terminal_output=output,
-                          cols=rich_cols,
-                          include_args=include_args,
-                          bg_color=rich_bg_color)
-    if rich == 'svg':
-      output = svg
-    elif rich == 'img+svg':
-      output = ('<img src="data:image/svg+xml;base64,' +
-                base64.b64encode(svg.encode()).decode() + '"/>')
+  elif call is not None and call.mode == 'pty':
+    output = _GetShellOutput(call, _ctx=_ctx)
+    if call.window is None:
+      output = _ExtractDelimted(name='output',
+                                text=output,
+                                start=start,
+                                end=end,
+                                regex=regex)
+
+    svg_kwargs: Dict[str, Any] = dict(args=args,
+                                      terminal_output=output,
+                                      cols=rich_cols,
+                                      include_args=include_args,
+                                      bg_color=rich_bg_color)
+    if rich == 'svg' or rich == 'img+svg':
+      if _ctx.pending_svgs is not None:
+        placeholder = _ctx.pending_svgs.AddPlaceholder(
+            _ctx.pending_svgs.Submit(**svg_kwargs),
+            finish=lambda svg: _FinishShellOutput(_InlineSVG(svg, rich=rich),
+                                                  escape=escape,
+                                                  backtickify=backtickify,
+                                                  indent=indent,
+                                                  indented=indented,
+                                                  decomentify=decomentify,
+                                                  _ctx=_ctx))
+        # The placeholder is not changed by escaping, so the text that
+        # replaces it is escaped by _FinishShellOutput() instead.
+        return placeholder if escape else markupsafe.Markup(placeholder)
+      output = _InlineSVG(_ctx.terminal_svg_cache.GetTerminalSVG(**svg_kwargs),
+                          rich=rich)
     elif isinstance(rich, str) and rich.endswith('.svg'):
       svg_path = Path(rich)
       if svg_path.is_absolute():
@@ -768,7 +2278,14 @@ def shell(args: str,
       output_rel_svg_path = svg_path.relative_to(_ctx.output_base_path)
       svg_path.parent.mkdir(parents=True, exist_ok=True)
 
-      _WriteTextArtifact(path=svg_path, text=svg, _ctx=_ctx)
+      if _ctx.pending_svgs is not None:
+        _ctx.pending_svgs.AddArtifact(_ctx.pending_svgs.Submit(**svg_kwargs),
+                                      svg_path)
+      else:
+        _WriteTextArtifact(
+            path=svg_path,
+            text=_ctx.terminal_svg_cache.GetTerminalSVG(**svg_kwargs),
+            _ctx=_ctx)
 
       alt_attr = ''
       if rich_alt is not None:
@@ -785,16 +2302,45 @@ def shell(args: str,
         f'Unsupported rich format: {json.dumps(rich)}, it should be "raw",'
         ' "svg", or "img+svg", or a file path ending with ".svg"')
 
-  output = _Backtickify(output, backtickify=backtickify)
-  output = _Indent(output, indent=indent)
-  output = _Indented(output, indented=indented)
-  output = _Decomentify(output, decomentify=decomentify, _ctx=_ctx)
+  output = _PostProcess(output,
+                        backtickify=backtickify,
+                        indent=indent,
+                        indented=indented,
+                        decomentify=decomentify,
+                        _ctx=_ctx)
   if not escape:
     return markupsafe.Markup(output)
   else:
     return output
 
 
+def _InlineSVG(svg: str, *, rich: str) -> str:
+  """Returns the output of shell(rich='svg'|'img+svg')."""
+  if rich == 'img+svg':
+    return ('<img src="data:image/svg+xml;base64,' +
+            base64.b64encode(svg.encode()).decode() + '"/>')
+  return svg
+
+
+def _FinishShellOutput(output: str, *, escape: bool, backtickify: Union[bool,
+                                                                        str],
+                       indent: Union[str, int, None], indented: Union[str, int,
+                                                                      None],
+                       decomentify: Union[bool, Literal['nl']],
+                       _ctx: _Context) -> str:
+  """Same as the end of shell(), for the text that replaces a placeholder."""
+  output = _PostProcess(output,
+                        backtickify=backtickify,
+                        indent=indent,
+                        indented=indented,
+                        decomentify=decomentify,
+                        _ctx=_ctx)
+  if escape:
+    # As the autoescaping of the environment would have.
+    return str(markupsafe.escape(output))
+  return output
+
+
 def _is_relative_to(path: Path, other: Path) -> bool:
   """Backport of Path.is_relative_to for Python < 3.9."""
   if sys.version_info < (3, 9):
@@ -835,41 +2381,6 @@ def _GetNodeNames(
   raise ValueError(f'Unsupported node type: {type(node)}')
 
 
-def _FindMatchingChildNodes(*, parent: ast.AST,
-                            symbol_part: str) -> Generator[ast.AST, None, None]:
-  child_node: ast.AST
-  for child_node in ast.iter_child_nodes(parent):
-    if not isinstance(
-        child_node,
-        (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Assign)):
-      continue
-    names = _GetNodeNames(child_node)
-    if symbol_part in names:
-      yield child_node
-
-
-def _FindTargetNodes(*, start: ast.AST,
-                     symbol_parts: List[str]) -> Generator[ast.AST, None, None]:
-  candidates = [start]
-  for symbol_part in symbol_parts:
-    next_candidates = []
-    candidate: ast.AST
-    for candidate in candidates:
-      matching_node: ast.AST
-      for matching_node in _FindMatchingChildNodes(parent=candidate,
-                                                   symbol_part=symbol_part):
-        next_candidates.append(matching_node)
-    candidates = next_candidates
-  yield from candidates
-
-
-def _FindTargetNode(*, start: ast.AST,
-                    symbol_parts: List[str]) -> Optional[ast.AST]:
-  for target_node in _FindTargetNodes(start=start, symbol_parts=symbol_parts):
-    return target_node
-  return None
-
-
 def _GetLineNo(node: ast.AST) -> int:
   """Because lineno is not well typed, hide all access to lineno behind this function."""
   if not hasattr(node, 'lineno'):
@@ -890,23 +2401,18 @@ def _GetEndLineNo(node: ast.AST) -> Optional[int]:
   return end_lineno
 
 
-def _DumpNode(*, source: str, node: ast.AST) -> str:
-  start_line_index = _GetLineNo(node) - 1
-  end_line_index = _GetEOLIndex(node)
-  code = source.splitlines()[start_line_index:end_line_index + 1]
-  return '\n'.join(code)
-
-
-def _GetSymbolSource(*, path: Path, symbol: str) -> str:
-  symbol_parts = symbol.split('.')
+def _GetSymbolSource(*, path: Path, symbol: str,
+                     symbol_index: '_SymbolIndex') -> str:
   try:
-    source = path.read_text()
-    tree = ast.parse(source)
-    nodes = list(_FindTargetNodes(start=tree, symbol_parts=symbol_parts))
-    for node in nodes:
-      return _DumpNode(source=source, node=node)
-    raise ValueError(
-        f'Symbol {json.dumps(symbol)} not found in {json.dumps(str(path))}')
+    file_symbols = symbol_index.Get(path)
+    info = file_symbols.Lookup(symbol)
+    if info.end_lineno is None:
+      raise ValueError(
+          f'end_lineno not found for {json.dumps(symbol)} of type {info.kind} defined at line {info.lineno}, this can happen in Python < 3.8.0. sys.version_info: {sys.version_info}.'
+      )
+    start_line_index = info.lineno - 1
+    end_line_index = info.end_lineno - 1
+    return file_symbols.lines.Slice(start_line_index, end_line_index + 1)
   except Exception as e:
     raise ValueError(
         f'Error getting source for {json.dumps(symbol)} in {json.dumps(str(path))}: {json.dumps(str(e))}'
@@ -962,76 +2468,326 @@ def _EndIndex(target_node: ast.AST) -> Optional[int]:
   return None
 
 
-def _GetSymbolSignature(source: str, path: str, symbol: str) -> str:
+def _GetSymbolSignature(*, path: Path, symbol: str,
+                        symbol_index: '_SymbolIndex') -> str:
   try:
-    tree = ast.parse(source, filename=Path(path).name)
-
-    target_node = _FindTargetNode(start=tree, symbol_parts=symbol.split('.'))
-    if target_node is None:
+    file_symbols = symbol_index.Get(path)
+    info = file_symbols.Lookup(symbol)
+    if info.signature_end_index is None:
       raise ValueError(
-          f'Symbol {json.dumps(symbol)} not found in {json.dumps(str(path))}')
-
-    start_line_index = _GetLineNo(target_node) - 1
-    end_line_index = _EndIndex(target_node)
-    if end_line_index is None:
-      raise ValueError(
-          f'Unsupported symbol type: {json.dumps(symbol)} of type {type(target_node)} in {json.dumps(str(path))}'
+          f'Unsupported symbol type: {json.dumps(symbol)} of type {info.kind} in {json.dumps(str(path))}'
       )
 
-    return '\n'.join(source.splitlines()[start_line_index:end_line_index])
+    start_line_index = info.lineno - 1
+    end_line_index = info.signature_end_index
+    return file_symbols.lines.Slice(start_line_index, end_line_index)
   except Exception as e:
     raise ValueError(
         f'Error getting signature for {json.dumps(symbol)} in {json.dumps(str(path))}: {json.dumps(str(e))}'
     ) from e
 
 
-def _Indent(text: str, *, indent: Union[str, int, None]) -> str:
-  if isinstance(indent, int):
-    return textwrap.indent(text, ' ' * indent)
-  elif isinstance(indent, str):
-    return textwrap.indent(text, indent)
-  else:
-    return text
+class _SymbolInfo(NamedTuple):
+  """Line information about a symbol (class, function, assignment) in a file."""
+
+  # Name of the AST node type, e.g "FunctionDef".
+  kind: str
+  lineno: int
+  end_lineno: Optional[int]
+  # Line index (zero based) of the end of the signature and docstring, as
+  # returned by _EndIndex(). None if the symbol has no signature (e.g an
+  # assignment).
+  signature_end_index: Optional[int]
 
 
-def _Indented(text: str, *, indented: Union[str, int, None]) -> str:
-  if indented is None:
-    return text
-  indent_str = ' ' * indented if isinstance(indented, int) else indented
-  lines = text.splitlines()
-  return '\n'.join([lines[0]] + [indent_str + line for line in lines[1:]])
+class _FileSymbols(NamedTuple):
+  """The source of a python file, and a table of all the symbols in it."""
 
+  path: Path
+  lines: '_LineIndex'
+  # Maps qualified names (e.g "Class.method") to the symbol info.
+  symbols: Dict[str, _SymbolInfo]
 
-def _CountSequentialBackticks(text: str) -> int:
-  """Find the largest number of sequential backticks in the text."""
-  for backticks in range(1, len(text)):
-    search = '`' * backticks
-    if search not in text:
-      return backticks - 1
-  return 0
+  def Lookup(self, symbol: str) -> _SymbolInfo:
+    info = self.symbols.get(symbol)
+    if info is None:
+      raise ValueError(
+          f'Symbol {json.dumps(symbol)} not found in {json.dumps(str(self.path))}'
+      )
+    return info
 
 
-def _Backtickify(text: str, *, backtickify: Union[bool, str]) -> str:
+def _MakeSymbolInfo(node: ast.AST) -> _SymbolInfo:
+  end_lineno: Optional[int] = _GetEndLineNo(node)
+  signature_end_index: Optional[int] = None
+  if end_lineno is not None:
+    signature_end_index = _EndIndex(node)
+  return _SymbolInfo(kind=type(node).__name__,
+                     lineno=_GetLineNo(node),
+                     end_lineno=end_lineno,
+                     signature_end_index=signature_end_index)
 
-  count = _CountSequentialBackticks(text)
-  count += 1
-  count = max(3, count)
-  bt_str = '`' * count
 
-  if backtickify is True:
-    return f'{bt_str}\n{text}\n{bt_str}'
-  elif isinstance(backtickify, str):
-    return f'{bt_str}{backtickify}\n{text}\n{bt_str}'
-  else:
-    return text
+def _BuildSymbolTable(tree: ast.AST) -> Dict[str, _SymbolInfo]:
+  """Builds a table of all the addressable symbols in the tree.
+
+  Only direct children of the module, and of classes/functions are
+  addressable. If a qualified name is defined more than once, the first
+  definition (in source order) wins.
+  """
+  table: Dict[str, _SymbolInfo] = {}
+
+  def _Visit(parent: ast.AST, prefix: str) -> None:
+    for child_node in ast.iter_child_nodes(parent):
+      if not isinstance(
+          child_node,
+          (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Assign)):
+        continue
+      names = list(_GetNodeNames(child_node))
+      for name in names:
+        qualified_name = f'{prefix}{name}'
+        if qualified_name not in table:
+          table[qualified_name] = _MakeSymbolInfo(child_node)
+        _Visit(child_node, f'{qualified_name}.')
+
+  _Visit(tree, '')
+  return table
+
+
+def _StatKey(path: Path) -> Tuple[int, int]:
+  stat = path.stat()
+  return (stat.st_size, stat.st_mtime_ns)
+
+
+# Bump this if _BuildSymbolTable() or _SymbolInfo change, to invalidate the
+# symbol tables in the on-disk cache.
+_SYMBOL_TABLE_VERSION = 1
+
+
+class _SymbolIndex:
+  """Parses each python file once, and indexes the symbols in it.
+
+  Files are re-parsed only if their size or modification time changes. If a
+  DiskCache is given, the symbol tables are also stored there, keyed by the
+  content of the file, so that unchanged files are never parsed again, even
+  across runs.
+
+  Also indexes the lines of each file, python or not, once, for both the symbol
+  tables and lines().
+  """
+
+  def __init__(self, disk_cache: Optional[DiskCache] = None) -> None:
+    # Both keyed by absolute path, because the index might outlive the working
+    # directory, e.g in `snipinator serve`.
+    self._files: Dict[Path, Tuple[Tuple[int, int], _FileSymbols]] = {}
+    self._lines: Dict[Path, Tuple[Tuple[int, int], _LineIndex]] = {}
+    self._disk_cache = disk_cache
+
+  def Invalidate(self, paths: Iterable[Path]) -> None:
+    resolved = {path.resolve() for path in paths}
+    for path in list(self._files):
+      if path.resolve() in resolved:
+        del self._files[path]
+    for path in list(self._lines):
+      if path.resolve() in resolved:
+        del self._lines[path]
+
+  def GetLines(self, path: Path) -> '_LineIndex':
+    return self._GetLines(path, _StatKey(path))
+
+  def _GetLines(self, path: Path, key: Tuple[int, int]) -> '_LineIndex':
+    cached = self._lines.get(path.absolute())
+    if cached is not None and cached[0] == key:
+      return cached[1]
+    line_index = _LineIndex(path.read_text())
+    self._lines[path.absolute()] = (key, line_index)
+    return line_index
+
+  def Get(self, path: Path) -> _FileSymbols:
+    key = _StatKey(path)
+    cached = self._files.get(path.absolute())
+    if cached is not None and cached[0] == key:
+      return cached[1]
+    line_index = self._GetLines(path, key)
+    file_symbols = _FileSymbols(path=path,
+                                lines=line_index,
+                                symbols=self._GetSymbolTable(
+                                    path, line_index.text))
+    self._files[path.absolute()] = (key, file_symbols)
+    return file_symbols
+
+  def _GetSymbolTable(self, path: Path, source: str) -> Dict[str, _SymbolInfo]:
+    if self._disk_cache is None:
+      return _BuildSymbolTable(ast.parse(source, filename=path.name))
+
+    disk_key = HashKey(str(_SYMBOL_TABLE_VERSION),
+                       f'{sys.version_info.major}.{sys.version_info.minor}',
+                       source)
+    data = self._disk_cache.Get('symbols', disk_key)
+    if data is not None:
+      try:
+        return {
+            name: _SymbolInfo(*info)
+            for name, info in json.loads(data).items()
+        }
+      except (ValueError, TypeError):
+        logger.warning('Ignoring corrupt symbol cache entry for %s', path)
+
+    table = _BuildSymbolTable(ast.parse(source, filename=path.name))
+    self._disk_cache.Put(
+        'symbols', disk_key,
+        json.dumps({
+            name: list(info)
+            for name, info in table.items()
+        }).encode())
+    return table
+
+
+# The line breaks that str.splitlines() splits on, other than '\n' and '\r'.
+_UNUSUAL_LINE_BREAKS = '\v\f\x1c\x1d\x1e\x85\u2028\u2029'
+# All of the line breaks that str.splitlines() splits on.
+_LINE_BREAK_RE = re.compile('\r\n?|[\n\v\f\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+class _LineIndex:
+  """The start offset of each line of a text, to slice out ranges of lines.
+
+  Lines are as split by str.splitlines(), and the offsets are kept in a compact
+  array, so that slicing a few lines does not split, or copy, the whole text.
+  """
+
+  def __init__(self, text: str):
+    self.text = text
+    # Searching for each character is much faster than a regex.
+    unusual = any(line_break in text for line_break in _UNUSUAL_LINE_BREAKS)
+    self._lf_only = not unusual and '\r' not in text
+    # The character that every line ends with, if there is one.
+    line_end: Optional[str] = None
+    if not unusual and text.count('\r') == text.count('\r\n'):
+      # '\n' or '\r\n'.
+      line_end = '\n'
+    elif not unusual and '\n' not in text:
+      line_end = '\r'
+    self._starts = array('Q', [0])
+    if line_end is not None:
+      start = text.find(line_end) + 1
+      while start:
+        self._starts.append(start)
+        start = text.find(line_end, start) + 1
+    else:
+      self._starts.extend(match.end()
+                          for match in _LINE_BREAK_RE.finditer(text))
+    if self._starts[-1] != len(text):
+      # The last line has no line break.
+      self._starts.append(len(text))
 
+  def __len__(self) -> int:
+    return len(self._starts) - 1
 
-def _Decomentify(text: str, *, decomentify: Union[bool, Literal['nl']],
-                 _ctx: _Context) -> str:
-  if decomentify is False:
-    return text
-  if _ctx.block_comment is None:
+  def Slice(self, start_index: int, end_index: int) -> str:
+    """Same as '\n'.join(text.splitlines()[start_index:end_index]).
+
+    The indices are zero based, and must not be negative.
+    """
+    start_index = min(start_index, len(self))
+    end_index = max(start_index, min(end_index, len(self)))
+    text = self.text[self._starts[start_index]:self._starts[end_index]]
+    if not self._lf_only:
+      return '\n'.join(text.splitlines())
+    return text[:-1] if text.endswith('\n') else text
+
+
+_BACKTICKS_RE = re.compile('`+')
+
+
+def _LongestBacktickRun(text: str) -> int:
+  longest = 0
+  # A longer run can only start after the first run of the current length, so
+  # each search continues where the last one left off.
+  start = text.find('`')
+  while start != -1:
+    end = _BACKTICKS_RE.match(text, start).end()  # type: ignore[union-attr]
+    longest = end - start
+    start = text.find('`' * (longest + 1), end)
+  return longest
+
+
+def _HasLineBreak(text: str) -> bool:
+  return ''.join(text.splitlines()) != text
+
+
+def _PostProcess(text: str, *, backtickify: Union[bool, str],
+                 indent: Union[str, int, None], indented: Union[str, int, None],
+                 decomentify: Union[bool,
+                                    Literal['nl']], _ctx: _Context) -> str:
+  """Applies backtickify, indent, indented and decomentify, in that order.
+
+  Equivalent to applying each of them to the whole text in turn, but builds the
+  output only once.
+  """
+  if decomentify is not False and _ctx.block_comment is None:
     raise Exception('decomentify is set, but no block comment style is set')
-  if decomentify == 'nl':
-    text = f'\n{text}\n'
-  return _ctx.block_comment.close + text + _ctx.block_comment.open
+  indent_str: str = ' ' * indent if isinstance(indent, int) else (indent or '')
+  indented_str: Optional[str] = (' ' * indented
+                                 if isinstance(indented, int) else indented)
+
+  head: Optional[str] = None
+  fence: Optional[str] = None
+  if backtickify is not False:
+    fence = '`' * max(3, _LongestBacktickRun(text) + 1)
+    head = fence if backtickify is True else f'{fence}{backtickify}'
+
+    if (indent_str or indented_str is not None) and _HasLineBreak(head):
+      # The first line of the fence would be split into lines, and so be
+      # indented too; rare enough to not deserve a fast path.
+      return _PostProcess(f'{head}\n{text}\n{fence}',
+                          backtickify=False,
+                          indent=indent,
+                          indented=indented,
+                          decomentify=decomentify,
+                          _ctx=_ctx)
+
+  if not indent_str and indented_str is None:
+    if head is not None and fence is not None:
+      text = f'{head}\n{text}\n{fence}'
+  elif indented_str is None:
+    # Like textwrap.indent(), which keeps the line endings, and only prefixes
+    # the lines that are not blank.
+    if head is not None and fence is not None:
+      lines = [head + '\n'] + (text + '\n').splitlines(True) + [fence]
+    else:
+      lines = text.splitlines(True)
+    text = ''.join(
+        [indent_str + line if line.strip() else line for line in lines])
+  elif indent_str and _HasLineBreak(indent_str):
+    # The indentation itself would be split into lines by `indented`.
+    indented_text = _PostProcess(text,
+                                 backtickify=backtickify,
+                                 indent=indent,
+                                 indented=None,
+                                 decomentify=False,
+                                 _ctx=_ctx)
+    return _PostProcess(indented_text,
+                        backtickify=False,
+                        indent=None,
+                        indented=indented,
+                        decomentify=decomentify,
+                        _ctx=_ctx)
+  else:
+    # Like indented, which splits the lines, and joins them back with '\n'.
+    if head is not None and fence is not None:
+      lines = [head] + (text + '\n').splitlines() + [fence]
+    else:
+      lines = text.splitlines()
+    if indent_str:
+      lines = [indent_str + line if line.strip() else line for line in lines]
+    text = ('\n' + indented_str).join(lines)
+
+  if decomentify is not False:
+    assert _ctx.block_comment is not None
+    newline = '\n' if decomentify == 'nl' else ''
+    text = ''.join([
+        _ctx.block_comment.close, newline, text, newline,
+        _ctx.block_comment.open
+    ])
+  return text
@@ -5,22 +5,84 @@
 # under the MIT license or a compatible open source license. See LICENSE.md for
 # the license text.
 
+import ast
+import itertools
+import os
+import random
+import re
+import tempfile
+import textwrap
+import time
 import unittest
 from pathlib import Path
+from typing import Any, Dict, List
+from unittest import mock
 
-from .snipinate import BlockCommentStyle, _Context, path
+from jinja2 import Environment
+
+from .private.disk_cache import DiskCache
+from .private.shell_limits import ShellLimitError
+from .snipinate import (BlockCommentStyle, RenderDependencies, Snipinate,
+                        SnipinateCache, _Context, _DelimitedFile,
+                        _ExtractDelimted, _FindShellCalls, _GetTerminalSVG,
+                        _LineIndex, _OutputWindow, _PostProcess, _ShellCache,
+                        _SymbolIndex, _TerminalSVGCache, _WindowScanner, lines,
+                        path, pysignature, pysnippet, shell)
+
+
+def _MakeContext(cwd: Path, artifact_path: Path = Path('.')) -> _Context:
+  return _Context(cwd=cwd,
+                  template_file_name='-',
+                  artifact_path=artifact_path,
+                  output_base_path=artifact_path,
+                  written_files=set(),
+                  block_comment=BlockCommentStyle(open='<!--', close='-->'),
+                  skip_unchanged=False,
+                  symbol_index=_SymbolIndex(),
+                  shell_cache=_ShellCache(),
+                  terminal_svg_cache=_TerminalSVGCache(),
+                  pending_svgs=None,
+                  shell_session=None,
+                  shell_timeout=None,
+                  render_deadline=None,
+                  shell_prefetch={},
+                  dependencies=RenderDependencies(),
+                  delimited_files={},
+                  shared_shell_outputs={})
+
+
+def _Snipinate(cwd: Path, template_string: str, **kwargs) -> str:
+  """Renders template_string in cwd, which is also the output directory."""
+  kwargs = {
+      'template_file_name': '-',
+      'templates_searchpath': None,
+      'artifact_path': cwd,
+      'output_base_path': cwd,
+      **kwargs
+  }
+  return Snipinate(template_string=template_string,
+                   cwd=cwd,
+                   template_args={},
+                   block_comment=BlockCommentStyle(open='<!--', close='-->'),
+                   warning_header='',
+                   **kwargs)
+
+
+class _TmpDirTestCase(unittest.TestCase):
+  """Runs each test in a new temporary directory, self.cwd."""
+
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self.cwd = Path(self._tmp_dir.name)
+
+  def tearDown(self):
+    self._tmp_dir.cleanup()
 
 
 class SnipinateTest(unittest.TestCase):
 
   def _MakeContext(self):
-    return _Context(cwd=Path.cwd(),
-                    template_file_name='-',
-                    artifact_path=Path('.'),
-                    output_base_path=Path('.'),
-                    written_files=set(),
-                    block_comment=BlockCommentStyle(open='<!--', close='-->'),
-                    skip_unchanged=False)
+    return _MakeContext(Path.cwd())
 
   def test_path(self):
     self.assertEqual('snipinator/snipinate.py',
@@ -33,5 +95,692 @@ class SnipinateTest(unittest.TestCase):
                       _ctx=self._MakeContext())
 
 
+class SymbolIndexTest(_TmpDirTestCase):
+
+  def setUp(self):
+    super().setUp()
+    (self.cwd / 'code.py').write_text(
+        textwrap.dedent('''\
+        X = Y = 1
+
+
+        class Outer:
+          """Outer docstring."""
+
+          class Inner:
+
+            def method(self):
+              """Method docstring."""
+              return 1
+
+
+        class Outer:
+
+          def other(self):
+            pass
+        '''))
+    self.ctx = _MakeContext(self.cwd, artifact_path=self.cwd)
+
+  def test_qualified_names(self):
+    self.assertEqual('X = Y = 1', pysnippet('code.py', 'Y', _ctx=self.ctx))
+    self.assertEqual(
+        '    def method(self):\n'
+        '      """Method docstring."""\n'
+        '      return 1',
+        pysnippet('code.py', 'Outer.Inner.method', _ctx=self.ctx))
+    self.assertEqual(
+        '    def method(self):\n'
+        '      """Method docstring."""',
+        pysignature('code.py', 'Outer.Inner.method', _ctx=self.ctx))
+    # Later duplicate definitions are still searched for nested symbols.
+    self.assertEqual('  def other(self):\n    pass',
+                     pysnippet('code.py', 'Outer.other', _ctx=self.ctx))
+
+  def test_missing_symbol(self):
+    self.assertRaises(ValueError,
+                      pysnippet,
+                      'code.py',
+                      'Outer.missing',
+                      _ctx=self.ctx)
+    self.assertRaises(ValueError, pysignature, 'code.py', 'X', _ctx=self.ctx)
+
+  def test_parses_once(self):
+    with mock.patch('ast.parse', wraps=ast.parse) as parse:
+      pysnippet('code.py', 'X', _ctx=self.ctx)
+      pysnippet('code.py', 'Outer', _ctx=self.ctx)
+      pysignature('code.py', 'Outer.Inner.method', _ctx=self.ctx)
+      self.assertEqual(1, parse.call_count)
+
+  def test_invalidate(self):
+    pysnippet('code.py', 'X', _ctx=self.ctx)
+    with mock.patch('ast.parse', wraps=ast.parse) as parse:
+      self.ctx.symbol_index.Invalidate([self.cwd / 'other.py'])
+      pysnippet('code.py', 'X', _ctx=self.ctx)
+      self.assertEqual(0, parse.call_count)
+      self.ctx.symbol_index.Invalidate([self.cwd / 'code.py'])
+      pysnippet('code.py', 'X', _ctx=self.ctx)
+      self.assertEqual(1, parse.call_count)
+
+  def test_disk_cache(self):
+    disk_cache = DiskCache(self.cwd / 'cache')
+    expected = pysnippet('code.py', 'Outer.Inner.method', _ctx=self.ctx)
+    for _ in range(2):
+      # A fresh index each time, like a fresh run of the CLI.
+      ctx = self.ctx._replace(symbol_index=_SymbolIndex(disk_cache=disk_cache))
+      with mock.patch('ast.parse', wraps=ast.parse) as parse:
+        self.assertEqual(expected,
+                         pysnippet('code.py', 'Outer.Inner.method', _ctx=ctx))
+    self.assertEqual(0, parse.call_count)
+
+
+class ShellCacheTest(_TmpDirTestCase):
+
+  def setUp(self):
+    super().setUp()
+    (self.cwd / 'input.txt').write_text('1')
+    self.ctx = _MakeContext(self.cwd, artifact_path=self.cwd)
+
+  def _Shell(self, ctx: _Context, **kwargs) -> str:
+    # Prints a different number every time it is run.
+    return shell('echo "$$"', include_args=False, _ctx=ctx, **kwargs)
+
+  def test_uncached(self):
+    self.assertNotEqual(self._Shell(self.ctx), self._Shell(self.ctx))
+
+  def test_cached(self):
+    first = self._Shell(self.ctx, cache=True)
+    self.assertEqual(first, self._Shell(self.ctx, cache=True))
+    self.assertNotEqual(first, self._Shell(self.ctx))
+
+  def test_inputs(self):
+    first = self._Shell(self.ctx, cache=True, inputs=['*.txt'])
+    self.assertEqual(first, self._Shell(self.ctx, cache=True, inputs=['*.txt']))
+    (self.cwd / 'input.txt').write_text('2')
+    self.assertNotEqual(first,
+                        self._Shell(self.ctx, cache=True, inputs=['*.txt']))
+    self.assertRaises(ValueError,
+                      self._Shell,
+                      self.ctx,
+                      cache=True,
+                      inputs=['*.missing'])
+
+  def test_disk_cache(self):
+    disk_cache = DiskCache(self.cwd / 'cache')
+    outputs = [
+        self._Shell(self.ctx._replace(shell_cache=_ShellCache(disk_cache)),
+                    cache=True) for _ in range(2)
+    ]
+    self.assertEqual(outputs[0], outputs[1])
+
+
+class ShellPrefetchTest(_TmpDirTestCase):
+
+  def _Render(self, template_string: str, jobs: int) -> str:
+    return _Snipinate(self.cwd, template_string, jobs=jobs)
+
+  def test_find_shell_calls(self):
+    template_ast = Environment().parse(
+        "{{ shell('a') }}{% set b = shell('b', rich='b.svg') %}"
+        "{% if x %}{{ shell('c') }}{% endif %}"
+        "{% for i in range(2) %}{{ shell('d') }}{% endfor %}"
+        "{{ shell('e' ~ x) }}{{ shell('f', bad_arg=1) }}{{ x or shell('g') }}")
+    self.assertEqual([('raw', 'a'), ('pty', 'b')],
+                     [(call.mode, call.args)
+                      for call in _FindShellCalls(template_ast)])
+
+  def test_same_output_as_serial(self):
+    template_string = (
+        "{{ shell('echo a') }}{{ shell('echo b', include_args=False) }}"
+        "{% for i in range(2) %}{{ shell('echo ' ~ i) }}{% endfor %}"
+        "{{ shell('echo a') }}")
+    self.assertEqual(self._Render(template_string, jobs=1),
+                     self._Render(template_string, jobs=4))
+
+  def test_conditional_calls_are_not_run(self):
+    self._Render("{% if false %}{{ shell('touch ran') }}{% endif %}", jobs=4)
+    self.assertFalse((self.cwd / 'ran').exists())
+
+
+class TerminalSVGCacheTest(_TmpDirTestCase):
+
+  def _GetTerminalSVG(self, cache: _TerminalSVGCache, **kwargs) -> str:
+    kwargs = {
+        'args': 'ls',
+        'terminal_output': '\x1b[32mgreen\x1b[0m\n',
+        'cols': 40,
+        'include_args': True,
+        'bg_color': None,
+        **kwargs
+    }
+    return cache.GetTerminalSVG(**kwargs)
+
+  def test_cached(self):
+    cache = _TerminalSVGCache()
+    with mock.patch('snipinator.snipinate._GetTerminalSVG',
+                    wraps=_GetTerminalSVG) as get_terminal_svg:
+      first = self._GetTerminalSVG(cache)
+      self.assertEqual(first, self._GetTerminalSVG(cache))
+      self.assertEqual(1, get_terminal_svg.call_count)
+      self.assertNotEqual(first, self._GetTerminalSVG(cache, bg_color='black'))
+      self.assertNotEqual(first, self._GetTerminalSVG(cache,
+                                                      include_args=False))
+      self.assertEqual(3, get_terminal_svg.call_count)
+    self.assertEqual(
+        _GetTerminalSVG(args='ls',
+                        terminal_output='\x1b[32mgreen\x1b[0m\n',
+                        cols=40,
+                        include_args=True), first)
+
+  def test_disk_cache(self):
+    disk_cache = DiskCache(self.cwd)
+    first = self._GetTerminalSVG(_TerminalSVGCache(disk_cache))
+    with mock.patch('snipinator.snipinate._GetTerminalSVG',
+                    wraps=_GetTerminalSVG) as get_terminal_svg:
+      self.assertEqual(first,
+                       self._GetTerminalSVG(_TerminalSVGCache(disk_cache)))
+      self.assertEqual(0, get_terminal_svg.call_count)
+
+
+class SVGProcessesTest(_TmpDirTestCase):
+
+  def _Render(self, template_string: str, svg_processes: int) -> str:
+    return _Snipinate(self.cwd, template_string, svg_processes=svg_processes)
+
+  def test_same_as_in_place(self):
+    template_string = textwrap.dedent('''\
+        {{ shell('printf "\\\\033[32mgreen\\\\033[0m"', rich='svg') }}
+        before {{ shell('echo "<&>"', rich='img+svg', indent=2) }} after
+        {{ shell('echo "<&>"', rich='svg', escape=True, backtickify=True) }}
+        {{ shell('echo 1', rich='one.svg', rich_alt='One') }}
+        {% set svg = shell('echo 2', rich='svg', include_args=False) %}
+        {{ svg }}{{ svg }}
+        ''')
+    expected = self._Render(template_string, svg_processes=1)
+    expected_svg = (self.cwd / 'one.svg').read_text()
+    (self.cwd / 'one.svg').unlink()
+    self.assertIn('green', expected)
+    self.assertEqual(expected, self._Render(template_string, svg_processes=2))
+    self.assertEqual(expected_svg, (self.cwd / 'one.svg').read_text())
+
+  def test_changed_placeholder(self):
+    with self.assertRaisesRegex(ValueError, 'changed by the template'):
+      self._Render("{{ shell('echo 1', rich='svg') | upper }}", svg_processes=2)
+
+
+class ShellShareTest(unittest.TestCase):
+
+  def test_runs_once(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cwd = Path(tmp_dir)
+      args = ('bash -c \\\'echo run >> runs.txt;'
+              ' printf "\\\\033[32mgreen\\\\033[0m\\\\n"\\\'')
+      template_string = textwrap.dedent(f'''\
+          {{{{ shell('{args}', rich='raw', share=True) }}}}
+          {{{{ shell('{args}', rich='svg', share=True) }}}}
+          {{{{ shell('{args}', rich='img+svg', share=True) }}}}
+          ''')
+      rendered = _Snipinate(cwd, template_string)
+      self.assertEqual('run\n', (cwd / 'runs.txt').read_text())
+      self.assertEqual('green', rendered.split('\n')[1], rendered)
+      self.assertIn('<svg', rendered)
+      self.assertNotIn('\033', rendered)
+
+  def test_not_shared_across_cache(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cwd = Path(tmp_dir)
+      args = 'bash -c \\\'echo run >> runs.txt; echo ok\\\''
+      template_string = textwrap.dedent(f'''\
+          {{{{ shell('{args}', rich='raw', share=True, cache=False) }}}}
+          {{{{ shell('{args}', rich='raw', share=True, cache=True) }}}}
+          ''')
+      dependencies = RenderDependencies()
+      _Snipinate(cwd, template_string, dependencies=dependencies)
+      self.assertEqual('run\nrun\n', (cwd / 'runs.txt').read_text())
+      self.assertEqual(1, len(dependencies.shell_calls))
+      self.assertEqual(1, len(dependencies.volatile_reasons))
+
+
+class ShellSessionTest(unittest.TestCase):
+
+  def test_same_as_without(self):
+    template_string = textwrap.dedent('''\
+        {{ shell('echo 1; cd /; export X=2', backtickify='bash') }}
+        {{ shell('pwd; echo "[$X]"', include_args=False) }}
+        {% for i in range(3) %}{{ shell('echo ' ~ i ~ ' >&2') }}{% endfor %}
+        {{ shell('printf "\\\\033[32mgreen\\\\033[0m"', rich='svg') }}
+        ''')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cwd = Path(tmp_dir)
+
+      def _Render(shell_session: bool, jobs: int) -> str:
+        return _Snipinate(cwd,
+                          template_string,
+                          jobs=jobs,
+                          shell_session=shell_session)
+
+      expected = _Render(shell_session=False, jobs=1)
+      self.assertIn('[]', expected)
+      self.assertEqual(expected, _Render(shell_session=True, jobs=1))
+      self.assertEqual(expected, _Render(shell_session=True, jobs=4))
+
+
+def _ExtractOrError(**kwargs) -> str:
+  try:
+    return _ExtractDelimted(name='output', **kwargs)
+  except ValueError as e:
+    return f'ValueError: {e}'
+
+
+class WindowScannerTest(unittest.TestCase):
+
+  def _Scan(self, window: _OutputWindow, chunks: List[str]) -> str:
+    scanner = _WindowScanner(window)
+    try:
+      for chunk in chunks:
+        if scanner.Feed(chunk):
+          return scanner.Window()
+      return scanner.Finish()
+    except ValueError as e:
+      return f'ValueError: {e}'
+
+  def test_same_as_extract(self):
+    rng = random.Random(0)
+    windows = [
+        _OutputWindow(start='<<', end='>>', regex=False),
+        _OutputWindow(start=None, end='>>', regex=False),
+        _OutputWindow(start='a\nb', end='\n\n', regex=False),
+        _OutputWindow(start=r'<+', end=r'>+|z', regex=True),
+        _OutputWindow(start=r'A+', end=r'B', regex='IGNORECASE'),
+        _OutputWindow(start=None, end=r'[>z]', regex=True),
+        _OutputWindow(start=r'^a', end=r'z$', regex=True),
+        _OutputWindow(start=r'\A<', end=r'^b', regex=True),
+        _OutputWindow(start=r'^b$', end=r'^z|>$', regex='MULTILINE'),
+        _OutputWindow(start=r'(?<=a)b', end=r'(?<!<)>', regex=True),
+        _OutputWindow(start=r'a\Z', end=r'>\Z', regex=True),
+    ]
+    for _ in range(2000):
+      text = ''.join(
+          rng.choice(['<', '<<', '>', '>>', 'a', 'b', 'z', '\n', 'xyz '])
+          for _ in range(rng.randint(0, 30)))
+      cuts = sorted(rng.sample(range(len(text) + 1), min(len(text), 4)))
+      chunks = [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+      for window in windows:
+        self.assertEqual(
+            _ExtractOrError(text=text,
+                            start=window.start,
+                            end=window.end,
+                            regex=window.regex), self._Scan(window, chunks),
+            (window, chunks))
+
+  def test_anchors(self):
+    window = _OutputWindow(start='START', end='y$', regex=True)
+    text = 'START\nxy\nzy\nw'
+    for chunks in [[text], ['START\nxy\n', 'zy\nw'], list(text)]:
+      self.assertEqual('ValueError: End delimiter "y$" not found in output',
+                       self._Scan(window, chunks), chunks)
+    window = _OutputWindow(start='^START', end='y$', regex='MULTILINE')
+    text = 'x START\nSTART\nxy\nzy\nw'
+    for chunks in [[text], ['x START\nST', 'ART\nxy\n', 'zy\nw'], list(text)]:
+      self.assertEqual('\nx', self._Scan(window, chunks), chunks)
+
+  def test_stops_early(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cwd = Path(tmp_dir)
+      for rich in ['raw', 'svg']:
+        start = time.monotonic()
+        rendered = _Snipinate(
+            cwd, '{{ shell("sh -c \'echo 1; echo START; echo 2; echo END;'
+            ' while true; do echo 3; done\'", start="START", end="END",'
+            ' stop_at_end=True, include_args=False, rich="%s") }}' % rich)
+        self.assertLess(time.monotonic() - start, 5)
+        if rich == 'raw':
+          self.assertEqual('\n2\n', rendered)
+        else:
+          self.assertIn('>2</text>', rendered)
+          self.assertNotIn('>3</text>', rendered)
+
+  def test_invalid(self):
+    ctx = _MakeContext(Path('.'))
+    with self.assertRaisesRegex(ValueError, 'requires an end delimiter'):
+      shell('echo 1', start='1', stop_at_end=True, _ctx=ctx)
+    with self.assertRaisesRegex(ValueError, 'cannot be used with share'):
+      shell('echo 1', end='1', stop_at_end=True, share=True, _ctx=ctx)
+
+
+class ShellLimitsTest(_TmpDirTestCase):
+
+  def _Render(self, template_string: str, **kwargs) -> str:
+    return _Snipinate(self.cwd,
+                      template_string,
+                      template_file_name=Path('README.md.jinja2'),
+                      **kwargs)
+
+  def test_timeout(self):
+    for rich in ['raw', 'svg']:
+      for shell_session in [False, True]:
+        start = time.monotonic()
+        # The subprocesses of the command are killed too.
+        with self.assertRaisesRegex(
+            ShellLimitError, r'^Command "sh -c \'sleep 10 & wait\'" timed out'
+            r' after 0.2s, in template README.md.jinja2:2$'):
+          self._Render('\n{{ shell("sh -c \'sleep 10 & wait\'", rich="%s",'
+                       ' timeout=0.2) }}' % rich,
+                       shell_session=shell_session)
+        self.assertLess(time.monotonic() - start, 5)
+
+  def test_shell_timeout(self):
+    with self.assertRaisesRegex(ShellLimitError, 'timed out after 0.2s'):
+      self._Render("{{ shell('sleep 10') }}", shell_timeout=0.2)
+    self.assertEqual(
+        '$ echo 1\n1\n',
+        self._Render("{{ shell('echo 1', timeout=10) }}", shell_timeout=0.01))
+
+  def test_max_output_bytes(self):
+    for rich in ['raw', 'svg']:
+      for shell_session in [False, True]:
+        with self.assertRaisesRegex(ShellLimitError,
+                                    'wrote more than 1000 bytes of output'):
+          self._Render("{{ shell('yes', rich='%s', max_output_bytes=1000) }}" %
+                       rich,
+                       shell_session=shell_session)
+        self.assertEqual(
+            '1234\n',
+            self._Render(
+                "{{ shell('echo 1234', max_output_bytes=5,"
+                " include_args=False) }}",
+                shell_session=shell_session))
+
+  def test_render_budget(self):
+    with self.assertRaisesRegex(ShellLimitError,
+                                'ran out of the render budget'):
+      self._Render("{{ shell('sleep 0.2') }}{{ shell('sleep 10') }}",
+                   render_budget=0.5,
+                   jobs=2)
+
+
+class TemplateCacheTest(_TmpDirTestCase):
+
+  def setUp(self):
+    super().setUp()
+    (self.cwd / 'templates').mkdir()
+    (self.cwd / 'templates' /
+     'header.jinja2').write_text("header {{ rawsnippet('input.txt') }}")
+    (self.cwd / 'input.txt').write_text('1')
+
+  def _Render(self, cache: SnipinateCache, cwd=None, dependencies=None) -> str:
+    return _Snipinate(cwd or self.cwd,
+                      "{% include 'header.jinja2' %}, body",
+                      templates_searchpath=self.cwd / 'templates',
+                      cache=cache,
+                      dependencies=dependencies)
+
+  def test_reuses_environment(self):
+    cache = SnipinateCache()
+    header_path = self.cwd / 'templates' / 'header.jinja2'
+    with mock.patch('jinja2.Environment.compile',
+                    autospec=True,
+                    side_effect=Environment.compile) as compile_:
+      for _ in range(2):
+        dependencies = RenderDependencies()
+        self.assertEqual('header 1, body',
+                         self._Render(cache, dependencies=dependencies))
+        # Still recorded when the include is reused.
+        self.assertEqual({header_path, self.cwd / 'input.txt'},
+                         dependencies.files)
+      self.assertEqual(2, compile_.call_count)
+
+    # A changed include is reloaded.
+    header_path.write_text('new header')
+    stat = header_path.stat()
+    os.utime(header_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    self.assertEqual('new header, body', self._Render(cache))
+
+  def test_binds_functions_per_render(self):
+    cache = SnipinateCache()
+    other_cwd = self.cwd / 'other'
+    other_cwd.mkdir()
+    self._Render(cache)
+    self.assertRaises(FileNotFoundError, self._Render, cache, cwd=other_cwd)
+    (other_cwd / 'input.txt').write_text('2')
+    self.assertEqual('header 2, body', self._Render(cache, cwd=other_cwd))
+
+  def test_disk_cache(self):
+    disk_cache = DiskCache(self.cwd / 'cache')
+    self._Render(SnipinateCache(disk_cache=disk_cache))
+    with mock.patch('jinja2.Environment.compile') as compile_:
+      self.assertEqual('header 1, body',
+                       self._Render(SnipinateCache(disk_cache=disk_cache)))
+      self.assertEqual(0, compile_.call_count)
+
+
+class DelimitedFileTest(_TmpDirTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.path = self.cwd / 'input.txt'
+    # Map every file, however small.
+    patcher = mock.patch('snipinator.snipinate._MMAP_MIN_SIZE', 0)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def _AssertSameAsText(self, data: bytes, start: str, end: str, regex=False):
+    self.path.write_bytes(data)
+    try:
+      expected = _ExtractDelimted(name='input',
+                                  text=self.path.read_text(),
+                                  start=start,
+                                  end=end,
+                                  regex=regex)
+    except ValueError as e:
+      with self.assertRaisesRegex(ValueError, re.escape(str(e))):
+        self._Extract(start, end, regex)
+      return
+    self.assertEqual(expected, self._Extract(start, end, regex))
+
+  def _Extract(self, start: str, end: str, regex, occurrence: int = 0) -> str:
+    return _DelimitedFile(self.path).Extract(name='input',
+                                             start=start,
+                                             end=end,
+                                             regex=regex,
+                                             occurrence=occurrence)
+
+  def test_literal(self):
+    data = 'a ▶ b\nSTART ünï\ncödé END c END'.encode()
+    self._AssertSameAsText(data, 'START', 'END')
+    self._AssertSameAsText(data, '▶', 'ü')
+    self._AssertSameAsText(data, 'END', 'END')
+    self._AssertSameAsText(data, 'START', 'missing')
+    self._AssertSameAsText(data, 'missing', 'END')
+    self._AssertSameAsText(b'', 'START', 'END')
+
+  def test_regex(self):
+    data = b'x\n# START\n1\n2\n# END\n'
+    self._AssertSameAsText(data, r'#\s*START\n', r'#\s*END', regex=True)
+    # Anchors match at the start of the text after the start delimiter.
+    self._AssertSameAsText(data, r'START\n', r'^\d', regex=True)
+    self._AssertSameAsText(data, r'START\n', r'(?<=\n)\d', regex=True)
+    self._AssertSameAsText(data,
+                           r'start\n',
+                           r'^# end',
+                           regex='IGNORECASE|MULTILINE')
+    self._AssertSameAsText(data, r'START', r'missing', regex=True)
+    # Not ASCII, so searched as text instead.
+    self._AssertSameAsText('é\nSTART\\w+END'.encode(),
+                           r'START\n',
+                           r'\w+',
+                           regex=True)
+
+  def test_newlines(self):
+    # Reading the text translates newlines, so these are searched as text.
+    self._AssertSameAsText(b'a\r\nSTART\r\nb\r\nEND', 'START\n', '\nEND')
+    self._AssertSameAsText(b'a\rSTART\rb\rEND', 'START\n', '\nEND')
+    # These are searched mapped, and the snippet's newlines translated.
+    self._AssertSameAsText(b'a\r\nSTART\r\nb\rc\r\nEND', 'START', 'END')
+    self._AssertSameAsText(b'START\r\r\nEND', 'START', 'END')
+
+  def test_scans_only_if_needed(self):
+    self.path.write_bytes(b'START\n1\nEND')
+    with mock.patch.object(_DelimitedFile,
+                           '_Scan',
+                           autospec=True,
+                           side_effect=_DelimitedFile._Scan) as scan:
+      self.assertEqual('\n1\n', self._Extract('START', 'END', False))
+      scan.assert_not_called()
+      self.assertEqual('1', self._Extract('START\n', '\nEND', False))
+      scan.assert_called()
+
+  def test_occurrences(self):
+    for min_size in [0, 1 << 30]:
+      with mock.patch('snipinator.snipinate._MMAP_MIN_SIZE', min_size):
+        self.path.write_text('[a] [bb] [ccc] [[d]]')
+        self.assertEqual(['a', 'bb', 'ccc', '[d', 'd'],
+                         [self._Extract('[', ']', False, i) for i in range(5)])
+        self.assertEqual('d', self._Extract('[', ']', False, -1))
+        self.assertEqual('a', self._Extract('[', ']', False, -5))
+        # Overlapping, like str.find().
+        self.assertEqual('d', self._Extract('[[', ']', False, 0))
+        # Non-overlapping, like re.finditer().
+        self.assertEqual('d', self._Extract(r'\[+', r'\]', True, 3))
+        self.assertEqual('ccc', self._Extract(r'\w\] \[', r'\]', True, 1))
+        with self.assertRaisesRegex(ValueError, r'\(occurrence 5\)'):
+          self._Extract('[', ']', False, 5)
+        with self.assertRaisesRegex(ValueError, r'\(occurrence -6\)'):
+          self._Extract('[', ']', False, -6)
+
+  def test_reads_once(self):
+    self.path.write_text('<1>a</1><2>b</2>')
+    template_string = ("{{ snippet('input.txt', '<1>', '</1>') }}"
+                       "{{ snippet('input.txt', '<2>', '</2>') }}"
+                       "{{ snippet('./input.txt', '<2>', '</2>') }}")
+    with mock.patch('pathlib.Path.read_text',
+                    autospec=True,
+                    side_effect=Path.read_text) as read_text, mock.patch(
+                        'snipinator.snipinate._MMAP_MIN_SIZE', 1 << 30):
+      rendered = _Snipinate(self.cwd, template_string)
+    self.assertEqual('abb', rendered)
+    self.assertEqual(1, read_text.call_count)
+
+
+class LineIndexTest(unittest.TestCase):
+
+  def test_same_as_splitlines(self):
+    rng = random.Random(0)
+    # Each alphabet takes a different path through _LineIndex().
+    alphabets = [['a', ' ', '\n', '\r', '\r\n', '\x0c', '\u2028'],
+                 ['a', '\n', '\r\n'], ['a', '\r']]
+    texts = ['', 'a', '\n', '\n\n', 'a\nb', 'a\nb\n'] + [
+        ''.join(rng.choice(alphabet)
+                for _ in range(rng.randint(1, 20)))
+        for alphabet in alphabets
+        for _ in range(100)
+    ]
+    for text in texts:
+      line_index = _LineIndex(text)
+      text_lines = text.splitlines()
+      self.assertEqual(len(text_lines), len(line_index))
+      for start_index in range(len(text_lines) + 2):
+        for end_index in range(len(text_lines) + 2):
+          self.assertEqual('\n'.join(text_lines[start_index:end_index]),
+                           line_index.Slice(start_index, end_index),
+                           f'{text!r}[{start_index}:{end_index}]')
+
+  def test_lines(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cwd = Path(tmp_dir)
+      (cwd / 'input.txt').write_text('1\n2\n3\n')
+      ctx = _MakeContext(cwd, artifact_path=cwd)
+      self.assertEqual('1', lines('input.txt', 1, 1, _ctx=ctx))
+      self.assertEqual('2\n3', lines('input.txt', 2, 3, _ctx=ctx))
+      self.assertEqual('  1\n  2', lines('input.txt', 1, 2, indent=2, _ctx=ctx))
+      for start, end in [(0, 1), (2, 1), (3, 4)]:
+        with self.assertRaisesRegex(ValueError, 'has 3 lines'):
+          lines('input.txt', start, end, _ctx=ctx)
+
+  def test_shared_with_symbols(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cwd = Path(tmp_dir)
+      (cwd / 'code.py').write_text('X = 1\nY = 2\n')
+      ctx = _MakeContext(cwd, artifact_path=cwd)
+      with mock.patch('pathlib.Path.read_text',
+                      autospec=True,
+                      side_effect=Path.read_text) as read_text:
+        self.assertEqual('Y = 2', lines('code.py', 2, 2, _ctx=ctx))
+        self.assertEqual('X = 1', pysnippet('code.py', 'X', _ctx=ctx))
+        self.assertEqual('X = 1', lines('./code.py', 1, 1, _ctx=ctx))
+      self.assertEqual(1, read_text.call_count)
+
+
+def _ReferencePostProcess(text, *, backtickify, indent, indented, decomentify,
+                          _ctx):
+  """The original, step by step, post-processing, that _PostProcess fuses."""
+  if backtickify is not False:
+    count = 0
+    for backticks in range(1, len(text)):
+      if '`' * backticks not in text:
+        count = backticks - 1
+        break
+    bt_str = '`' * max(3, count + 1)
+    text = f'{bt_str}{"" if backtickify is True else backtickify}\n{text}\n{bt_str}'
+  if indent is not None:
+    text = textwrap.indent(text,
+                           ' ' * indent if isinstance(indent, int) else indent)
+  if indented is not None:
+    indent_str = ' ' * indented if isinstance(indented, int) else indented
+    lines = text.splitlines()
+    text = '\n'.join([lines[0]] + [indent_str + line for line in lines[1:]])
+  if decomentify is not False:
+    if decomentify == 'nl':
+      text = f'\n{text}\n'
+    text = _ctx.block_comment.close + text + _ctx.block_comment.open
+  return text
+
+
+class PostProcessTest(unittest.TestCase):
+
+  def test_same_as_reference(self):
+    ctx = _MakeContext(Path.cwd())
+    rng = random.Random(0)
+    alphabet = [
+        'a', ' ', '\t', '`', '```', '\n', '\r', '\r\n', '\x0c', '\u2028'
+    ]
+    texts = ['', 'a', '\n', 'a\n', ' \n\na\n '] + [
+        ''.join(rng.choice(alphabet)
+                for _ in range(rng.randint(1, 20)))
+        for _ in range(200)
+    ]
+    options = itertools.product([False, True, 'py', 'a\nb'],
+                                [None, 0, 2, '> ', 'x\ry'],
+                                [None, 0, 2, '| ', '\n'], [False, True, 'nl'])
+    for backtickify, indent, indented, decomentify in options:
+      for text in texts:
+        if indented is not None and not text and backtickify is False:
+          # The reference fails on empty text.
+          continue
+        # The reference miscounts backticks when the longest run is almost the
+        # whole text, e.g "a``".
+        longest = max(map(len, re.findall('`+', text)), default=0)
+        if backtickify is not False and longest >= max(1, len(text) - 1):
+          continue
+        kwargs: Dict[str, Any] = dict(backtickify=backtickify,
+                                      indent=indent,
+                                      indented=indented,
+                                      decomentify=decomentify,
+                                      _ctx=ctx)
+        self.assertEqual(_ReferencePostProcess(text, **kwargs),
+                         _PostProcess(text, **kwargs),
+                         f'text={text!r}, {kwargs}')
+
+  def test_backticks(self):
+    ctx = _MakeContext(Path.cwd())
+    self.assertEqual(
+        '````\n```\n````',
+        _PostProcess('```',
+                     backtickify=True,
+                     indent=None,
+                     indented=None,
+                     decomentify=False,
+                     _ctx=ctx))
+
+
 if __name__ == '__main__':
   unittest.main()